@@ -0,0 +1,62 @@
+-- Compare storage and query time of nelson_book_contents with the halfvec,
+-- partitioned layout. Run it after migrate_to_halfvec.sql, on a warm cache
+-- (run twice and keep the second result).
+-- Usage: psql "$DATABASE_URL" -f measure_layout.sql
+
+-- Storage: heap, TOAST and indexes; partitioned tables are summed over partitions
+select 'nelson_book_contents' as relation,
+       pg_size_pretty(pg_relation_size('public.nelson_book_contents')) as heap,
+       pg_size_pretty(pg_total_relation_size('public.nelson_book_contents')
+                      - pg_relation_size('public.nelson_book_contents')
+                      - pg_indexes_size('public.nelson_book_contents')) as toast,
+       pg_size_pretty(pg_indexes_size('public.nelson_book_contents')) as indexes,
+       pg_size_pretty(pg_total_relation_size('public.nelson_book_contents')) as total
+union all
+select 'nelson_book_chunks',
+       pg_size_pretty(sum(pg_relation_size(relid))),
+       pg_size_pretty(sum(pg_total_relation_size(relid) - pg_relation_size(relid) - pg_indexes_size(relid))),
+       pg_size_pretty(sum(pg_indexes_size(relid))),
+       pg_size_pretty(sum(pg_total_relation_size(relid)))
+from pg_partition_tree('public.nelson_book_chunks')
+union all
+select 'nelson_book_chunk_contents',
+       pg_size_pretty(pg_relation_size('public.nelson_book_chunk_contents')),
+       pg_size_pretty(pg_total_relation_size('public.nelson_book_chunk_contents')
+                      - pg_relation_size('public.nelson_book_chunk_contents')
+                      - pg_indexes_size('public.nelson_book_chunk_contents')),
+       pg_size_pretty(pg_indexes_size('public.nelson_book_chunk_contents')),
+       pg_size_pretty(pg_total_relation_size('public.nelson_book_chunk_contents'));
+
+-- Average stored embedding size per row
+select (select avg(pg_column_size(embedding)) from public.nelson_book_contents) as vector_bytes,
+       (select avg(pg_column_size(embedding)) from public.nelson_book_chunks) as halfvec_bytes;
+
+-- Query time: an existing embedding as the query vector, and its book for a scoped search
+select embedding::text as query_embedding, coalesce(title, '') as query_book
+from public.nelson_book_contents
+where embedding is not null
+order by id
+limit 1 \gset
+
+explain (analyze, buffers)
+select id from public.nelson_book_contents
+order by embedding <=> :'query_embedding'::vector
+limit 10;
+
+explain (analyze, buffers)
+select id from public.nelson_book_chunks
+order by embedding <=> :'query_embedding'::halfvec(1536)
+limit 10;
+
+-- Book-scoped: the partitioned layout scans a single partition
+explain (analyze, buffers)
+select id from public.nelson_book_contents
+where title = :'query_book'
+order by embedding <=> :'query_embedding'::vector
+limit 10;
+
+explain (analyze, buffers)
+select id from public.nelson_book_chunks
+where title = :'query_book'
+order by embedding <=> :'query_embedding'::halfvec(1536)
+limit 10;
@@ -0,0 +1,39 @@
+-- Copy nelson_book_contents into the halfvec, partitioned layout created by
+-- pgvector_setup.sql. The original table is left untouched, so readers can be
+-- switched over (and back) by changing the table they query.
+-- Usage: psql "$DATABASE_URL" -f pgvector_setup.sql -f migrate_to_halfvec.sql
+
+-- Building HNSW once after the copy is much faster than maintaining it per row
+set maintenance_work_mem = '1GB';
+drop index if exists public.nelson_book_chunks_embedding_idx;
+
+begin;
+
+insert into public.nelson_book_chunks
+  (id, meta, index_path, title, topic, subtopic, summary, chunk_no, embedding, created_at, updated_at)
+select id, meta, index_path, coalesce(title, ''), topic, subtopic, summary, chunk_no,
+       embedding::halfvec(1536), created_at, updated_at
+from public.nelson_book_contents
+on conflict do nothing;
+
+insert into public.nelson_book_chunk_contents (title, id, content)
+select coalesce(title, ''), id, content
+from public.nelson_book_contents
+on conflict do nothing;
+
+-- New rows continue after the copied ids
+select setval('public.nelson_book_chunks_id_seq',
+              greatest((select max(id) from public.nelson_book_chunks), 1));
+
+commit;
+
+create index if not exists nelson_book_chunks_embedding_idx
+  on public.nelson_book_chunks using hnsw (embedding halfvec_cosine_ops);
+
+analyze public.nelson_book_chunks;
+analyze public.nelson_book_chunk_contents;
+
+-- Row counts must match before switching readers
+select (select count(*) from public.nelson_book_contents) as source_rows,
+       (select count(*) from public.nelson_book_chunks) as chunk_rows,
+       (select count(*) from public.nelson_book_chunk_contents) as content_rows;
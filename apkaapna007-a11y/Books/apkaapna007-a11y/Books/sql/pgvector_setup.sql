@@ -22,6 +22,84 @@ create table if not exists public.nelson_book_contents (
 alter table public.nelson_book_contents
   add column if not exists embedding vector(1536);
 
+-- Incremental sync (nelson_db_sync.py): stable chunk key and content hash,
+-- so a reload only writes the chunks whose text changed
+alter table public.nelson_book_contents
+  add column if not exists sync_key text,
+  add column if not exists content_hash text;
+
+create unique index if not exists nelson_book_contents_sync_key_idx
+  on public.nelson_book_contents (sync_key);
+
+-- Full-text search: weighted tsvector over title, summary and content,
+-- maintained by Postgres on every write
+alter table public.nelson_book_contents
+  add column if not exists search_tsv tsvector
+  generated always as (
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(summary, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(content, '')), 'C')
+  ) stored;
+
+create index if not exists nelson_book_contents_search_idx
+  on public.nelson_book_contents using gin (search_tsv);
+
+-- Hybrid search in one query: the best candidate_count rows by vector
+-- distance and by text rank are pooled, then every pooled row is scored as
+-- text_weight * ts_rank_cd + vector_weight * cosine similarity. Rank
+-- normalisation 32 maps ts_rank_cd into [0, 1) so the two weights compare.
+create or replace function public.hybrid_search_nelson_book_contents(
+  query_text text,
+  query_embedding vector(1536),
+  match_count int default 10,
+  text_weight float default 0.5,
+  vector_weight float default 0.5,
+  candidate_count int default 50
+)
+returns table (
+  id bigint,
+  title text,
+  topic text,
+  subtopic text,
+  summary text,
+  content text,
+  text_rank float,
+  similarity float,
+  score float
+)
+language sql stable
+as $$
+  with query as (
+    select websearch_to_tsquery('english', query_text) as tsq
+  ),
+  candidates as (
+    (select c.id
+     from public.nelson_book_contents c
+     where c.embedding is not null
+     order by c.embedding <=> query_embedding
+     limit candidate_count)
+    union
+    (select c.id
+     from public.nelson_book_contents c, query q
+     where c.search_tsv @@ q.tsq
+     order by ts_rank_cd(c.search_tsv, q.tsq, 32) desc
+     limit candidate_count)
+  ),
+  scored as (
+    select c.id, c.title, c.topic, c.subtopic, c.summary, c.content,
+           ts_rank_cd(c.search_tsv, q.tsq, 32)::float as text_rank,
+           coalesce(1 - (c.embedding <=> query_embedding), 0)::float as similarity
+    from candidates k
+    join public.nelson_book_contents c on c.id = k.id
+    cross join query q
+  )
+  select s.id, s.title, s.topic, s.subtopic, s.summary, s.content, s.text_rank, s.similarity,
+         text_weight * s.text_rank + vector_weight * s.similarity as score
+  from scored s
+  order by score desc
+  limit match_count;
+$$;
+
 -- Trigger to auto-update updated_at
 do $$ begin
   if not exists (
@@ -31,3 +109,72 @@ do $$ begin
     for each row execute procedure moddatetime (updated_at);
   end if;
 end $$;
+
+-- ---------------------------------------------------------------------------
+-- Alternative layout: halfvec embeddings, partitioned by book, content apart
+-- ---------------------------------------------------------------------------
+-- halfvec (pgvector >= 0.7.0) stores 2 bytes per dimension: 3,080 bytes per
+-- 1536-d embedding instead of 6,152. Rows are hash-partitioned on title (the
+-- source book), so book-scoped queries prune to one partition and each
+-- partition gets its own, smaller HNSW index. Hash rather than list
+-- partitioning means a new book needs no DDL. The bulky content text lives in
+-- nelson_book_chunk_contents so vector scans never read it.
+-- Copy existing rows over with migrate_to_halfvec.sql; compare the two
+-- layouts with measure_layout.sql.
+
+-- Identity columns on partitioned tables need Postgres 17, so use a sequence
+create sequence if not exists public.nelson_book_chunks_id_seq;
+
+create table if not exists public.nelson_book_chunks (
+  id bigint not null default nextval('public.nelson_book_chunks_id_seq'),
+  meta jsonb,
+  index_path text,
+  title text not null default '',
+  topic text,
+  subtopic text,
+  summary text,
+  chunk_no int,
+  embedding halfvec(1536),
+  created_at timestamptz default now(),
+  updated_at timestamptz default now(),
+  primary key (title, id)
+) partition by hash (title);
+
+alter sequence public.nelson_book_chunks_id_seq owned by public.nelson_book_chunks.id;
+
+do $$ begin
+  for i in 0..7 loop
+    execute format(
+      'create table if not exists public.nelson_book_chunks_p%s '
+      'partition of public.nelson_book_chunks for values with (modulus 8, remainder %s)', i, i);
+  end loop;
+end $$;
+
+create table if not exists public.nelson_book_chunk_contents (
+  title text not null,
+  id bigint not null,
+  content text,
+  primary key (title, id),
+  foreign key (title, id) references public.nelson_book_chunks (title, id) on delete cascade
+);
+
+-- Created on the parent, built per partition
+create index if not exists nelson_book_chunks_embedding_idx
+  on public.nelson_book_chunks using hnsw (embedding halfvec_cosine_ops);
+
+do $$ begin
+  if not exists (
+    select 1 from pg_trigger
+    where tgname = 'handle_updated_at' and tgrelid = 'public.nelson_book_chunks'::regclass) then
+    create trigger handle_updated_at
+    before update on public.nelson_book_chunks
+    for each row execute procedure moddatetime (updated_at);
+  end if;
+end $$;
+
+-- Same columns as nelson_book_contents for readers that need the text
+create or replace view public.nelson_book_chunks_with_content as
+  select c.id, c.meta, c.index_path, c.title, c.topic, c.subtopic, t.content, c.summary,
+         c.chunk_no, c.embedding, c.created_at, c.updated_at
+  from public.nelson_book_chunks c
+  left join public.nelson_book_chunk_contents t using (title, id);
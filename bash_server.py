@@ -4,17 +4,22 @@ FastAPI server providing Bash and File tool endpoints
 """
 
 import asyncio
+import codecs
+import fcntl
 import os
 import re
 import base64
+import struct
+import termios
 import shutil
 import inspect
+import itertools
 import aiofiles
 import aiofiles.os
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 from dataclasses import dataclass, fields, replace
-from typing import Any, ClassVar, Dict, List, Literal, Optional, get_args
+from typing import Any, ClassVar, Dict, List, Literal, Optional, Tuple, get_args
 
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
@@ -44,6 +49,9 @@ EXCLUDED_PATTERNS = [
     "README.rst"
 ]
 
+# Workspace directory (hidden, so not listed or served) for command output that outgrows memory
+OUTPUT_SPILL_DIR = ".bash_output"
+
 
 def _is_excluded_path(path: Path) -> bool:
     """Check if a path should be excluded from serving/listing."""
@@ -100,6 +108,12 @@ class ToolResult:
     error: str | None = None
     base64_image: str | None = None
     system: str | None = None
+    output_file: str | None = None
+    error_file: str | None = None
+    next_offset: int | None = None
+    next_error_offset: int | None = None
+    command_number: int | None = None
+    exit_code: int | None = None
 
     def __bool__(self):
         return any(getattr(self, field.name) for field in fields(self))
@@ -119,6 +133,12 @@ class ToolResult:
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
             system=combine_fields(self.system, other.system),
+            output_file=combine_fields(self.output_file, other.output_file, False),
+            error_file=combine_fields(self.error_file, other.error_file, False),
+            next_offset=combine_fields(self.next_offset, other.next_offset, False),
+            next_error_offset=combine_fields(self.next_error_offset, other.next_error_offset, False),
+            command_number=combine_fields(self.command_number, other.command_number, False),
+            exit_code=combine_fields(self.exit_code, other.exit_code, False),
         )
 
     def replace(self, **kwargs):
@@ -153,6 +173,207 @@ class BaseAnthropicTool(metaclass=ABCMeta):
 
 
 # Bash Session implementation
+class _OutputBuffer:
+    """Bounded capture of one output stream of one command.
+
+    The first ``head_size`` bytes and the most recent ``ring_size`` bytes are
+    kept in memory, the latter in a fixed-size ring. Once the output outgrows
+    the ring it is also appended to ``spill_path``, so the full output stays
+    available on disk while memory use stays constant.
+    """
+
+    def __init__(self, spill_path: Path, ring_size: int, head_size: int):
+        self.spill_path = spill_path
+        self.size = 0
+        self.spill_error: str | None = None
+        self._ring_size = ring_size
+        self._ring = bytearray()
+        self._head = bytearray()
+        self._head_size = head_size
+        self._spill = None
+
+    @property
+    def spilled(self) -> bool:
+        return self.size > self._ring_size
+
+    def write(self, data: bytes):
+        """Append bytes read from the pipe."""
+        if not data:
+            return
+        if len(self._head) < self._head_size:
+            self._head += data[:self._head_size - len(self._head)]
+        if self.size + len(data) > self._ring_size and self._spill is None and self.spill_error is None:
+            self._start_spill()
+        if self._spill is not None:
+            # Writes go to the page cache; one pipe read (at most 256 KiB) takes
+            # microseconds, less than handing it to a thread would cost
+            try:
+                self._spill.write(data)
+            except OSError as e:
+                self._stop_spill(e)
+
+        if self.size + len(data) <= self._ring_size:
+            # The ring only grows to full size for output that needs it
+            self._ring += data
+        else:
+            if len(self._ring) < self._ring_size:
+                self._ring.extend(bytes(self._ring_size - len(self._ring)))
+            kept = memoryview(data)[max(len(data) - self._ring_size, 0):]
+            start = (self.size + len(data) - len(kept)) % self._ring_size
+            first = min(len(kept), self._ring_size - start)
+            self._ring[start:start + first] = kept[:first]
+            self._ring[:len(kept) - first] = kept[first:]
+        self.size += len(data)
+
+    def _start_spill(self):
+        try:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            self._spill = open(self.spill_path, "wb")
+            # The ring has not wrapped yet, so it still holds everything so far
+            self._spill.write(self._ring)
+        except OSError as e:
+            self._stop_spill(e)
+
+    def _stop_spill(self, error: OSError):
+        self.spill_error = str(error)
+        self.close()
+
+    def _from_ring(self, start: int, end: int) -> bytes:
+        """Bytes [start, end) of the output; start must still be within the ring."""
+        if end <= start:
+            return b""
+        if not self.spilled:
+            return bytes(self._ring[start:end])
+        first = start % self._ring_size
+        last = first + end - start
+        if last <= self._ring_size:
+            return bytes(self._ring[first:last])
+        return bytes(self._ring[first:]) + bytes(self._ring[:last - self._ring_size])
+
+    async def read(self, offset: int, limit: int) -> Tuple[int, bytes]:
+        """Up to ``limit`` bytes from ``offset`` on, as ``(start, data)``.
+
+        Bytes still in the ring come from memory, older ones from the spill
+        file. ``start`` is past ``offset`` only if the bytes in between were
+        lost because the spill file could not be written.
+        """
+        offset = max(0, min(offset, self.size))
+        ring_start = self.size - min(self.size, self._ring_size)
+        if offset < ring_start and self.spill_error is not None:
+            offset = ring_start
+        end = min(self.size, offset + limit)
+        if offset >= ring_start:
+            return offset, self._from_ring(offset, end)
+        if self._spill is not None:
+            self._spill.flush()
+        async with aiofiles.open(self.spill_path, "rb") as f:
+            await f.seek(offset)
+            return offset, await f.read(end - offset)
+
+    def text(self, excerpt_size: int) -> str:
+        """The whole output if it fits in the ring, otherwise its head and tail around an omission note."""
+        if not self.spilled:
+            return self._ring.decode(errors="replace")
+        head = bytes(self._head[:excerpt_size])
+        tail = self._from_ring(self.size - min(excerpt_size, self._ring_size), self.size)
+        omitted = self.size - len(head) - len(tail)
+        if self.spill_error is None:
+            note = f"full output in {self.spill_path}"
+        else:
+            note = f"full output could not be saved: {self.spill_error}"
+        return (f"{head.decode(errors='replace')}\n[... {omitted} bytes omitted; {note} ...]\n"
+                f"{tail.decode(errors='replace')}")
+
+    @property
+    def output_file(self) -> str | None:
+        """Path of the spill file holding the full output, if there is one."""
+        return str(self.spill_path) if self.spilled and self.spill_error is None else None
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+class _CommandOutput:
+    """Captured stdout and stderr of one command, and its completion and exit status."""
+
+    def __init__(self, number: int, stdout: _OutputBuffer, stderr: _OutputBuffer):
+        self.number = number
+        self.buffers = {"stdout": stdout, "stderr": stderr}
+        self.finished = asyncio.Event()
+        self.completing = False
+        self.exit_code: int | None = None
+        self.exited = False
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        """Wake everyone waiting for new output; later waiters get a fresh event."""
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    @property
+    def stdout(self) -> _OutputBuffer:
+        return self.buffers["stdout"]
+
+    @property
+    def stderr(self) -> _OutputBuffer:
+        return self.buffers["stderr"]
+
+    def close(self):
+        for buffer in self.buffers.values():
+            buffer.close()
+
+
+def _complete_utf8(data: bytes) -> int:
+    """Length of *data* without a trailing incomplete UTF-8 sequence."""
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 == 0x80:
+            continue  # continuation byte
+        if byte >= 0xF0:
+            needed = 4
+        elif byte >= 0xE0:
+            needed = 3
+        elif byte >= 0xC0:
+            needed = 2
+        else:
+            needed = 1
+        return len(data) - back if needed > back else len(data)
+    return len(data)
+
+
+def _unread_bytes(fd: int) -> int:
+    """Bytes waiting in a pipe that nobody has read yet."""
+    return struct.unpack("i", fcntl.ioctl(fd, termios.FIONREAD, b"\0\0\0\0"))[0]
+
+
+class _OutputProtocol(asyncio.Protocol):
+    """Feeds one output pipe of a bash session into the session's capture."""
+
+    def __init__(self, session: "_BashSession", stream: str):
+        self._session = session
+        self._stream = stream
+
+    def data_received(self, data: bytes):
+        self._session._on_output(self._stream, data)
+
+
+class _ControlProtocol(asyncio.Protocol):
+    """Reads ``<command number> <exit status>`` lines that bash writes to the session's control pipe."""
+
+    def __init__(self, session: "_BashSession"):
+        self._session = session
+        self._partial = b""
+
+    def data_received(self, data: bytes):
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        for line in lines:
+            fields = line.split()
+            if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit():
+                self._session._on_command_exit(int(fields[0]), int(fields[1]))
+
+
 class _BashSession:
     """A session of a bash shell."""
 
@@ -160,70 +381,64 @@ class _BashSession:
     _process: asyncio.subprocess.Process
     _is_running_command: bool
     _last_command: str
-    _partial_output: str
-    _partial_error: str
+    _output: _CommandOutput | None
     _session_id: int
 
     command: str = "/bin/bash"
     _output_delay: float = 0.2
+    _drain_poll: float = 0.005
     _timeout: float = 10.0
-    _sentinel: str = "<<exit>>"
+    _output_ring_size: int = 1024 * 1024
+    _output_excerpt_size: int = 64 * 1024
+    _kept_spill_files: int = 8
+    _output_page_size: int = 256 * 1024
+    # Shared by all sessions, so a number never names two commands, even across restarts
+    _command_numbers = itertools.count(1)
+    _max_output_wait: float = 30.0
 
     def __init__(self, session_id: int):
         self._started = False
         self._is_running_command = False
         self._last_command = ""
-        self._partial_output = ""
-        self._partial_error = ""
+        self._output = None
         self._session_id = session_id
         self._process = None
+        self._pipes: List[asyncio.ReadTransport] = []
+        self._command_number = 0
+        self._spill_files: List[Path] = []
+        self._control_fd: int | None = None
+        self._output_fds: tuple = ()
+        self._tasks: set = set()
 
     @property
     def session_id(self) -> int:
         return self._session_id
-        
+
     @property
     def is_running_command(self) -> bool:
         return self._is_running_command
-        
+
     @property
     def last_command(self) -> str:
         return self._last_command
-        
+
     @property
     def current_directory(self) -> str:
         return str(WORKSPACE_DIR)
-        
+
     async def check_command_completion(self) -> bool:
         """Check if a running command has completed."""
-        if not self._is_running_command:
-            return True
-            
-        if not self._process or self._process.stdout is None:
-            self._is_running_command = False
-            return True
-            
-        try:
-            if self._process.stdout._buffer:
-                output = self._process.stdout._buffer.decode(errors="replace")
-                self._partial_output = output
-                
-                if self._sentinel in output:
-                    self._is_running_command = False
-                    return True
-        except Exception:
-            pass
-            
-        return False
+        # The control pipe updates the state when bash reports the exit status
+        return not self._is_running_command
 
     def _filter_error_output(self, error: str) -> str:
         """Filter out common error messages that don't affect command execution."""
         if not error:
             return error
-            
+
         if error.endswith("\n"):
             error = error[:-1]
-            
+
         filtered_error = []
         for line in error.split('\n'):
             if not any(x in line.lower() for x in [
@@ -236,7 +451,7 @@ class _BashSession:
                 'watches established'
             ]):
                 filtered_error.append(line)
-                
+
         return '\n'.join(filtered_error)
 
     async def start(self):
@@ -245,19 +460,45 @@ class _BashSession:
             return
 
         try:
-            self._process = await asyncio.create_subprocess_shell(
-                self.command,
-                preexec_fn=os.setsid,
-                shell=True,
-                bufsize=0,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                limit=3 * 1024 * 1024,
+            # The session owns its output pipes, so output goes straight into
+            # the bounded capture instead of piling up in a StreamReader. Bash
+            # reports each command's exit status on a separate control pipe.
+            stdout_read, stdout_write = os.pipe()
+            stderr_read, stderr_write = os.pipe()
+            control_read, control_write = os.pipe()
+            try:
+                self._process = await asyncio.create_subprocess_shell(
+                    self.command,
+                    preexec_fn=os.setsid,
+                    shell=True,
+                    bufsize=0,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=stdout_write,
+                    stderr=stderr_write,
+                    pass_fds=(control_write,),
+                )
+            finally:
+                os.close(stdout_write)
+                os.close(stderr_write)
+                os.close(control_write)
+            # pass_fds keeps the descriptor number in the child
+            self._control_fd = control_write
+            self._output_fds = (stdout_read, stderr_read)
+
+            loop = asyncio.get_running_loop()
+            for stream, fd in (("stdout", stdout_read), ("stderr", stderr_read)):
+                transport, _ = await loop.connect_read_pipe(
+                    lambda stream=stream: _OutputProtocol(self, stream), os.fdopen(fd, "rb", buffering=0)
+                )
+                self._pipes.append(transport)
+            transport, _ = await loop.connect_read_pipe(
+                lambda: _ControlProtocol(self), os.fdopen(control_read, "rb", buffering=0)
             )
+            self._pipes.append(transport)
+            self._start_task(self._watch_process())
 
             self._started = True
-                
+
         except Exception as e:
             raise ToolError(f"Failed to start bash session: {str(e)}")
 
@@ -265,15 +506,139 @@ class _BashSession:
         """Terminate the bash shell."""
         if not self._started:
             return
-            
+
         if self._process and self._process.returncode is None:
             try:
                 self._process.terminate()
             except Exception:
                 pass
-        
+
+        for task in list(self._tasks):
+            task.cancel()
+        for pipe in self._pipes:
+            pipe.close()
+        if self._output is not None:
+            self._output.close()
+        for path in self._spill_files:
+            path.unlink(missing_ok=True)
+        self._spill_files.clear()
+
         self._is_running_command = False
 
+    def _begin_command(self, command: str) -> _CommandOutput:
+        """Set up the capture for a new command; output arriving between commands is dropped."""
+        if self._output is not None:
+            self._output.close()
+        self._command_number = next(self._command_numbers)
+        name = f"session-{self._session_id}-{self._command_number}"
+        spill_dir = WORKSPACE_DIR / OUTPUT_SPILL_DIR
+        self._output = _CommandOutput(
+            self._command_number,
+            _OutputBuffer(spill_dir / f"{name}.stdout", self._output_ring_size, self._output_excerpt_size),
+            _OutputBuffer(spill_dir / f"{name}.stderr", self._output_ring_size, self._output_excerpt_size),
+        )
+        # Keep the spill files of the last few commands so their handles stay readable
+        self._spill_files += [self._output.stdout.spill_path, self._output.stderr.spill_path]
+        while len(self._spill_files) > self._kept_spill_files:
+            self._spill_files.pop(0).unlink(missing_ok=True)
+
+        self._last_command = command
+        self._is_running_command = True
+        return self._output
+
+    def _wrap_command(self, command: str, number: int) -> bytes:
+        # The group runs in the shell itself (variables and functions persist) with the
+        # control pipe closed, so programs the command starts, background jobs
+        # included, never inherit it; bash keeps its saved copy close-on-exec.
+        # $? is taken right after the command, before the cd
+        return f"""
+{{
+{command}
+}} {self._control_fd}>&-
+printf '{number} %d\\n' $? >&{self._control_fd}
+cd "{WORKSPACE_DIR}"
+""".encode()
+
+    def _start_task(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _on_output(self, stream: str, data: bytes):
+        """Feed bytes read from an output pipe into the running command's capture."""
+        output = self._output
+        if output is None or output.finished.is_set():
+            return
+        output.buffers[stream].write(data)
+        output.notify()
+
+    def _on_command_exit(self, number: int, exit_code: int):
+        """Bash reported a command's exit status on the control pipe."""
+        output = self._output
+        if output is None or output.number != number or output.completing:
+            return
+        output.exit_code = exit_code
+        self._start_task(self._complete(output))
+
+    async def _watch_process(self):
+        """Finish a running command if bash itself exits, e.g. on ``exit``."""
+        returncode = await self._process.wait()
+        output = self._output
+        if output is not None and not output.completing:
+            output.exited = True
+            output.exit_code = returncode
+            await self._complete(output)
+
+    async def _complete(self, output: _CommandOutput):
+        """Capture what the command left in the output pipes, then mark it finished.
+
+        Everything the command wrote is in the pipes before bash reports its
+        status, so once they hold no unread bytes the capture is complete.
+        Between checks this sleeps until the next read from the pipes (or
+        ``_drain_poll`` seconds), so background jobs that keep writing cost
+        no busy loop; they are cut off after ``_output_delay``.
+        """
+        output.completing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._output_delay
+        try:
+            while any(_unread_bytes(fd) for fd in self._output_fds) and loop.time() < deadline:
+                try:
+                    await asyncio.wait_for(output.changed.wait(),
+                                           timeout=min(self._drain_poll, max(deadline - loop.time(), 0)))
+                except asyncio.TimeoutError:
+                    pass
+        except OSError:
+            pass  # the pipes were closed under us
+        output.close()
+        output.finished.set()
+        if output is self._output:
+            self._is_running_command = False
+        output.notify()
+
+    def _captured_result(self, output: _CommandOutput, system: str | None = None,
+                         result_type: type = CLIResult) -> ToolResult:
+        """Render the captured output; large streams become head, tail and a spill file handle.
+
+        ``next_offset`` and ``next_error_offset`` are the bytes captured so
+        far, from where :meth:`read_output` continues for ``command_number``.
+        """
+        stdout = output.stdout.text(self._output_excerpt_size)
+        stderr = output.stderr.text(self._output_excerpt_size)
+        if output.finished.is_set():
+            stdout = stdout.rstrip('\n')
+        return result_type(
+            output=stdout,
+            error=self._filter_error_output(stderr),
+            system=system,
+            output_file=output.stdout.output_file,
+            error_file=output.stderr.output_file,
+            next_offset=output.stdout.size,
+            next_error_offset=output.stderr.size,
+            command_number=output.number,
+            exit_code=output.exit_code,
+        )
+
     async def get_current_output(self) -> CLIResult:
         """Get the current output of a running command."""
         if not self._started:
@@ -282,92 +647,112 @@ class _BashSession:
                 error="Session not started",
                 system=f"Session ID: {self._session_id} not started"
             )
-            
+
         await self.check_command_completion()
-            
+
         if not self._is_running_command:
             return CLIResult(
                 output="No command currently running in this session.",
                 error="",
                 system=f"Session ID: {self._session_id}"
             )
-        
-        if not self._process or self._process.stdout is None or self._process.stderr is None:
-            self._is_running_command = False
-            return CLIResult(
-                output="",
-                error="Process terminated unexpectedly",
-                system=f"Session ID: {self._session_id} process terminated"
-            )
-        
-        output = self._partial_output
-        if self._process.stdout._buffer:
-            output += self._process.stdout._buffer.decode(errors="replace")
-            
-        error = self._partial_error
-        if self._process.stderr._buffer:
-            error += self._process.stderr._buffer.decode(errors="replace")
-            
-        filtered_error = self._filter_error_output(error)
-            
-        if self._sentinel in output:
-            self._is_running_command = False
-            output = output.replace(self._sentinel, "")
-            
-            processed_output = output.rstrip('\n')
-            system_msg = f"Command completed. Session ID: {self._session_id}"
-            return CLIResult(
-                output=processed_output,
-                error=filtered_error,
-                system=system_msg
-            )
-            
-        return CLIResult(
-            output=output,
-            error=filtered_error,
-            system=f"Command still running. Session ID: {self._session_id}"
+
+        return self._captured_result(
+            self._output, system=f"Command still running. Session ID: {self._session_id}"
+        )
+
+    async def read_output(self, offset: int = 0, error_offset: int = 0, wait: float | None = None,
+                          limit: int | None = None, command_number: int | None = None) -> ToolResult:
+        """Page through the latest command's output from the byte offsets a client has already seen.
+
+        Returns at most ``limit`` bytes of stdout after ``offset`` and of stderr
+        after ``error_offset``, verbatim, with ``next_offset`` and
+        ``next_error_offset`` to pass on the next call. ``limit`` is capped at
+        ``_output_page_size``. With ``wait``, a call that finds nothing new
+        waits up to that many seconds (at most ``_max_output_wait``) for more
+        output or completion, so polling costs O(new output) rather than
+        O(total output). Pages end on whole UTF-8 characters.
+
+        Offsets belong to one command: results carry its ``command_number``,
+        which must be passed back with non-zero offsets. If another command
+        has started since, paging restarts from offset 0 of the new command
+        and the status says so.
+        """
+        output = self._output
+        if output is None:
+            return ToolResult(system=f"No command has run in session {self._session_id}.")
+        if command_number is None and (offset or error_offset):
+            return ToolResult(error="Pass the command_number returned with next_offset to continue paging")
+        notes = []
+        if command_number is not None and command_number != output.number:
+            notes.append(f"Command {command_number} was replaced by command {output.number}; "
+                         f"paging restarted from offset 0")
+            offset = error_offset = 0
+        limit = min(max(limit or self._output_page_size, 4), self._output_page_size)
+        wait = min(wait, self._max_output_wait) if wait else None
+
+        changed = output.changed
+        caught_up = offset >= output.stdout.size and error_offset >= output.stderr.size
+        if wait and caught_up and not output.finished.is_set():
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+        pages = []
+        for stream, start in (("stdout", offset), ("stderr", error_offset)):
+            buffer = output.buffers[stream]
+            start, data = await buffer.read(start, limit)
+            if start + len(data) < buffer.size or not output.finished.is_set():
+                # The rest of a split character comes with the next page
+                data = data[:_complete_utf8(data)]
+            pages.append((start, data))
+        (stdout_start, stdout), (stderr_start, stderr) = pages
+
+        if output.finished.is_set():
+            status = f"Command completed with exit code {output.exit_code}"
+        else:
+            status = "Command still running"
+        system = ". ".join([*notes, f"{status}. Session ID: {self._session_id}"])
+        lost = max(stdout_start - offset, 0) + max(stderr_start - error_offset, 0)
+        if lost > 0:
+            system += f". {lost} bytes of output could not be kept"
+        return ToolResult(
+            output=stdout.decode(errors="replace"),
+            error=stderr.decode(errors="replace"),
+            system=system,
+            output_file=output.stdout.output_file,
+            error_file=output.stderr.output_file,
+            next_offset=stdout_start + len(stdout),
+            next_error_offset=stderr_start + len(stderr),
+            command_number=output.number,
+            exit_code=output.exit_code if output.finished.is_set() else None,
         )
 
     async def run(self, command: str, timeout: float | None = None):
         """Execute a command in the bash shell."""
         if not self._started:
             raise ToolError("Session has not started.")
-            
+
         await self.check_command_completion()
-            
+
         if not self._process or self._process.returncode is not None:
             return ToolResult(
                 system=f"Session {self._session_id} must be restarted",
                 error=f"Bash has exited with returncode {self._process.returncode if self._process else 'None'}",
             )
-            
+
         if self._is_running_command:
             return ToolResult(
                 system=f"A command is already running in this session (ID: {self._session_id}). Please use another session or check the status of the current command."
             )
 
         assert self._process.stdin
-        assert self._process.stdout
-        assert self._process.stderr
-
-        self._partial_output = ""
-        self._partial_error = ""
-        self._last_command = command
-        self._is_running_command = True
-        
-        base_dir = str(WORKSPACE_DIR)
 
-        wrapped_command = f"""
-{command}
+        output = self._begin_command(command)
 
-cd "{base_dir}"
-echo '{self._sentinel}'
-"""
-        self._process.stdout._buffer.clear()
-        self._process.stderr._buffer.clear()
-        
         try:
-            self._process.stdin.write(wrapped_command.encode())
+            self._process.stdin.write(self._wrap_command(command, output.number))
             await self._process.stdin.drain()
         except Exception as e:
             self._is_running_command = False
@@ -376,207 +761,70 @@ echo '{self._sentinel}'
                 system="Session may need to be restarted"
             )
 
+        command_timeout = timeout if timeout is not None else self._timeout
         try:
-            command_timeout = timeout if timeout is not None else self._timeout
-            
-            # Add timeout protection for the readuntil operation
-            try:
-                data = await asyncio.wait_for(
-                    self._process.stdout.readuntil(self._sentinel.encode()),
-                    timeout=command_timeout
-                )
-                output = data.decode(errors="replace").replace(self._sentinel, "")
-                self._partial_output = output
-                error = self._process.stderr._buffer.decode(errors="replace")
-                self._partial_error = error
-                self._is_running_command = False
-                
-            except (asyncio.IncompleteReadError, ConnectionResetError) as e:
-                # Handle the "0 bytes read" error and similar stream issues
-                # This is the main fix for the reported error
-                output = self._partial_output
-                error = self._partial_error
-                
-                # Try to get any remaining data from buffers
-                if hasattr(self._process.stdout, '_buffer') and self._process.stdout._buffer:
-                    try:
-                        remaining = self._process.stdout._buffer.decode(errors="replace")
-                        output += remaining
-                    except Exception:
-                        pass
-                        
-                if hasattr(self._process.stderr, '_buffer') and self._process.stderr._buffer:
-                    try:
-                        remaining = self._process.stderr._buffer.decode(errors="replace")
-                        error += remaining
-                    except Exception:
-                        pass
-                
-                # Check if the command actually completed successfully despite the stream error
-                if self._sentinel in output:
-                    # Command completed, just had a stream reading issue
-                    output = output.replace(self._sentinel, "")
-                    self._is_running_command = False
-                    filtered_error = self._filter_error_output(error)
-                    return CLIResult(
-                        output=output.rstrip('\n'), 
-                        error=filtered_error,
-                        system=f"Command completed despite stream reading issue. Session ID: {self._session_id}"
-                    )
-                else:
-                    # Command didn't complete normally
-                    self._is_running_command = False
-                    filtered_error = self._filter_error_output(error)
-                    return ToolResult(
-                        output=output,
-                        error=filtered_error,
-                        system=f"Stream reading error: {str(e)}. Command may have failed or produced output exceeding buffer limits."
-                    )
-                
+            await asyncio.wait_for(output.finished.wait(), timeout=command_timeout)
         except asyncio.TimeoutError:
-            output = self._partial_output
-            error = self._partial_error
-            filtered_error = self._filter_error_output(error)
-            
-            command_timeout = timeout if timeout is not None else self._timeout
-            return ToolResult(
-                output=output,
-                error=filtered_error,
-                system=f"Process timed out after {command_timeout} seconds. This process will continue to run in session {self._session_id}."
+            return self._captured_result(
+                output,
+                system=f"Process timed out after {command_timeout} seconds. This process will continue to run in session {self._session_id}.",
+                result_type=ToolResult,
             )
-        except asyncio.LimitOverrunError:
-            # Enhanced limit overrun handling with timeout protection
-            output_chunks = []
-            total_timeout = command_timeout if 'command_timeout' in locals() else (timeout if timeout is not None else self._timeout)
-            start_time = asyncio.get_event_loop().time()
-            
-            try:
-                while True:
-                    current_time = asyncio.get_event_loop().time()
-                    remaining_time = total_timeout - (current_time - start_time)
-                    
-                    if remaining_time <= 0:
-                        break
-                        
-                    chunk = await asyncio.wait_for(
-                        self._process.stdout.read(8192),
-                        timeout=min(remaining_time, 30.0)  # Max 30s per read
-                    )
-                    if not chunk:
-                        break
-                        
-                    output_chunks.append(chunk.decode(errors="replace"))
-                    accumulated = ''.join(output_chunks)
-                    
-                    if self._sentinel in accumulated:
-                        output = accumulated.replace(self._sentinel, "")
-                        self._partial_output = output
-                        error = self._process.stderr._buffer.decode(errors="replace")
-                        self._partial_error = error
-                        self._is_running_command = False
-                        break
-                        
-            except asyncio.TimeoutError:
-                output = ''.join(output_chunks)
-                self._partial_output = output
-                error = self._process.stderr._buffer.decode(errors="replace")
-                self._partial_error = error
-        except Exception as e:
-            # Catch any other unexpected errors
-            self._is_running_command = False
-            return ToolResult(
-                error=f"Unexpected error executing command: {str(e)}",
-                system="Session may need to be restarted"
-            )
-
-        processed_output = output.rstrip('\n')
-        filtered_error = self._filter_error_output(error)
 
-        self._process.stdout._buffer.clear()
-        self._process.stderr._buffer.clear()
+        if output.exited:
+            return self._captured_result(
+                output,
+                # Not "must be restarted": BashTool would restart and re-run the command that
+                # killed bash. The next command restarts the session instead, keeping this
+                # result's output files until then.
+                system=f"Bash exited with code {output.exit_code} while running the command. "
+                       f"Session {self._session_id} will be restarted before its next command",
+                result_type=ToolResult,
+            )
 
-        return CLIResult(output=processed_output, error=filtered_error)
+        system = f"Command exited with code {output.exit_code}" if output.exit_code else None
+        return self._captured_result(output, system=system)
 
     async def stream_command(self, command: str):
-        """Run command and yield stdout and stderr lines as they arrive until the sentinel appears."""
+        """Run command and yield stdout and stderr text as it arrives until the command completes."""
         if not self._started:
             await self.start()
 
         await self.check_command_completion()
         if self._is_running_command:
             raise ToolError("Session busy running another command")
+        if self._process.returncode is not None:
+            raise ToolError(f"Bash has exited; session {self._session_id} must be restarted")
 
-        assert (
-            self._process
-            and self._process.stdin
-            and self._process.stdout
-            and self._process.stderr
-        )
+        assert self._process and self._process.stdin
 
-        self._partial_output = ""
-        self._partial_error = ""
-        self._last_command = command
-        self._is_running_command = True
-
-        wrapped_command = f"""
-{command}
-
-cd \"{WORKSPACE_DIR}\"
-echo '{self._sentinel}'
-"""
-
-        self._process.stdout._buffer.clear()
-        self._process.stderr._buffer.clear()
-
-        self._process.stdin.write(wrapped_command.encode())
-        await self._process.stdin.drain()
-
-        sentinel = self._sentinel
-
-        queue: asyncio.Queue[str] = asyncio.Queue()
-
-        async def _reader(stream: asyncio.StreamReader, is_stdout: bool):
-            """Continuously read chunks (not lines) from *stream* and enqueue them."""
-            buffer = ""
-            chunk_size = 256  # bytes
-
-            while True:
-                data = await stream.read(chunk_size)
-                if not data:
-                    break  # EOF
-
-                text = data.decode(errors="replace")
-
-                if is_stdout:
-                    buffer += text
-
-                    if sentinel in buffer:
-                        before, _sent, _after = buffer.partition(sentinel)
-                        if before:
-                            await queue.put(before)
-                        await queue.put(None)
-                        break
-
-                    if buffer:
-                        await queue.put(buffer)
-                        buffer = ""
-                else:
-                    filtered = self._filter_error_output(text)
-                    if filtered:
-                        await queue.put(filtered)
-
-        stdout_task = asyncio.create_task(_reader(self._process.stdout, True))
-        stderr_task = asyncio.create_task(_reader(self._process.stderr, False))
+        output = self._begin_command(command)
+        # Follow the capture with a cursor per stream, so a slow client never
+        # makes the server hold more than the bounded buffers
+        offsets = {"stdout": 0, "stderr": 0}
+        decoders = {stream: codecs.getincrementaldecoder("utf-8")(errors="replace")
+                    for stream in offsets}
 
         try:
+            self._process.stdin.write(self._wrap_command(command, output.number))
+            await self._process.stdin.drain()
+
             while True:
-                line = await queue.get()
-                if line is None:  # Sentinel from stdout reader
+                changed = output.changed
+                for stream in offsets:
+                    start, data = await output.buffers[stream].read(offsets[stream], self._output_page_size)
+                    offsets[stream] = start + len(data)
+                    text = decoders[stream].decode(data)
+                    if stream == "stderr":
+                        text = self._filter_error_output(text)
+                    if text:
+                        yield text
+                caught_up = all(offsets[stream] >= output.buffers[stream].size for stream in offsets)
+                if output.finished.is_set() and caught_up:
                     break
-                yield line
+                if caught_up:
+                    await changed.wait()
         finally:
-            for t in (stdout_task, stderr_task):
-                t.cancel()
             self._is_running_command = False
 
 
@@ -599,6 +847,11 @@ class BashTool(BaseAnthropicTool):
         list_sessions: bool = False, 
         check_session: int | None = None,
         timeout: float | None = None,
+        offset: int | None = None,
+        error_offset: int | None = None,
+        wait: float | None = None,
+        limit: int | None = None,
+        command_number: int | None = None,
         **kwargs
     ):
         if list_sessions:
@@ -619,6 +872,10 @@ class BashTool(BaseAnthropicTool):
                 return ToolResult(error=f"Session {check_session} not found.")
                 
             session_obj = self._sessions[check_session]
+
+            # With an offset, page through the output instead of returning all of it
+            if offset is not None or error_offset is not None:
+                return await session_obj.read_output(offset or 0, error_offset or 0, wait, limit, command_number)
             
             await session_obj.check_command_completion()
                 
@@ -684,12 +941,7 @@ class BashTool(BaseAnthropicTool):
                 validate_command_length(command)
                 result = await current_session.run(command, timeout)
                 
-                if isinstance(result, ToolResult) and (
-                    (result.system and "must be restarted" in result.system) or
-                    (result.error and "0 bytes read on a total of undefined expected bytes" in result.error) or
-                    (result.error and "Stream reading error" in result.error) or
-                    (result.system and "stream reading issue" in result.system)
-                ):
+                if isinstance(result, ToolResult) and result.system and "must be restarted" in result.system:
                     try:
                         async with self._sessions_lock:
                             current_session.stop()
@@ -699,26 +951,11 @@ class BashTool(BaseAnthropicTool):
                         
                         result = await current_session.run(command, timeout)
                         
-                        if isinstance(result, CLIResult):
+                        if isinstance(result, ToolResult):
                             new_system_msg = f"Session {session} was automatically restarted and the command was re-run."
                             if result.system:
                                 new_system_msg = f"{new_system_msg} {result.system}"
-                            return CLIResult(
-                                output=result.output,
-                                error=result.error,
-                                system=new_system_msg,
-                                base64_image=getattr(result, 'base64_image', None)
-                            )
-                        elif isinstance(result, ToolResult):
-                            new_system_msg = f"Session {session} was automatically restarted and the command was re-run."
-                            if result.system:
-                                new_system_msg = f"{new_system_msg} {result.system}"
-                            return ToolResult(
-                                output=result.output,
-                                error=result.error,
-                                system=new_system_msg,
-                                base64_image=getattr(result, 'base64_image', None)
-                            )
+                            return result.replace(system=new_system_msg)
                     except Exception as e:
                         return ToolResult(error=f"Failed to automatically restart session {session}: {str(e)}")
                 
@@ -726,12 +963,7 @@ class BashTool(BaseAnthropicTool):
                     new_system_msg = created_msg
                     if result.system:
                         new_system_msg = f"{created_msg}. {result.system}"
-                    return CLIResult(
-                        output=result.output,
-                        error=result.error,
-                        system=new_system_msg,
-                        base64_image=getattr(result, 'base64_image', None)
-                    )
+                    return result.replace(system=new_system_msg)
                 return result
             except Exception as e:
                 return ToolResult(error=f"Error executing command: {str(e)}")
@@ -1236,6 +1468,11 @@ class BashRequest(BaseModel):
     list_sessions: Optional[bool] = False
     check_session: Optional[int] = None
     timeout: Optional[float] = None
+    offset: Optional[int] = None
+    error_offset: Optional[int] = None
+    wait: Optional[float] = None
+    limit: Optional[int] = None
+    command_number: Optional[int] = None
 
 
 class FileRequest(BaseModel):
@@ -1264,6 +1501,12 @@ class ToolResponse(BaseModel):
     error: Optional[str] = None
     base64_image: Optional[str] = None
     system: Optional[str] = None
+    output_file: Optional[str] = None
+    error_file: Optional[str] = None
+    next_offset: Optional[int] = None
+    next_error_offset: Optional[int] = None
+    command_number: Optional[int] = None
+    exit_code: Optional[int] = None
 
 
 # Helper function
@@ -1272,7 +1515,13 @@ def _tool_result_to_response(result: ToolResult) -> Dict[str, Any]:
         "output": result.output,
         "error": result.error,
         "base64_image": result.base64_image,
-        "system": result.system
+        "system": result.system,
+        "output_file": result.output_file,
+        "error_file": result.error_file,
+        "next_offset": result.next_offset,
+        "next_error_offset": result.next_error_offset,
+        "command_number": result.command_number,
+        "exit_code": result.exit_code,
     }
 
 
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Chunk Size Autotuner
+Sweeps chunking settings over sample books and measures index size, build time, latency and recall.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from convert_to_structured_csv import NelsonTextbookConverter, non_negative_int
+from nelson_retrieval import (QUERY_SET_FILE, HashingEmbedder, VectorIndex, chunk_text,
+                              first_relevant_rank, load_query_set)
+from token_counter import TokenCounter
+
+# Optional: NumPy for latency percentiles
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+def sample_files(input_pattern: str, sample: int) -> List[str]:
+    """Pick ``sample`` files spread evenly over the sorted matches (0 keeps all)."""
+    files = sorted(glob.glob(input_pattern))
+    if sample <= 0 or sample >= len(files):
+        return files
+    step = len(files) / sample
+    return [files[int(i * step)] for i in range(sample)]
+
+
+def chunk_files(files: List[str], max_tokens: int, overlap: int, token_counter: str) -> Tuple[List[Dict], TokenCounter]:
+    """Convert files in memory with one chunk setting; returns the rows and the token counter used."""
+    converter = NelsonTextbookConverter(max_chunk_tokens=max_tokens, token_counter=token_counter,
+                                        chunk_overlap_sentences=overlap)
+    rows = []
+    for filepath in files:
+        try:
+            rows.extend(converter.parse_file_structure(filepath))
+        except Exception as e:
+            logger.error(f"Failed to process {filepath}: {str(e)}")
+    return rows, converter.token_counter
+
+
+def evaluate_setting(rows: List[Dict], token_counter: TokenCounter, queries: List[Dict], dim: int, k: int) -> Dict:
+    """Build an index over one chunking of the sample and run the query set against it."""
+    texts = [chunk_text(row) for row in rows]
+    tokens = sum(token_counter.count_batch([row['content'] for row in rows]))
+
+    start = time.perf_counter()
+    embedder = HashingEmbedder(dim=dim)
+    index = VectorIndex(embedder.embed(texts))
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    reciprocal_ranks = 0.0
+    for query in queries:
+        start = time.perf_counter()
+        found, _ = index.search(embedder.embed([query['query']])[0], k)
+        latencies.append(time.perf_counter() - start)
+        rank = first_relevant_rank([rows[i] for i in found.tolist()], query)
+        if rank is not None:
+            hits += 1
+            reciprocal_ranks += 1.0 / rank
+
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {
+        'queries': len(queries),
+        'chunks': len(rows),
+        'total_tokens': tokens,
+        'mean_tokens_per_chunk': round(tokens / len(rows), 1) if rows else 0.0,
+        'index_bytes': index.nbytes,
+        'build_seconds': round(build_seconds, 3),
+        'latency_ms_p50': round(float(np.percentile(latencies_ms, 50)), 3) if latencies else None,
+        'latency_ms_p95': round(float(np.percentile(latencies_ms, 95)), 3) if latencies else None,
+        f'recall_at_{k}': round(hits / len(queries), 4) if queries else None,
+        'mrr': round(reciprocal_ranks / len(queries), 4) if queries else None,
+    }
+
+
+def recommend(results: List[Dict], k: int, tolerance: float) -> Optional[Dict]:
+    """Smallest index whose recall is within ``tolerance`` of the best setting."""
+    key = f'recall_at_{k}'
+    scored = [result for result in results if result[key] is not None]
+    if not scored:
+        return None
+    best = max(result[key] for result in scored)
+    eligible = [result for result in scored if result[key] >= best - tolerance]
+    return min(eligible, key=lambda result: (result['index_bytes'], -result['mrr']))
+
+
+def run_autotune(files: List[str], max_tokens: List[int], overlaps: List[int], queries: List[Dict],
+                 token_counter: str = 'heuristic', dim: int = 1536, k: int = 5,
+                 tolerance: float = 0.02) -> Dict:
+    """Sweep every (max_tokens, overlap) setting and recommend one."""
+    results = []
+    for max_chunk_tokens in max_tokens:
+        for overlap in overlaps:
+            start = time.perf_counter()
+            rows, counter = chunk_files(files, max_chunk_tokens, overlap, token_counter)
+            chunk_seconds = time.perf_counter() - start
+
+            # Only queries answerable from the sampled books count towards recall
+            chapters = {row['chapter_number'] for row in rows}
+            answerable = [query for query in queries if chapters & set(query['expected_chapters'])]
+
+            result = {'max_chunk_tokens': max_chunk_tokens, 'chunk_overlap_sentences': overlap,
+                      'chunk_seconds': round(chunk_seconds, 3)}
+            result.update(evaluate_setting(rows, counter, answerable, dim, k))
+            results.append(result)
+            logger.info(f"max_tokens={max_chunk_tokens} overlap={overlap}: {result['chunks']} chunks, "
+                        f"recall@{k}={result[f'recall_at_{k}']}")
+
+    return {
+        'files': [Path(filepath).name for filepath in files],
+        'queries_total': len(queries),
+        'embedding_dim': dim,
+        'k': k,
+        'recall_tolerance': tolerance,
+        'results': results,
+        'recommended': recommend(results, k, tolerance),
+    }
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(description='Sweep chunk sizes and recommend one from index cost and recall.')
+    parser.add_argument('--input', default='*.txt', help='Glob pattern of input text files (default: *.txt)')
+    parser.add_argument('--sample', type=int, default=6,
+                        help='Number of books to sample, spread over the sorted files (0 = all, default: 6)')
+    parser.add_argument('--max-tokens', type=int, nargs='+', default=[150, 300, 500, 800],
+                        help='max_chunk_tokens values to sweep (default: 150 300 500 800)')
+    parser.add_argument('--overlap', type=non_negative_int, nargs='+', default=[0],
+                        help='Chunk overlap values in sentences to sweep (default: 0)')
+    parser.add_argument('--token-counter', choices=['heuristic', 'whitespace', 'bpe'], default='heuristic',
+                        help='Token counter used for chunking and token totals')
+    parser.add_argument('--queries', default=QUERY_SET_FILE, help=f'Labelled query set (default: {QUERY_SET_FILE})')
+    parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension (default: 1536)')
+    parser.add_argument('--k', type=int, default=5, help='Recall cutoff (default: 5)')
+    parser.add_argument('--recall-tolerance', type=float, default=0.02,
+                        help='Recall a smaller index may give up against the best setting (default: 0.02)')
+    parser.add_argument('--json', metavar='PATH', help='Also write results as JSON to PATH')
+    return parser
+
+
+def main():
+    """Main entry point"""
+    args = create_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    if np is None:
+        raise ImportError("numpy not found. Please install with: pip install numpy")
+
+    files = sample_files(args.input, args.sample)
+    queries = load_query_set(args.queries)['queries']
+    report = run_autotune(files, args.max_tokens, args.overlap, queries, token_counter=args.token_counter,
+                          dim=args.dim, k=args.k, tolerance=args.recall_tolerance)
+
+    recall_key = f"recall_at_{args.k}"
+    answerable = max((result['queries'] for result in report['results']), default=0)
+    print(f"Sampled {len(files)} files; {answerable}/{report['queries_total']} queries answerable")
+    print(f"{'max_tok':>7} {'overlap':>7} {'chunks':>7} {'tokens':>9} {'index MB':>9} {'build s':>8} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'recall':>7} {'mrr':>6}")
+    for result in report['results']:
+        print(f"{result['max_chunk_tokens']:>7} {result['chunk_overlap_sentences']:>7} {result['chunks']:>7} "
+              f"{result['total_tokens']:>9} {result['index_bytes'] / 1e6:>9.2f} {result['build_seconds']:>8.2f} "
+              f"{result['latency_ms_p50'] or 0:>7.2f} {result['latency_ms_p95'] or 0:>7.2f} "
+              f"{result[recall_key] or 0:>7.3f} {result['mrr'] or 0:>6.3f}")
+
+    recommended = report['recommended']
+    if recommended:
+        print(f"Recommended: max_chunk_tokens={recommended['max_chunk_tokens']} "
+              f"chunk_overlap_sentences={recommended['chunk_overlap_sentences']}")
+    else:
+        print("No recommendation: none of the queries are answerable from the sampled files", file=sys.stderr)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0 if recommended else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
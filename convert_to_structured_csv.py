@@ -4,22 +4,73 @@ Nelson Textbook of Pediatrics - Structured CSV Converter
 Converts raw text files into hierarchical, chunked CSV format for vector search and RAG.
 """
 
-import csv
+import argparse
+import bisect
+import itertools
+import json
 import re
 import os
+import sys
 import glob
+import time
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Generator
+from typing import Dict, List, Tuple, Optional, Generator, Union
 import logging
 
+# Optional: NumPy for prefix-sum chunk boundaries
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from nelson_dataset import FIELDNAMES, StructuredCSVWriter, compress_structured_csv, manifest_path_for
+from pattern_registry import PatternRegistry
+from quality_metrics import quality_failures, write_quality_report
+from tfidf_summarizer import TfidfSummarizer
+from token_counter import HeuristicTokenCounter, TokenCounter, create_token_counter
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Marker priority when overlapping markers are merged (lower wins)
+MARKER_PRIORITY = {'PART': 0, 'CHAPTER': 1, 'SECTION': 2, 'NUMBERED_SUBSECTION': 3}
+# Only markers starting this close to another marker's start can be the same heading
+MAX_HEADING_CHARS = 150
+
+# Budgeted marker detection searches one window of start positions at a time
+# and checks the clock in between. A match may run MARKER_MATCH_MARGIN chars
+# past its window; far longer than any heading.
+MARKER_SCAN_WINDOW = 4096
+MARKER_MATCH_MARGIN = 4096
+
+# Lowercase words that may appear inside a heading
+HEADING_CONNECTORS = {'a', 'an', 'and', 'the', 'of', 'in', 'on', 'to', 'for', 'with', 'or', 'by', 'at', 'from'}
+
 class NelsonTextbookConverter:
-    def __init__(self, min_chunk_tokens: int = 50, max_chunk_tokens: int = 300):
+    def __init__(self, min_chunk_tokens: int = 50, max_chunk_tokens: int = 300,
+                 summarizer: str = 'rules', marker_mode: str = 'regex',
+                 marker_time_budget: Optional[float] = 10.0, merge_markers: bool = True,
+                 token_counter: Union[str, TokenCounter] = 'heuristic', chunk_overlap_sentences: int = 0):
         self.min_chunk_tokens = min_chunk_tokens
         self.max_chunk_tokens = max_chunk_tokens
+        # Token counting: 'heuristic' (len // 3), 'whitespace', 'bpe' or a TokenCounter instance
+        if isinstance(token_counter, str):
+            token_counter = create_token_counter(token_counter)
+        self.token_counter = token_counter
+        # Sentences repeated at the start of the next chunk (sliding window)
+        if chunk_overlap_sentences < 0:
+            raise ValueError(f"chunk_overlap_sentences must be >= 0, got {chunk_overlap_sentences}")
+        self.chunk_overlap_sentences = chunk_overlap_sentences
+        # 'rules' scores one chunk at a time; 'tfidf' summarizes a chapter per batch
+        self.summarizer = summarizer
+        self.tfidf_summarizer = TfidfSummarizer() if summarizer == 'tfidf' else None
+        # 'regex' runs the full structure patterns under a per-file time budget (seconds);
+        # 'linear' always uses the linear heuristic scan
+        self.marker_mode = marker_mode
+        self.marker_time_budget = marker_time_budget
+        # Collapse duplicate and overlapping markers before segmentation
+        self.merge_markers = merge_markers
         self.book_title = "Nelson Textbook of Pediatrics"
         self.book_edition = "22"  # Assuming 22nd edition based on common usage
         
@@ -42,25 +93,93 @@ class NelsonTextbookConverter:
             'M-IM-$': '≤',       # Less than or equal
         }
         
+        # Every regex goes through the registry so it is compiled once and profiled
+        self.patterns = PatternRegistry()
+        register = self.patterns.register
+        
         # Enhanced regex patterns for structure detection
-        self.part_pattern = re.compile(r'PART\s+([IVXLCDM]+)\s+([^0-9]+?)(?=\s+Section|\s+\d+|\s*$)', re.IGNORECASE)
+        self.part_pattern = register('part', r'PART\s+([IVXLCDM]+)\s+([^0-9]{1,%d}?)(?=\s+Section|\s+\d|\s*$)' % MAX_HEADING_CHARS,
+                                     re.IGNORECASE)
         # Multiple chapter patterns for comprehensive title extraction
         self.chapter_patterns = [
             # Standard format: "Chapter 182 Allergy and the Immunologic Basis"
-            re.compile(r'Chapter\s+(\d+)\s+([A-Za-z][^0-9\n]*?)(?=\s+(?:[A-Z][a-z]|Downloaded|Copyright|\d+\.\d+|\n|$))', re.IGNORECASE),
+            register('chapter_standard', r'Chapter\s+(\d+)\s+([A-Za-z][^0-9\n]*?)(?=\s+(?:[A-Z][a-z]|Downloaded|Copyright|\d+\.\d+|\n|$))', re.IGNORECASE),
             # Alternative format: "182 Allergy and the Immunologic Basis"
-            re.compile(r'^(\d+)\s+([A-Z][A-Za-z\s,\-:()]{10,80}?)(?=\s+[A-Z][a-z]|\s*$)', re.MULTILINE),
+            register('chapter_number_title', r'^(\d+)\s+([A-Z][A-Za-z\s,\-:()]{10,80}?)(?=\s+[A-Z][a-z]|\s*$)', re.MULTILINE),
             # Format with chapter number in content: "Chapter 182" followed by title
-            re.compile(r'Chapter\s+(\d+)[^\w]*([A-Z][A-Za-z\s,\-:()]{5,100}?)(?=\s+[A-Z][a-z]|\s+\d+|\s*$)', re.IGNORECASE),
+            register('chapter_inline', r'Chapter\s+(\d+)[^\w]*([A-Z][A-Za-z\s,\-:()]{5,100}?)(?=\s+[A-Z][a-z]|\s+\d+|\s*$)', re.IGNORECASE),
             # Standalone chapter titles after numbers
-            re.compile(r'^(\d+)\.\s*([A-Z][A-Za-z\s,\-:()]{10,80}?)(?=\s*$)', re.MULTILINE)
+            register('chapter_dotted', r'^(\d+)\.\s*([A-Z][A-Za-z\s,\-:()]{10,80}?)(?=\s*$)', re.MULTILINE)
         ]
         # All-caps section headers (major sections)
-        self.section_pattern = re.compile(r'([A-Z][A-Z\s]{8,50})\s+(?=[A-Z][a-z])')
+        self.section_pattern = register('section', r'([A-Z][A-Z\s]{8,50})\s+(?=[A-Z][a-z])')
         # Numbered subsections like "184.1 Global Allergic"
-        self.numbered_subsection_pattern = re.compile(r'(\d+\.\d+)\s+([A-Z][A-Za-z\s,\-:()]{8,80}?)(?=\s+[A-Z][a-z]|\s*$)')
+        self.numbered_subsection_pattern = register('numbered_subsection', r'(\d+\.\d+)\s+([A-Z][A-Za-z\s,\-:()]{8,80}?)(?=\s+[A-Z][a-z]|\s*$)')
         # Mixed case subsections (less common)
-        self.subsection_pattern = re.compile(r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s+(?=[A-Z][a-z])')
+        self.subsection_pattern = register('subsection', r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s+(?=[A-Z][a-z])')
+        
+        # Linear-time fallbacks: literal anchors, short bounded repeats, no lazy quantifiers
+        register('linear_part', r'\bPART[ \t]{1,5}([IVXLCDM]{1,8})[ \t]{1,5}([A-Z][A-Za-z ,\-:()&]{2,80})')
+        register('linear_chapter', r'\b(?i:chapter)[ \t]{1,5}(\d{1,4})[ \t]{1,5}([A-Z][A-Za-z ,\-:()]{2,100})')
+        register('linear_section', r'\b([A-Z]{2,40}(?:[ \t]{1,3}[A-Z]{2,40}){1,6})[ \t]{1,3}(?=[A-Z][a-z])')
+        register('linear_numbered_subsection', r'\b(\d{1,4}\.\d{1,3})[ \t]{1,3}([A-Z][a-z][A-Za-z ,\-:()]{6,80})')
+        
+        # Text cleaning and sentence splitting
+        register('blank_lines', r'\n\s*\n\s*\n+')
+        register('horizontal_space', r'[ \t]+')
+        register('whitespace', r'\s+')
+        register('sentence_split', r'[.!?]+\s+(?=[A-Z])')
+        register('sentence_end', r'[.!?]+')
+        
+        # Metadata contamination removed by clean_content
+        register('downloaded_domain', r'Downloaded for [^.]+\.com[^.]*\.')
+        register('downloaded_at', r'Downloaded for [^)]+\) at [^.]+\.')
+        register('copyright_elsevier', r'Copyright ©\d{4}\. Elsevier Inc\. All rights reserved\.')
+        register('personal_use', r'For personal use only\. No other uses without permission\.')
+        register('permission_copyright', r'No other uses without permission\. Copyright ©\d{4}\. Elsevier[^.]*\.')
+        register('running_header', r'\b\d{4}\s+Part [IVX]+\s+[^0-9]*')
+        register('trailing_page_number', r'\s+\d+\s*$')
+        
+        # Title extraction and cleanup
+        register('leading_u', r'^u\s*')
+        register('leading_non_word', r'^[^\w]+')
+        register('title_special_chars', r'[^\w\s,\-:()]')
+        register('title_after_indicator', r'^[^\w]*([A-Z][A-Za-z\s,\-:()]{5,80}?)(?=\s+[A-Z][a-z]|\s+\d+|\s*$)')
+        register('caps_title', r'\b([A-Z][A-Z\s]{10,60})\b')
+        self.patterns.register_template('title_after_chapter_number', r'{value}\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)')
+        self.medical_title_patterns = [
+            register(f'medical_title_{i}', pattern) for i, pattern in enumerate([
+                r'\b(Disorders?\s+of\s+[A-Za-z\s]+)',
+                r'\b(Diseases?\s+of\s+[A-Za-z\s]+)',
+                r'\b([A-Z][a-z]+\s+Syndrome)',
+                r'\b([A-Z][a-z]+\s+Deficiency)',
+                r'\b(Congenital\s+[A-Za-z\s]+)',
+                r'\b(Inherited\s+[A-Za-z\s]+)',
+                r'\b([A-Z][a-z]+\s+Discrepancy)',
+                r'\b(Evaluation\s+of\s+[A-Za-z\s]+)',
+                r'\b(Defects\s+in\s+[A-Za-z\s]+)'
+            ])
+        ]
+        register('hyphenated_title', r'\b([A-Z][a-z]+\-[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)')
+        
+        # Summary and section inference
+        self.medical_definition_patterns = [
+            register(f'medical_definition_{i}', pattern, re.IGNORECASE) for i, pattern in enumerate([
+                r'\b(is|are)\s+(a|an|the)\s+(condition|disease|disorder|syndrome)',
+                r'\b(refers to|defined as|characterized by)\b',
+                r'\b(involves|includes|comprises)\s+(the|a|an)',
+                r'\b(occurs when|results from|caused by)\b',
+                r'\b(manifests as|presents with|associated with)\b'
+            ])
+        ]
+        self.inferred_section_patterns = [
+            # Medical section patterns
+            register('inferred_medical_section', r'\b(TREATMENT|DIAGNOSIS|CLINICAL MANIFESTATIONS|EPIDEMIOLOGY|PATHOGENESIS|PREVENTION|PROGNOSIS)\b'),
+            # Numbered patterns
+            register('inferred_numbered_section', r'\b(\d+\.\d+)\s+([A-Z][A-Za-z\s]{5,40})'),
+            # All-caps headers
+            register('inferred_caps_section', r'\b([A-Z][A-Z\s]{8,40})\b')
+        ]
         
     def clean_text(self, text: str) -> str:
         """Clean special characters while preserving medical terminology."""
@@ -69,21 +188,21 @@ class NelsonTextbookConverter:
             cleaned = cleaned.replace(old_char, new_char)
         
         # Remove excessive whitespace but preserve paragraph breaks
-        cleaned = re.sub(r'\n\s*\n\s*\n+', '\n\n', cleaned)
-        cleaned = re.sub(r'[ \t]+', ' ', cleaned)
+        cleaned = self.patterns['blank_lines'].sub('\n\n', cleaned)
+        cleaned = self.patterns['horizontal_space'].sub(' ', cleaned)
         cleaned = cleaned.strip()
         
         return cleaned
     
     def estimate_tokens(self, text: str) -> int:
-        """Estimate token count (rough approximation: 1 token ≈ 3.5 characters)."""
-        return len(text) // 3
+        """Count tokens with the configured token counter (default: 1 token ≈ 3 characters)."""
+        return self.token_counter.count(text)
     
     def split_into_sentences(self, text: str) -> List[str]:
         """Split text into sentences, handling medical abbreviations."""
         # Simple sentence splitting that avoids complex lookbehind
         # Split on sentence endings followed by whitespace and capital letter
-        sentences = re.split(r'[.!?]+\s+(?=[A-Z])', text)
+        sentences = self.patterns['sentence_split'].split(text)
         
         # Clean up and filter sentences
         cleaned_sentences = []
@@ -104,35 +223,72 @@ class NelsonTextbookConverter:
         
         sentences = self.split_into_sentences(content)
         chunks = []
-        current_chunk = []
-        current_tokens = 0
         chunk_number = 1
         
-        for sentence in sentences:
-            sentence_tokens = self.estimate_tokens(sentence)
-            
-            # If adding this sentence would exceed max tokens, finalize current chunk
-            if current_tokens + sentence_tokens > self.max_chunk_tokens and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                # Add chunk if it has reasonable content
-                if len(chunk_text.strip()) > 50:
-                    chunks.append(self.create_chunk_dict(chunk_text, context, chunk_number))
-                    chunk_number += 1
-                current_chunk = [sentence]
-                current_tokens = sentence_tokens
-            else:
-                current_chunk.append(sentence)
-                current_tokens += sentence_tokens
-        
-        # Add final chunk if it exists
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            # Always add the final chunk if it has reasonable content
+        for chunk_sentences in self.group_sentences(sentences):
+            chunk_text = ' '.join(chunk_sentences)
+            # Add chunk if it has reasonable content
             if len(chunk_text.strip()) > 50:
                 chunks.append(self.create_chunk_dict(chunk_text, context, chunk_number))
+                chunk_number += 1
         
         return chunks
     
+    def group_sentences(self, sentences: List[str]) -> List[List[str]]:
+        """Group sentences into chunks that stay within max_chunk_tokens."""
+        token_counts = self.token_counter.count_batch(sentences)
+        return [sentences[start:end] for start, end in self.chunk_boundaries(token_counts, sentences)]
+    
+    def chunk_boundaries(self, token_counts: List[int], sentences: Optional[List[str]] = None) -> List[Tuple[int, int]]:
+        """Return greedy (start, end) sentence ranges from token prefix sums.
+        
+        For every possible start, the furthest end whose cumulative tokens fit
+        the budget comes from one searchsorted over the prefix sums; chunks are
+        then read off by following those ends. A chunk always takes at least one
+        sentence. With chunk_overlap_sentences the next chunk starts that many
+        sentences before the previous end. With an exact token counter and the
+        sentences given, a chunk whose joined text no longer fits (joining
+        sentences can add tokens) is shortened to the longest prefix that does,
+        found by binary search over its end.
+        """
+        n = len(token_counts)
+        if n == 0:
+            return []
+        
+        budget = self.max_chunk_tokens
+        if np is not None:
+            cumulative = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(token_counts, out=cumulative[1:])
+            furthest = np.searchsorted(cumulative, cumulative[:-1] + budget, side='right') - 1
+            furthest = np.maximum(furthest, np.arange(1, n + 1)).tolist()
+        else:
+            cumulative = [0, *itertools.accumulate(token_counts)]
+            furthest = [max(bisect.bisect_right(cumulative, cumulative[i] + budget) - 1, i + 1)
+                        for i in range(n)]
+        
+        refit = sentences is not None and not isinstance(self.token_counter, HeuristicTokenCounter)
+        overlap = self.chunk_overlap_sentences
+        boundaries = []
+        start = 0
+        while start < n:
+            end = furthest[start]
+            if refit and end - start > 1 and self.estimate_tokens(' '.join(sentences[start:end])) > budget:
+                # Longest end that fits lies in [start + 1, end - 1]
+                low, high = start + 1, end - 1
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    if self.estimate_tokens(' '.join(sentences[start:middle])) > budget:
+                        high = middle - 1
+                    else:
+                        low = middle
+                end = low
+            boundaries.append((start, end))
+            if end >= n:
+                break
+            start = max(end - overlap, start + 1)
+        
+        return boundaries
+    
     def create_chunk_dict(self, content: str, context: Dict, chunk_number: int) -> Dict:
         """Create a chunk dictionary with all required fields."""
         summary = self.generate_summary(content)
@@ -208,8 +364,8 @@ class NelsonTextbookConverter:
                 if len(groups) > 1:
                     title = groups[1].strip()
                     # Clean up common title issues
-                    title = re.sub(r'^u\s*', '', title)  # Remove leading 'u'
-                    title = re.sub(r'^[^\w]+', '', title)  # Remove leading non-word chars
+                    title = self.patterns['leading_u'].sub('', title)  # Remove leading 'u'
+                    title = self.patterns['leading_non_word'].sub('', title)  # Remove leading non-word chars
                     title = title.strip()
                     if len(title) > 2:  # Only use if meaningful length
                         chapter_title = title[:100]
@@ -300,14 +456,29 @@ class NelsonTextbookConverter:
                 chunk['content'] = self.clean_content(chunk['content'])
             
             # Generate enhanced summary
-            if chunk.get('content'):
+            if chunk.get('content') and self.tfidf_summarizer is None:
                 chunk['summary'] = self.generate_enhanced_summary(chunk['content'])
             
             # Handle special content types
             chunk = self.handle_special_content(chunk)
         
+        if self.tfidf_summarizer is not None:
+            self.summarize_by_chapter(chunks)
+        
         return chunks
     
+    def summarize_by_chapter(self, chunks: List[Dict]):
+        """Summarize chunks in one TF-IDF batch per chapter."""
+        chapters: Dict[str, List[Dict]] = {}
+        for chunk in chunks:
+            if chunk.get('content'):
+                chapters.setdefault(chunk.get('chapter_number', ''), []).append(chunk)
+        
+        for chapter_chunks in chapters.values():
+            summaries = self.tfidf_summarizer.summarize_batch([c['content'] for c in chapter_chunks])
+            for chunk, summary in zip(chapter_chunks, summaries):
+                chunk['summary'] = summary
+    
     def handle_special_content(self, chunk: Dict) -> Dict:
         """Identify and handle special content types (TOC, Index, etc.)."""
         content = chunk.get('content', '').lower()
@@ -341,20 +512,21 @@ class NelsonTextbookConverter:
     def clean_content(self, content: str) -> str:
         """Clean content by removing metadata contamination."""
         # Remove download attribution
-        content = re.sub(r'Downloaded for [^.]+\.com[^.]*\.', '', content)
-        content = re.sub(r'Downloaded for [^)]+\) at [^.]+\.', '', content)
+        patterns = self.patterns
+        content = patterns['downloaded_domain'].sub('', content)
+        content = patterns['downloaded_at'].sub('', content)
         
         # Remove copyright notices
-        content = re.sub(r'Copyright ©\d{4}\. Elsevier Inc\. All rights reserved\.', '', content)
-        content = re.sub(r'For personal use only\. No other uses without permission\.', '', content)
-        content = re.sub(r'No other uses without permission\. Copyright ©\d{4}\. Elsevier[^.]*\.', '', content)
+        content = patterns['copyright_elsevier'].sub('', content)
+        content = patterns['personal_use'].sub('', content)
+        content = patterns['permission_copyright'].sub('', content)
         
         # Remove page numbers and references
-        content = re.sub(r'\b\d{4}\s+Part [IVX]+\s+[^0-9]*', '', content)
-        content = re.sub(r'\s+\d+\s*$', '', content)  # Trailing page numbers
+        content = patterns['running_header'].sub('', content)
+        content = patterns['trailing_page_number'].sub('', content)  # Trailing page numbers
         
         # Clean up extra whitespace
-        content = re.sub(r'\s+', ' ', content).strip()
+        content = patterns['whitespace'].sub(' ', content).strip()
         
         return content
     
@@ -381,9 +553,9 @@ class NelsonTextbookConverter:
                 if len(match) >= 2 and match[0] == chapter_num:
                     title = match[1].strip()
                     # Clean up the title
-                    title = re.sub(r'^u\s*', '', title)  # Remove leading 'u'
-                    title = re.sub(r'[^\w\s,\-:()]', ' ', title)  # Clean special chars
-                    title = re.sub(r'\s+', ' ', title).strip()
+                    title = self.patterns['leading_u'].sub('', title)  # Remove leading 'u'
+                    title = self.patterns['title_special_chars'].sub(' ', title)  # Clean special chars
+                    title = self.patterns['whitespace'].sub(' ', title).strip()
                     if len(title) > 3 and not title.lower().startswith('downloaded'):
                         return title[:100]
         
@@ -401,10 +573,10 @@ class NelsonTextbookConverter:
                 if len(parts) > 1:
                     after_text = parts[1][:200]  # First 200 chars after indicator
                     # Look for title-like patterns
-                    title_match = re.search(r'^[^\w]*([A-Z][A-Za-z\s,\-:()]{5,80}?)(?=\s+[A-Z][a-z]|\s+\d+|\s*$)', after_text)
+                    title_match = self.patterns['title_after_indicator'].search(after_text)
                     if title_match:
                         title = title_match.group(1).strip()
-                        title = re.sub(r'\s+', ' ', title)
+                        title = self.patterns['whitespace'].sub(' ', title)
                         if len(title) > 3:
                             return title[:100]
         
@@ -450,8 +622,7 @@ class NelsonTextbookConverter:
         first_part = content[:500]
         
         # Pattern 1: All-caps titles (common in medical texts)
-        caps_pattern = r'\b([A-Z][A-Z\s]{10,60})\b'
-        caps_matches = re.findall(caps_pattern, first_part)
+        caps_matches = self.patterns['caps_title'].findall(first_part)
         for match in caps_matches:
             clean_match = match.strip()
             if (len(clean_match) > 10 and 
@@ -461,36 +632,23 @@ class NelsonTextbookConverter:
                 return clean_match[:100]
         
         # Pattern 2: Title case after chapter number
-        title_pattern = rf'{re.escape(chapter_num)}\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)'
-        title_match = re.search(title_pattern, first_part)
+        title_pattern = self.patterns.dynamic('title_after_chapter_number', chapter_num)
+        title_match = title_pattern.search(first_part)
         if title_match:
             title = title_match.group(1).strip()
             if len(title) > 5:
                 return title[:100]
         
         # Pattern 3: Medical terminology patterns
-        medical_terms = [
-            r'\b(Disorders?\s+of\s+[A-Za-z\s]+)',
-            r'\b(Diseases?\s+of\s+[A-Za-z\s]+)',
-            r'\b([A-Z][a-z]+\s+Syndrome)',
-            r'\b([A-Z][a-z]+\s+Deficiency)',
-            r'\b(Congenital\s+[A-Za-z\s]+)',
-            r'\b(Inherited\s+[A-Za-z\s]+)',
-            r'\b([A-Z][a-z]+\s+Discrepancy)',
-            r'\b(Evaluation\s+of\s+[A-Za-z\s]+)',
-            r'\b(Defects\s+in\s+[A-Za-z\s]+)'
-        ]
-        
-        for pattern in medical_terms:
-            match = re.search(pattern, first_part)
+        for pattern in self.medical_title_patterns:
+            match = pattern.search(first_part)
             if match:
                 title = match.group(1).strip()
                 if len(title) > 10 and len(title) < 80:
                     return title[:100]
         
         # Pattern 4: Look for hyphenated medical terms
-        hyphen_pattern = r'\b([A-Z][a-z]+\-[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)'
-        hyphen_match = re.search(hyphen_pattern, first_part)
+        hyphen_match = self.patterns['hyphenated_title'].search(first_part)
         if hyphen_match:
             title = hyphen_match.group(1).strip()
             if len(title) > 8:
@@ -511,25 +669,17 @@ class NelsonTextbookConverter:
             return clean_content
         
         # Split into sentences
-        sentences = re.split(r'[.!?]+', clean_content)
+        sentences = self.patterns['sentence_end'].split(clean_content)
         sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
         
         if not sentences:
             return clean_content[:200]
         
         # Strategy 1: Medical definition patterns (highest priority)
-        medical_definition_patterns = [
-            r'\b(is|are)\s+(a|an|the)\s+(condition|disease|disorder|syndrome)',
-            r'\b(refers to|defined as|characterized by)\b',
-            r'\b(involves|includes|comprises)\s+(the|a|an)',
-            r'\b(occurs when|results from|caused by)\b',
-            r'\b(manifests as|presents with|associated with)\b'
-        ]
-        
         for sentence in sentences[:5]:
             if len(sentence) > 30 and len(sentence) < 250:
-                for pattern in medical_definition_patterns:
-                    if re.search(pattern, sentence, re.IGNORECASE):
+                for pattern in self.medical_definition_patterns:
+                    if pattern.search(sentence):
                         return sentence.strip()
         
         # Strategy 2: Medical terminology priority sentences
@@ -578,17 +728,8 @@ class NelsonTextbookConverter:
             return '', ''
         
         # Look for section-like patterns in content
-        section_patterns = [
-            # Medical section patterns
-            r'\b(TREATMENT|DIAGNOSIS|CLINICAL MANIFESTATIONS|EPIDEMIOLOGY|PATHOGENESIS|PREVENTION|PROGNOSIS)\b',
-            # Numbered patterns
-            r'\b(\d+\.\d+)\s+([A-Z][A-Za-z\s]{5,40})',
-            # All-caps headers
-            r'\b([A-Z][A-Z\s]{8,40})\b'
-        ]
-        
-        for pattern in section_patterns:
-            match = re.search(pattern, content)
+        for pattern in self.inferred_section_patterns:
+            match = pattern.search(content)
             if match:
                 if len(match.groups()) >= 2:
                     # Numbered section found
@@ -689,6 +830,156 @@ class NelsonTextbookConverter:
         # Category 8: Default medical content
         return f"{chapter_num}.M", "MEDICAL CONTENT"
     
+    def find_markers(self, content: str, source: str = '') -> List[Tuple]:
+        """Find structural markers, sorted by position.
+        
+        In 'regex' mode the full structure patterns run under a per-file time
+        budget; if the budget is exhausted (long ALL-CAPS tables, OCR garbage)
+        detection falls back to the linear heuristic scan and logs it. The
+        budget is checked between bounded search windows, so a pattern that
+        backtracks without ever matching is stopped too. 'linear' mode always
+        uses the heuristic scan.
+        """
+        if self.marker_mode == 'linear':
+            return self.find_markers_linear(content)
+        
+        budget = self.marker_time_budget
+        deadline = time.perf_counter() + budget if budget else None
+        markers = []
+        
+        marker_patterns = [('PART', self.part_pattern)]
+        marker_patterns += [('CHAPTER', pattern) for pattern in self.chapter_patterns]
+        marker_patterns += [('SECTION', self.section_pattern),
+                            ('NUMBERED_SUBSECTION', self.numbered_subsection_pattern)]
+        
+        for marker_type, pattern in marker_patterns:
+            matches = pattern.finditer(content) if deadline is None else self._search_windows(pattern, content)
+            for match in matches:
+                if deadline is not None and time.perf_counter() > deadline:
+                    logger.warning(f"Marker detection for {source or 'input'} exceeded its {budget:.1f}s budget "
+                                   f"in pattern '{pattern.stats.name}'; falling back to linear heuristic scan")
+                    return self.find_markers_linear(content)
+                if match is None:
+                    continue  # a window without a match; only there to check the clock
+                if marker_type == 'SECTION':
+                    markers.append((marker_type, match.start(), match.end(), (match.group(1).strip(),)))
+                else:
+                    markers.append((marker_type, match.start(), match.end(), match.groups()))
+        
+        # Sort markers by position
+        markers.sort(key=lambda x: x[1])
+        return markers
+    
+    def _search_windows(self, pattern, content: str) -> Generator:
+        """Yield the matches of ``finditer``, plus None after every window searched without one.
+
+        Each search only considers start positions in one MARKER_SCAN_WINDOW
+        and text up to MARKER_MATCH_MARGIN past it, which bounds the time a
+        single call can spend backtracking. A match that only exists because
+        the text was cut off (only whitespace left before the search end) is
+        searched again with more text.
+        """
+        pos = 0
+        size = len(content)
+        while pos < size:
+            window_end = min(pos + MARKER_SCAN_WINDOW, size)
+            endpos = min(window_end + MARKER_MATCH_MARGIN, size)
+            match = pattern.search(content, pos, endpos)
+            while (match is not None and match.start() < window_end and endpos < size
+                   and not content[match.end():endpos].strip()):
+                yield None
+                endpos = min(endpos + MARKER_MATCH_MARGIN, size)
+                match = pattern.search(content, pos, endpos)
+            if match is None or match.start() >= window_end:
+                pos = window_end
+                yield None
+                continue
+            pos = match.end() if match.end() > match.start() else match.end() + 1
+            yield match
+
+    def find_markers_linear(self, content: str) -> List[Tuple]:
+        """Cheap marker scan whose patterns have no lazy quantifiers or open-ended lookaheads.
+        
+        Every pattern is anchored on a literal or word boundary and uses short
+        bounded repeats, so the work per start position is constant and the scan
+        is linear in the input. Titles are trimmed in Python instead of by
+        lookahead, which makes them slightly less precise than the full patterns.
+        """
+        markers = []
+        patterns = self.patterns
+        
+        for match in patterns['linear_part'].finditer(content):
+            markers.append(('PART', match.start(), match.end(),
+                            (match.group(1), self.trim_heading(match.group(2)))))
+        for match in patterns['linear_chapter'].finditer(content):
+            markers.append(('CHAPTER', match.start(), match.end(),
+                            (match.group(1), self.trim_heading(match.group(2)))))
+        for match in patterns['linear_section'].finditer(content):
+            title = match.group(1).strip()
+            if len(title) >= 9:
+                markers.append(('SECTION', match.start(), match.end(), (title,)))
+        for match in patterns['linear_numbered_subsection'].finditer(content):
+            markers.append(('NUMBERED_SUBSECTION', match.start(), match.end(),
+                            (match.group(1), self.trim_heading(match.group(2)))))
+        
+        markers.sort(key=lambda x: x[1])
+        return markers
+    
+    def merge_overlapping_markers(self, markers: List[Tuple]) -> List[Tuple]:
+        """Collapse markers that detect the same heading into one marker.
+        
+        The chapter patterns often match one heading at the same or overlapping
+        offsets, and the section pattern fires inside those spans. A marker that
+        starts inside another marker's heading (its match, capped at
+        MAX_HEADING_CHARS) is merged into it. The merged marker keeps the
+        higher-priority type (PART, CHAPTER, SECTION, NUMBERED_SUBSECTION). Its end is the end of the last
+        merged marker, which is where segmentation resumed before merging, so
+        segment content is unchanged. Markers further inside an over-long match
+        (a lazy title that ran into prose) are kept.
+        """
+        merged: List[Tuple] = []
+        heading_end = -1
+        
+        for marker in sorted(markers, key=lambda m: m[1]):
+            if merged and marker[1] < heading_end:
+                current = merged[-1]
+                winner = self._preferred_marker(current, marker)
+                merged[-1] = (winner[0], current[1], marker[2], winner[3])
+            else:
+                merged.append(marker)
+                heading_end = min(marker[2], marker[1] + MAX_HEADING_CHARS)
+        
+        return merged
+    
+    def _preferred_marker(self, first: Tuple, second: Tuple) -> Tuple:
+        """Pick the marker that describes a heading matched twice.
+        
+        Different types resolve by priority. For the same type the later marker
+        wins, as it did when every marker was applied in order.
+        """
+        first_rank = MARKER_PRIORITY.get(first[0], 99)
+        second_rank = MARKER_PRIORITY.get(second[0], 99)
+        return first if first_rank < second_rank else second
+    
+    def section_number(self, chapter_number: str, section_counter: int) -> str:
+        """Number a section within its chapter, e.g. '182.3' ('.3' before the first chapter)."""
+        return f"{chapter_number}.{section_counter}"
+    
+    def trim_heading(self, title: str) -> str:
+        """Cut a greedily matched heading where running prose starts."""
+        words = title.split()
+        kept = []
+        for word in words:
+            if kept and not word[0].isupper() and word.lower() not in HEADING_CONNECTORS:
+                break
+            kept.append(word)
+        # Drop a trailing capitalized word that starts the next sentence
+        if len(kept) > 1 and len(kept) < len(words):
+            kept.pop()
+        while kept and kept[-1].lower() in HEADING_CONNECTORS:
+            kept.pop()
+        return ' '.join(kept)[:100]
+    
     def parse_file_structure(self, filepath: str) -> Generator[Dict, None, None]:
         """Parse a file and yield structured content chunks with context inheritance."""
         logger.info(f"Processing file: {filepath}")
@@ -720,27 +1011,12 @@ class NelsonTextbookConverter:
                 # Look for structural markers and split the content accordingly
                 
                 # First, find all structural markers and their positions
-                markers = []
-                
-                # Find PART markers
-                for match in self.part_pattern.finditer(content):
-                    markers.append(('PART', match.start(), match.end(), match.groups()))
-                
-                # Find Chapter markers using multiple patterns
-                for pattern in self.chapter_patterns:
-                    for match in pattern.finditer(content):
-                        markers.append(('CHAPTER', match.start(), match.end(), match.groups()))
-                
-                # Find Section markers (all-caps headers)
-                for match in self.section_pattern.finditer(content):
-                    markers.append(('SECTION', match.start(), match.end(), (match.group(1).strip(),)))
-                
-                # Find Numbered Subsection markers
-                for match in self.numbered_subsection_pattern.finditer(content):
-                    markers.append(('NUMBERED_SUBSECTION', match.start(), match.end(), match.groups()))
-                
-                # Sort markers by position
-                markers.sort(key=lambda x: x[1])
+                markers = self.find_markers(content, filepath)
+                if self.merge_markers:
+                    found = len(markers)
+                    markers = self.merge_overlapping_markers(markers)
+                    logger.info(f"Merged overlapping markers in {Path(filepath).name}: "
+                                f"removed {found - len(markers)} of {found}")
                 
                 # Process content between markers
                 last_pos = 0
@@ -799,7 +1075,7 @@ class NelsonTextbookConverter:
                         section_title = groups[0].strip()
                         # Increment section counter and generate section number
                         section_counter += 1
-                        section_number = f"{current_context.get('chapter_number', '1')}.{section_counter}"
+                        section_number = self.section_number(current_context['chapter_number'], section_counter)
                         
                         current_context.update({
                             'section_number': section_number,
@@ -844,23 +1120,109 @@ class NelsonTextbookConverter:
         except Exception as e:
             logger.error(f"Error processing file {filepath}: {str(e)}")
     
-    def convert_files_to_csv(self, input_pattern: str, output_file: str):
-        """Convert all matching files to structured CSV."""
+    def scan_structure(self, filepath: str) -> Dict:
+        """Build a file's table of contents from the cleaning and marker stages only."""
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as file:
+            content = self.clean_text(file.read())
+        
+        markers = self.find_markers(content, filepath)
+        found = len(markers)
+        if self.merge_markers:
+            markers = self.merge_overlapping_markers(markers)
+        
+        toc: List[Dict] = []
+        part = chapter = section = None
+        section_counter = 0
+        counts = {'parts': 0, 'chapters': 0, 'sections': 0, 'subsections': 0}
+        
+        for marker_type, start_pos, end_pos, groups in markers:
+            if marker_type == 'PART':
+                part = {'type': 'part', 'number': groups[0], 'title': groups[1].strip()[:100],
+                        'offset': start_pos, 'children': []}
+                toc.append(part)
+                chapter = section = None
+                counts['parts'] += 1
+            elif marker_type == 'CHAPTER':
+                title = self.patterns['leading_u'].sub('', groups[1].strip())
+                title = self.patterns['leading_non_word'].sub('', title).strip()[:100]
+                chapter = {'type': 'chapter', 'number': groups[0], 'title': title,
+                           'offset': start_pos, 'children': []}
+                (part['children'] if part else toc).append(chapter)
+                section = None
+                section_counter = 0
+                counts['chapters'] += 1
+            elif marker_type == 'SECTION':
+                section_counter += 1
+                number = self.section_number(chapter['number'] if chapter else '', section_counter)
+                section = {'type': 'section', 'number': number, 'title': groups[0].strip(),
+                           'offset': start_pos, 'children': []}
+                (chapter['children'] if chapter else part['children'] if part else toc).append(section)
+                counts['sections'] += 1
+            elif marker_type == 'NUMBERED_SUBSECTION':
+                subsection = {'type': 'subsection', 'number': groups[0].strip(),
+                              'title': groups[1].strip(), 'offset': start_pos}
+                parent = section or chapter or part
+                (parent['children'] if parent else toc).append(subsection)
+                counts['subsections'] += 1
+        
+        return {
+            'file': Path(filepath).name,
+            'characters': len(content),
+            'markers_found': found,
+            'markers_kept': len(markers),
+            **counts,
+            'toc': toc,
+        }
+    
+    def write_structure_json(self, input_pattern: str, output_file: str) -> bool:
+        """Write a JSON table of contents for all matching files.
+        
+        Returns False if no files matched or any file could not be read or had
+        no chapters, so the scan can gate uploads in CI.
+        """
+        files = sorted(glob.glob(input_pattern))
+        logger.info(f"Scanning structure of {len(files)} files")
+        
+        results = []
+        ok = bool(files)
+        for filepath in files:
+            try:
+                structure = self.scan_structure(filepath)
+            except Exception as e:
+                logger.error(f"Failed to scan {filepath}: {str(e)}")
+                results.append({'file': Path(filepath).name, 'error': str(e)})
+                ok = False
+                continue
+            if not structure['chapters']:
+                logger.warning(f"No chapters found in {Path(filepath).name}")
+                ok = False
+            logger.info(f"Scanned {structure['file']}: {structure['parts']} parts, {structure['chapters']} chapters, "
+                        f"{structure['sections']} sections, {structure['subsections']} subsections")
+            results.append(structure)
+        
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump({'book_title': self.book_title, 'book_edition': self.book_edition, 'files': results},
+                      f, indent=2, ensure_ascii=False)
+        logger.info(f"Structure scan complete: {output_file}")
+        return ok
+    
+    def convert_files_to_csv(self, input_pattern: str, output_file: str,
+                             shard_rows: Optional[int] = None, shard_bytes: Optional[int] = None,
+                             write_index: bool = False, compress: bool = False):
+        """Convert all matching files to structured CSV.
+
+        With ``shard_rows`` or ``shard_bytes`` the output is split at chapter
+        boundaries into numbered shards plus a JSON manifest. ``write_index``
+        writes a byte-offset index sidecar next to every CSV file and
+        ``compress`` adds a dictionary-compressed, chapter-framed ``.zst`` copy.
+        """
         files = sorted(glob.glob(input_pattern))
         logger.info(f"Found {len(files)} files to process")
         
-        fieldnames = [
-            'book_title', 'book_edition', 'chapter_number', 'chapter_title',
-            'section_number', 'section_title', 'subsection_number', 'subsection_title',
-            'chunk_number', 'content', 'summary'
-        ]
-        
         total_chunks = 0
         
-        with open(output_file, 'w', encoding='utf-8', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            writer.writeheader()
-            
+        with StructuredCSVWriter(output_file, FIELDNAMES, shard_rows=shard_rows,
+                                 shard_bytes=shard_bytes, write_index=write_index) as writer:
             for filepath in files:
                 file_chunks = 0
                 try:
@@ -877,19 +1239,98 @@ class NelsonTextbookConverter:
                 except Exception as e:
                     logger.error(f"Failed to process {filepath}: {str(e)}")
         
-        logger.info(f"Conversion complete! Generated {total_chunks} chunks in {output_file}")
+        if compress:
+            for shard in writer.shards:
+                compress_structured_csv(shard['path'])
+        
+        if writer.sharded:
+            logger.info(f"Conversion complete! Generated {total_chunks} chunks in {len(writer.shards)} shards "
+                        f"(manifest: {manifest_path_for(output_file)})")
+        else:
+            logger.info(f"Conversion complete! Generated {total_chunks} chunks in {output_file}")
+
+def non_negative_int(value: str) -> int:
+    """argparse type for counts that may be zero but not negative."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be >= 0, got {number}")
+    return number
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(
+        description='Convert Nelson Textbook text files into a structured, chunked CSV.'
+    )
+    parser.add_argument('--input', default='*.txt',
+                        help='Glob pattern of input text files (default: *.txt)')
+    parser.add_argument('--output', default='nelson_textbook_structured.csv',
+                        help='Output CSV path (default: nelson_textbook_structured.csv)')
+    parser.add_argument('--shard-rows', type=int,
+                        help='Split output into shards of at most this many rows (at chapter boundaries)')
+    parser.add_argument('--shard-bytes', type=int,
+                        help='Split output into shards of at most this many bytes (at chapter boundaries)')
+    parser.add_argument('--index', action='store_true',
+                        help='Write a byte-offset index sidecar (<csv>.idx.json) for random access')
+    parser.add_argument('--compress', action='store_true',
+                        help='Also write a dictionary-compressed zstd copy of each CSV (<csv>.zst plus .zst.dict and '
+                             '.zst.frames.json, requires zstandard); the CSV itself is kept')
+    parser.add_argument('--summarizer', choices=['rules', 'tfidf'], default='rules',
+                        help='Summary method: per-chunk rules or batch TF-IDF per chapter (requires numpy)')
+    parser.add_argument('--regex-report', metavar='PATH',
+                        help='Write per-pattern regex timings as JSON to PATH and log the hottest patterns')
+    parser.add_argument('--marker-mode', choices=['regex', 'linear'], default='regex',
+                        help='Structure detection: full regexes with a time budget, or the linear heuristic scan')
+    parser.add_argument('--marker-time-budget', type=float, default=10.0,
+                        help='Seconds per file for regex marker detection before falling back (0 disables)')
+    parser.add_argument('--no-marker-merge', action='store_true',
+                        help='Keep duplicate and overlapping structure markers (previous behaviour)')
+    parser.add_argument('--structure-only', action='store_true',
+                        help='Only clean and detect markers, writing a JSON table of contents (exit 1 if a file has no chapters)')
+    parser.add_argument('--toc-output', default='nelson_textbook_toc.json',
+                        help='Table of contents path for --structure-only (default: nelson_textbook_toc.json)')
+    parser.add_argument('--token-counter', choices=['heuristic', 'whitespace', 'bpe'], default='heuristic',
+                        help='Token counting for chunk budgets: len/3 heuristic, whitespace words, or BPE (requires tiktoken)')
+    parser.add_argument('--chunk-overlap', type=non_negative_int, default=0,
+                        help='Sentences repeated at the start of the following chunk (default: 0)')
+    parser.add_argument('--quality', action='store_true',
+                        help='Compute quality metrics for the output (<stem>.quality.json/.md, requires numpy) '
+                             'and exit 1 if a metric misses its target')
+    return parser
 
 def main():
     """Main execution function."""
-    converter = NelsonTextbookConverter()
+    args = create_parser().parse_args()
+    converter = NelsonTextbookConverter(summarizer=args.summarizer, marker_mode=args.marker_mode,
+                                        marker_time_budget=args.marker_time_budget or None,
+                                        merge_markers=not args.no_marker_merge,
+                                        token_counter=args.token_counter,
+                                        chunk_overlap_sentences=args.chunk_overlap)
+    
+    exit_code = 0
+    if args.structure_only:
+        if not converter.write_structure_json(args.input, args.toc_output):
+            logger.error("Structure scan found files without chapters or unreadable files")
+            exit_code = 1
+    else:
+        logger.info("Starting Nelson Textbook conversion to structured CSV...")
+        converter.convert_files_to_csv(args.input, args.output,
+                                       shard_rows=args.shard_rows, shard_bytes=args.shard_bytes,
+                                       write_index=args.index, compress=args.compress)
+        logger.info("Conversion completed successfully!")
+        
+        if args.quality:
+            sharded = bool(args.shard_rows or args.shard_bytes)
+            report = write_quality_report(manifest_path_for(args.output) if sharded else args.output)
+            for failure in quality_failures(report):
+                logger.error(f"Quality gate: {failure}")
+                exit_code = 1
     
-    # Convert all .txt files in current directory
-    input_pattern = "*.txt"
-    output_file = "nelson_textbook_structured.csv"
+    if args.regex_report:
+        with open(args.regex_report, 'w', encoding='utf-8') as f:
+            json.dump(converter.patterns.report(), f, indent=2)
+        logger.info(f"Regex profile (hottest first):\n{converter.patterns.format_report()}")
     
-    logger.info("Starting Nelson Textbook conversion to structured CSV...")
-    converter.convert_files_to_csv(input_pattern, output_file)
-    logger.info("Conversion completed successfully!")
+    return exit_code
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Shared Corpus Store
+Columnar, memory-mapped snapshots of chunk texts, embeddings and built search indexes, shared read-only by workers.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from nelson_dataset import FIELDNAMES, file_sha256, iter_rows
+from nelson_retrieval import (QUERY_SET_FILE, BitmapField, BitmapFilterIndex, HashingEmbedder, InProcessBackend,
+                              LexicalBackend, LexicalIndex, chunk_text, load_chapter_books, load_query_set)
+
+# Optional: NumPy for the offsets and the memory-mapped vectors
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 2
+STORE_HEADER = 'store.json'
+VECTORS_FILE = 'vectors.npy'
+VOCABULARY_FILE = 'lexical.vocabulary.txt'
+LEXICAL_ARRAYS = ('postings', 'indptr', 'idf', 'weights')
+FILTER_FIELDS = ('chapters', 'suffixes', 'books')
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy not found. Please install with: pip install numpy")
+
+
+def build_corpus_store(data_path: str, output_dir: str, dim: int = 1536, batch_size: int = 1024,
+                       toc_file: Optional[str] = None) -> Dict:
+    """Write a corpus store for a CSV, shard manifest or .zst output; returns the header.
+
+    Each text column is stored the way Arrow stores a string array: one
+    UTF-8 data buffer plus an int64 offsets array with rows + 1 entries.
+    Embeddings are a float32 ``.npy`` matrix. The built BM25 index (CSR
+    postings, idf, per-posting weights and the vocabulary in term order) and
+    the packed filter bitmaps are saved as arrays too. Every file is written
+    once and only ever mapped read-only afterwards, so the page cache holds a
+    single copy however many processes open the store.
+    """
+    _require_numpy()
+    out = Path(output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    # A rebuild in place must not leave an old header describing new files
+    (out / STORE_HEADER).unlink(missing_ok=True)
+    rows = list(iter_rows(data_path))
+
+    for column in FIELDNAMES:
+        encoded = [row.get(column, '').encode('utf-8') for row in rows]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        np.save(out / f"{column}.offsets.npy", offsets)
+        with open(out / f"{column}.data", 'wb') as f:
+            f.write(b''.join(encoded))
+
+    embedder = HashingEmbedder(dim=dim)
+    vectors = np.lib.format.open_memmap(out / VECTORS_FILE, mode='w+', dtype=np.float32, shape=(len(rows), dim))
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        vectors[start:start + len(batch)] = embedder.embed([chunk_text(row) for row in batch])
+    vectors.flush()
+    del vectors
+
+    lexical = LexicalIndex([chunk_text(row) for row in rows])
+    for name in LEXICAL_ARRAYS:
+        np.save(out / f"lexical.{name}.npy", getattr(lexical, name))
+    # Tokens are [a-z0-9]+, so a newline never occurs inside one
+    with open(out / VOCABULARY_FILE, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lexical.vocabulary))
+
+    filter_index = BitmapFilterIndex(rows, load_chapter_books(toc_file) if toc_file else None)
+    for name in FILTER_FIELDS:
+        np.save(out / f"filters.{name}.npy", getattr(filter_index, name).bitmaps)
+
+    header = {
+        'version': STORE_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'rows': len(rows),
+        'columns': FIELDNAMES,
+        'embedding_dim': dim,
+        'embedder': 'hashing',
+        'source': Path(data_path).name,
+        'source_sha256': file_sha256(data_path),
+        'toc': Path(toc_file).name if toc_file else None,
+        'lexical': {'k1': lexical.k1, 'b': lexical.b, 'terms': len(lexical.vocabulary)},
+        'filters': {name: list(getattr(filter_index, name)) for name in FILTER_FIELDS},
+    }
+    # Sizes let a truncated or partially replaced file be caught without reading it
+    header['files'] = {path.name: path.stat().st_size for path in sorted(out.iterdir())
+                       if path.name != STORE_HEADER}
+    # The header goes last, so a store without one is known to be incomplete
+    with open(out / STORE_HEADER, 'w', encoding='utf-8') as f:
+        json.dump(header, f, indent=2)
+    return header
+
+
+class StringColumn:
+    """Read-only string column over a mapped offsets array and data buffer."""
+
+    def __init__(self, offsets: 'np.ndarray', data: 'np.ndarray'):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return self.data[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+class CorpusRow(Mapping):
+    """One row as a read-only mapping; each column is decoded only when it is read."""
+
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns: Dict[str, StringColumn], index: int):
+        self.columns = columns
+        self.index = index
+
+    def __getitem__(self, column: str) -> str:
+        return self.columns[column][self.index]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+
+class CorpusRows:
+    """Sequence of rows decoded on access, usable wherever a list of CSV row dicts is read.
+
+    Rows are :class:`CorpusRow` mappings; use ``dict(row)`` where a real dict
+    is needed, e.g. for JSON output.
+    """
+
+    def __init__(self, store: 'CorpusStore'):
+        self.store = store
+
+    def __len__(self) -> int:
+        return self.store.rows
+
+    def __getitem__(self, index: int) -> CorpusRow:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return CorpusRow(self.store.columns, index)
+
+    def __iter__(self) -> Iterator[CorpusRow]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+class CorpusStore:
+    """Opens a corpus store read-only; nothing is copied into private memory.
+
+    ``source`` is optional: when given, the store must have been built from
+    a file with the same SHA-256 (for a shard manifest, the hash of the
+    manifest, which lists every shard's hash), otherwise a ValueError is
+    raised. The indexes are restored from their saved arrays on first use.
+    """
+
+    def __init__(self, store_dir: str, source: Optional[str] = None):
+        _require_numpy()
+        self.store_dir = Path(store_dir)
+        header_file = self.store_dir / STORE_HEADER
+        if not header_file.exists():
+            raise FileNotFoundError(f"No {STORE_HEADER} in {store_dir}; the store is missing or incomplete")
+        with open(header_file, 'r', encoding='utf-8') as f:
+            self.header = json.load(f)
+        if self.header.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported corpus store version {self.header.get('version')}; "
+                             f"rebuild it with: python corpus_store.py build")
+        for name, size in self.header['files'].items():
+            path = self.store_dir / name
+            if not path.exists() or path.stat().st_size != size:
+                raise ValueError(f"{path} is missing or has the wrong size; rebuild the store")
+        if source is not None and file_sha256(source) != self.header['source_sha256']:
+            raise ValueError(f"{store_dir} was built from a different version of {source}")
+
+        self.rows = self.header['rows']
+        self.columns: Dict[str, StringColumn] = {}
+        for column in self.header['columns']:
+            offsets = np.load(self.store_dir / f"{column}.offsets.npy", mmap_mode='r')
+            data_file = self.store_dir / f"{column}.data"
+            # np.memmap refuses empty files
+            data = (np.memmap(data_file, dtype=np.uint8, mode='r') if os.path.getsize(data_file)
+                    else np.zeros(0, dtype=np.uint8))
+            self.columns[column] = StringColumn(offsets, data)
+        self.vectors = np.load(self.store_dir / VECTORS_FILE, mmap_mode='r')
+        self._lexical: Optional[LexicalIndex] = None
+        self._filters: Optional[BitmapFilterIndex] = None
+
+    def row_view(self) -> CorpusRows:
+        return CorpusRows(self)
+
+    def lexical_index(self) -> LexicalIndex:
+        """The BM25 index over the mapped postings; only the vocabulary dict is built in memory."""
+        if self._lexical is None:
+            with open(self.store_dir / VOCABULARY_FILE, 'r', encoding='utf-8') as f:
+                terms = f.read().split('\n') if self.header['lexical']['terms'] else []
+            arrays = {name: np.load(self.store_dir / f"lexical.{name}.npy", mmap_mode='r')
+                      for name in LEXICAL_ARRAYS}
+            self._lexical = LexicalIndex.from_arrays(dict(zip(terms, range(len(terms)))), size=self.rows,
+                                                     k1=self.header['lexical']['k1'],
+                                                     b=self.header['lexical']['b'], **arrays)
+        return self._lexical
+
+    def filter_index(self) -> BitmapFilterIndex:
+        """The chapter, section suffix and book bitmaps, mapped from the store."""
+        if self._filters is None:
+            fields = {name: BitmapField.from_arrays(self.header['filters'][name],
+                                                    np.load(self.store_dir / f"filters.{name}.npy", mmap_mode='r'),
+                                                    self.rows)
+                      for name in FILTER_FIELDS}
+            self._filters = BitmapFilterIndex.from_fields(**fields)
+        return self._filters
+
+    def backend(self, **kwargs) -> InProcessBackend:
+        """An in-process vector backend that searches the mapped vectors directly."""
+        return InProcessBackend(self.row_view(), HashingEmbedder(dim=self.header['embedding_dim']),
+                                vectors=self.vectors, filter_index=self.filter_index(), **kwargs)
+
+    def lexical_backend(self) -> LexicalBackend:
+        """A BM25 backend over the restored lexical index."""
+        return LexicalBackend(self.row_view(), index=self.lexical_index(), filter_index=self.filter_index())
+
+
+def measure_startup(store_dir: str, query: str, source: Optional[str] = None) -> Dict[str, float]:
+    """Time opening the store, restoring each backend and answering its first query, in milliseconds."""
+    timings = {}
+    start = time.perf_counter()
+    store = CorpusStore(store_dir, source=source)
+    timings['open_ms'] = (time.perf_counter() - start) * 1000.0
+    for name, make_backend in (('vector', store.backend), ('lexical', store.lexical_backend)):
+        start = time.perf_counter()
+        backend = make_backend()
+        timings[f'{name}_restore_ms'] = (time.perf_counter() - start) * 1000.0
+        start = time.perf_counter()
+        backend.search(query, 10)
+        timings[f'{name}_first_query_ms'] = (time.perf_counter() - start) * 1000.0
+    return {name: round(value, 1) for name, value in timings.items()}
+
+
+def process_memory() -> Dict[str, Optional[float]]:
+    """RSS, PSS and private memory of this process in MB (Linux; None elsewhere).
+
+    PSS splits each shared page between the processes mapping it, so summing
+    PSS over workers gives their true combined footprint.
+    """
+    fields = {'Rss': None, 'Pss': None, 'Private_Clean': None, 'Private_Dirty': None}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    fields[name] = int(value.split()[0]) / 1024.0
+    except OSError:
+        pass
+    private = (fields['Private_Clean'] + fields['Private_Dirty']
+               if fields['Private_Clean'] is not None and fields['Private_Dirty'] is not None else None)
+    return {'rss_mb': fields['Rss'], 'pss_mb': fields['Pss'], 'private_mb': private}
+
+
+def _worker(store_dir: Optional[str], data_path: Optional[str], queries: List[str], dim: int,
+            ready, proceed, results):
+    start = time.perf_counter()
+    if store_dir:
+        backend = CorpusStore(store_dir).backend()
+    else:
+        backend = InProcessBackend(list(iter_rows(data_path)), HashingEmbedder(dim=dim))
+    startup = time.perf_counter() - start
+    for query in queries:
+        backend.search(query, 10)
+    # Measure once every worker is up, so shared pages are counted across all of them
+    ready.wait()
+    memory = process_memory()
+    memory['startup_seconds'] = round(startup, 3)
+    results.put(memory)
+    proceed.wait()
+
+
+def measure_workers(workers: int, queries: List[str], store_dir: Optional[str] = None,
+                    data_path: Optional[str] = None, dim: int = 1536) -> Dict:
+    """Start ``workers`` processes that each open the store (or load the CSV) and search; report memory."""
+    context = multiprocessing.get_context('spawn')
+    ready = context.Barrier(workers)
+    proceed = context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=_worker, args=(store_dir, data_path, queries, dim, ready, proceed, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    memories = [results.get() for _ in processes]
+    proceed.set()
+    for process in processes:
+        process.join()
+
+    def total(key: str) -> Optional[float]:
+        values = [memory[key] for memory in memories]
+        return round(sum(values), 1) if None not in values else None
+
+    return {
+        'workers': workers,
+        'source': 'store' if store_dir else 'csv',
+        'rss_mb_per_worker': round(max(memory['rss_mb'] or 0 for memory in memories), 1),
+        'private_mb_per_worker': round(max(memory['private_mb'] or 0 for memory in memories), 1),
+        'pss_mb_total': total('pss_mb'),
+        'startup_seconds': max(memory['startup_seconds'] for memory in memories),
+    }
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(description='Shared, memory-mapped corpus store for retrieval workers.')
+    subparsers = parser.add_subparsers(dest='command', help='Available commands')
+
+    build_parser = subparsers.add_parser('build', help='Build a store from converter output')
+    build_parser.add_argument('--data', default='nelson_textbook_structured.csv',
+                              help='Structured CSV, shard manifest or .zst output (default: nelson_textbook_structured.csv)')
+    build_parser.add_argument('--output', default='nelson_corpus_store', help='Store directory (default: nelson_corpus_store)')
+    build_parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension (default: 1536)')
+    build_parser.add_argument('--toc', metavar='PATH',
+                              help='TOC from --structure-only output, for the book filter bitmaps')
+
+    startup_parser = subparsers.add_parser('startup', help='Time a cold start from the store')
+    startup_parser.add_argument('--store', default='nelson_corpus_store', help='Store directory (default: nelson_corpus_store)')
+    startup_parser.add_argument('--source', help='Check the store was built from this CSV or shard manifest')
+    startup_parser.add_argument('--query', default='management of acute otitis media in children',
+                                help='First query to answer')
+
+    measure_parser = subparsers.add_parser('measure', help='Compare worker memory with and without the store')
+    measure_parser.add_argument('--store', default='nelson_corpus_store', help='Store directory (default: nelson_corpus_store)')
+    measure_parser.add_argument('--data', help='Also measure workers that each load this CSV themselves')
+    measure_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                                help='Worker counts to measure (default: 1 2 4)')
+    measure_parser.add_argument('--queries', default=QUERY_SET_FILE, help=f'Query set to run (default: {QUERY_SET_FILE})')
+    return parser
+
+
+def main():
+    """Main entry point"""
+    parser = create_parser()
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.command == 'build':
+        header = build_corpus_store(args.data, args.output, dim=args.dim, toc_file=args.toc)
+        print(f"{args.output}: {header['rows']} rows, {header['embedding_dim']}-d vectors, "
+              f"{header['lexical']['terms']} terms")
+        return 0
+    if args.command == 'startup':
+        try:
+            timings = measure_startup(args.store, args.query, source=args.source)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        for name, value in timings.items():
+            print(f"{name:>24} {value:>8.1f}")
+        return 0
+    if args.command == 'measure':
+        queries = [query['query'] for query in load_query_set(args.queries)['queries']]
+        dim = CorpusStore(args.store).header['embedding_dim']
+        runs = [measure_workers(workers, queries, store_dir=args.store) for workers in args.workers]
+        if args.data:
+            runs += [measure_workers(workers, queries, data_path=args.data, dim=dim) for workers in args.workers]
+        print(f"{'source':>6} {'workers':>7} {'RSS/worker MB':>13} {'private/worker MB':>17} "
+              f"{'PSS total MB':>12} {'startup s':>9}")
+        for run in runs:
+            print(f"{run['source']:>6} {run['workers']:>7} {run['rss_mb_per_worker']:>13.1f} "
+                  f"{run['private_mb_per_worker']:>17.1f} {run['pss_mb_total'] or 0:>12.1f} "
+                  f"{run['startup_seconds']:>9.2f}")
+        return 0
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Adversarial Marker Detection Benchmark
+Times structure-marker detection on pathological inputs to catch super-linear regex behaviour.
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+from convert_to_structured_csv import NelsonTextbookConverter
+
+logger = logging.getLogger(__name__)
+
+
+def _repeat_to(unit: str, size: int) -> str:
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def _ocr_garbage(size: int) -> str:
+    rng = random.Random(1729)
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ      .,-~|'
+    return ''.join(rng.choice(alphabet) for _ in range(size))
+
+
+# Each case builds a single-line input of the requested size
+ADVERSARIAL_CASES: Dict[str, Callable[[int], str]] = {
+    'caps_table': lambda size: _repeat_to('ABCDEF GHIJ KLMN OPQRS ', size),
+    'caps_wide_spacing': lambda size: _repeat_to('A' + ' ' * 40, size),
+    'ocr_garbage': _ocr_garbage,
+    'chapter_heads_no_titles': lambda size: _repeat_to('Chapter 12 ' + '-' * 30, size),
+    'part_heads_no_digits': lambda size: _repeat_to('PART IV ' + 'x' * 50 + ' ', size),
+    'part_heads_never_matching': lambda size: _repeat_to('PART I abc ', size - 2) + 'x1',
+    'numbered_runs': lambda size: _repeat_to('184.1 ' + 'A' * 90 + ' ', size),
+}
+
+
+def time_markers(converter: NelsonTextbookConverter, text: str) -> float:
+    start = time.perf_counter()
+    converter.find_markers(text, 'benchmark')
+    return time.perf_counter() - start
+
+
+def run_benchmark(sizes: List[int], budget: float) -> Dict:
+    """Time regex (budgeted) and linear marker detection on every case and size."""
+    modes = {
+        'regex': NelsonTextbookConverter(marker_mode='regex', marker_time_budget=budget),
+        'linear': NelsonTextbookConverter(marker_mode='linear'),
+    }
+    results = {'budget_seconds': budget, 'sizes': sizes, 'cases': {}}
+    failures = []
+
+    for case, build in ADVERSARIAL_CASES.items():
+        case_results = {}
+        for mode, converter in modes.items():
+            timings = [time_markers(converter, build(size)) for size in sizes]
+            # Empirical growth exponent between the smallest and largest input
+            exponent = None
+            if len(sizes) > 1 and timings[0] > 0:
+                exponent = math.log(timings[-1] / timings[0]) / math.log(sizes[-1] / sizes[0])
+            case_results[mode] = {
+                'seconds': [round(t, 4) for t in timings],
+                'mb_per_second': [round(size / t / 1e6, 2) if t else None for size, t in zip(sizes, timings)],
+                'growth_exponent': round(exponent, 2) if exponent is not None else None,
+            }
+            # The budget is checked between search windows, so allow one window worth of slack
+            if max(timings) > budget * 1.5:
+                failures.append(f"{case}/{mode}: {max(timings):.2f}s exceeds budget {budget:.2f}s")
+            if mode == 'linear' and exponent is not None and exponent > 1.5:
+                failures.append(f"{case}/linear: growth exponent {exponent:.2f} is super-linear")
+        results['cases'][case] = case_results
+
+    results['failures'] = failures
+    return results
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(description='Adversarial-input benchmark for structure marker detection.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250_000, 1_000_000],
+                        help='Input sizes in characters (default: 250000 1000000)')
+    parser.add_argument('--budget', type=float, default=2.0,
+                        help='Per-input time budget in seconds (default: 2.0)')
+    parser.add_argument('--json', metavar='PATH', help='Also write results as JSON to PATH')
+    return parser
+
+
+def main():
+    """Main entry point"""
+    args = create_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run_benchmark(sorted(args.sizes), args.budget)
+    print(f"{'case':<26} {'mode':<7} {'seconds':>24} {'growth':>7}")
+    for case, modes in results['cases'].items():
+        for mode, stats in modes.items():
+            seconds = ' '.join(f"{t:.3f}" for t in stats['seconds'])
+            growth = stats['growth_exponent']
+            print(f"{case:<26} {mode:<7} {seconds:>24} {growth if growth is not None else '-':>7}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    for failure in results['failures']:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if results['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Structured Dataset I/O
+Writers and readers for the structured CSV produced by convert_to_structured_csv.py.
+"""
+
+import argparse
+import bisect
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+# Optional: zstandard for dictionary-compressed output
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+FIELDNAMES = [
+    'book_title', 'book_edition', 'chapter_number', 'chapter_title',
+    'section_number', 'section_title', 'subsection_number', 'subsection_title',
+    'chunk_number', 'content', 'summary'
+]
+
+MANIFEST_VERSION = 1
+INDEX_VERSION = 1
+FRAMES_VERSION = 1
+
+
+def format_csv_row(values: List) -> bytes:
+    """Encode one row exactly as csv.DictWriter(quoting=QUOTE_ALL) writes it."""
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerow(values)
+    return buffer.getvalue().encode('utf-8')
+
+
+def manifest_path_for(output_file: str) -> str:
+    """Return the manifest path that belongs to an output CSV path."""
+    path = Path(output_file)
+    return str(path.with_name(f"{path.stem}.manifest.json"))
+
+
+def index_path_for(csv_file: str) -> str:
+    """Return the offset index sidecar path that belongs to a CSV path."""
+    return f"{csv_file}.idx.json"
+
+
+def _chunk_sort_key(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def row_index_key(row: Dict) -> Tuple[str, str, int]:
+    """Return the (chapter_number, section_number, chunk_number) key of a row."""
+    return (str(row.get('chapter_number', '')), str(row.get('section_number', '')),
+            _chunk_sort_key(row.get('chunk_number')))
+
+
+def write_offset_index(csv_file: str, entries: List[Tuple[str, str, int, int, int]],
+                       size: int) -> str:
+    """Write a sorted offset index sidecar for ``csv_file`` and return its path.
+
+    Each entry is ``(chapter_number, section_number, chunk_number, offset, length)``
+    where offset and length are in bytes into the CSV file.
+    """
+    index_file = index_path_for(csv_file)
+    index = {
+        'version': INDEX_VERSION,
+        'csv': os.path.basename(csv_file),
+        'size': size,
+        'entries': sorted(entries),
+    }
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    return index_file
+
+
+def _iter_csv_records(f) -> Iterator[Tuple[int, bytes]]:
+    """Yield (offset, raw bytes) for each record of a binary CSV stream.
+
+    A record ends at a newline once an even number of quote characters has been
+    seen, which is how quoted fields with embedded newlines are kept together.
+    """
+    offset = 0
+    pending = b''
+    quotes = 0
+    for line in f:
+        pending += line
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            yield offset, pending
+            offset += len(pending)
+            pending = b''
+            quotes = 0
+    if pending:
+        yield offset, pending
+
+
+def build_offset_index(csv_file: str) -> str:
+    """Scan an existing structured CSV once and write its offset index sidecar."""
+    entries = []
+    with open(csv_file, 'rb') as f:
+        records = _iter_csv_records(f)
+        header_offset, header = next(records)
+        fieldnames = next(csv.reader([header.decode('utf-8')]))
+        size = len(header)
+        for offset, raw in records:
+            values = next(csv.reader([raw.decode('utf-8')]), None)
+            size = offset + len(raw)
+            if not values:
+                continue
+            entries.append(row_index_key(dict(zip(fieldnames, values))) + (offset, len(raw)))
+    return write_offset_index(csv_file, entries, size)
+
+
+class StructuredCSVWriter:
+    """Write structured chunks to one CSV or to size-bounded shards.
+
+    Rows are grouped by chapter and a shard is only rotated between chapter
+    groups, so a contiguous run of rows for one chapter is never split across
+    shards; a chapter that reappears later in the input may land in another
+    shard. When neither
+    ``shard_rows`` nor ``shard_bytes`` is set, a single CSV is written to
+    ``output_file`` byte-for-byte as before. With ``write_index`` every CSV
+    file gets an offset index sidecar for :class:`IndexedCSVReader`.
+    """
+
+    def __init__(self, output_file: str, fieldnames: List[str] = FIELDNAMES,
+                 shard_rows: Optional[int] = None, shard_bytes: Optional[int] = None,
+                 write_index: bool = False):
+        self.output_file = output_file
+        self.fieldnames = fieldnames
+        self.shard_rows = shard_rows
+        self.shard_bytes = shard_bytes
+        self.write_index = write_index
+        self.sharded = bool(shard_rows or shard_bytes)
+        self.header = format_csv_row(fieldnames)
+
+        self.shards: List[Dict] = []
+        self.total_rows = 0
+        self._file = None
+        self._hasher = None
+        self._shard = None
+        self._group: List[Tuple[bytes, Tuple[str, str, int]]] = []
+        self._group_key = None
+        self._index_entries: List[Tuple[str, str, int, int, int]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _shard_path(self, index: int) -> str:
+        path = Path(self.output_file)
+        return str(path.with_name(f"{path.stem}-{index:05d}{path.suffix}"))
+
+    def _open_shard(self):
+        path = self._shard_path(len(self.shards)) if self.sharded else self.output_file
+        self._file = open(path, 'wb')
+        self._hasher = hashlib.sha256()
+        self._shard = {
+            'path': path,
+            'row_start': self.total_rows,
+            'row_end': self.total_rows,
+            'bytes': 0,
+            'chapters': [],
+        }
+        self._index_entries = []
+        self._write_bytes(self.header)
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._shard['sha256'] = self._hasher.hexdigest()
+        if self.write_index:
+            write_offset_index(self._shard['path'], self._index_entries, self._shard['bytes'])
+        self.shards.append(self._shard)
+        self._file = None
+        self._shard = None
+
+    def _write_bytes(self, data: bytes):
+        self._file.write(data)
+        self._hasher.update(data)
+        self._shard['bytes'] += len(data)
+
+    def _would_overflow(self, rows: int, size: int) -> bool:
+        shard_rows = self._shard['row_end'] - self._shard['row_start']
+        if shard_rows == 0:
+            return False
+        if self.shard_rows and shard_rows + rows > self.shard_rows:
+            return True
+        if self.shard_bytes and self._shard['bytes'] + size > self.shard_bytes:
+            return True
+        return False
+
+    def _flush_group(self):
+        if not self._group:
+            return
+        size = sum(len(row) for row, _ in self._group)
+        if self._file is None:
+            self._open_shard()
+        elif self.sharded and self._would_overflow(len(self._group), size):
+            self._close_shard()
+            self._open_shard()
+
+        for row, key in self._group:
+            if self.write_index:
+                self._index_entries.append(key + (self._shard['bytes'], len(row)))
+            self._write_bytes(row)
+        self._shard['row_end'] += len(self._group)
+        self.total_rows += len(self._group)
+        if self._group_key not in self._shard['chapters']:
+            self._shard['chapters'].append(self._group_key)
+        self._group = []
+
+    def writerow(self, row: Dict):
+        """Buffer a row; rows are flushed whenever the chapter changes."""
+        chapter = str(row.get('chapter_number', ''))
+        if self._group and chapter != self._group_key:
+            self._flush_group()
+        self._group_key = chapter
+        self._group.append((format_csv_row([row.get(field, '') for field in self.fieldnames]),
+                            row_index_key(row)))
+
+    def close(self):
+        """Flush pending rows, close the open shard and write the manifest."""
+        self._flush_group()
+        if self._file is None and not self.shards:
+            self._open_shard()
+        self._close_shard()
+        if self.sharded:
+            self.write_manifest()
+
+    def write_manifest(self) -> str:
+        """Write a JSON manifest describing every shard and return its path."""
+        manifest_file = manifest_path_for(self.output_file)
+        base_dir = Path(manifest_file).parent
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'fieldnames': self.fieldnames,
+            'total_rows': self.total_rows,
+            'shard_rows': self.shard_rows,
+            'shard_bytes': self.shard_bytes,
+            'shards': [
+                {
+                    'path': os.path.relpath(shard['path'], base_dir),
+                    'row_start': shard['row_start'],
+                    'row_end': shard['row_end'],
+                    'bytes': shard['bytes'],
+                    'chapters': shard['chapters'],
+                    'sha256': shard['sha256'],
+                }
+                for shard in self.shards
+            ],
+        }
+        with open(manifest_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        logger.info(f"Wrote manifest for {len(self.shards)} shards to {manifest_file}")
+        return manifest_file
+
+
+def load_manifest(manifest_file: str) -> Dict:
+    """Load a shard manifest, resolving shard paths relative to the manifest."""
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    base_dir = Path(manifest_file).parent
+    for shard in manifest['shards']:
+        shard['path'] = str(base_dir / shard['path'])
+    return manifest
+
+
+def file_sha256(path: str) -> str:
+    """Hex SHA-256 of a file, read in 1 MB blocks."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def verify_manifest(manifest_file: str) -> List[str]:
+    """Return the paths of shards whose checksum no longer matches the manifest."""
+    return [shard['path'] for shard in load_manifest(manifest_file)['shards']
+            if file_sha256(shard['path']) != shard['sha256']]
+
+
+class IndexedCSVReader:
+    """Random access to a structured CSV through its offset index sidecar.
+
+    The sorted index is loaded once; each lookup is a binary search followed by
+    seeking to and parsing only the matching rows.
+    """
+
+    def __init__(self, csv_file: str, index_file: Optional[str] = None):
+        self.csv_file = csv_file
+        index_file = index_file or index_path_for(csv_file)
+        if not os.path.exists(index_file):
+            raise FileNotFoundError(f"No offset index for {csv_file}; run build_offset_index() first")
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version {index.get('version')} in {index_file}")
+        if os.path.getsize(csv_file) != index['size']:
+            raise ValueError(f"Offset index {index_file} is stale for {csv_file}")
+
+        self._keys = [tuple(entry[:3]) for entry in index['entries']]
+        self._spans = [tuple(entry[3:]) for entry in index['entries']]
+        self._file = open(csv_file, 'rb')
+        header = self._file.readline().decode('utf-8')
+        self.fieldnames = next(csv.reader([header]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def close(self):
+        self._file.close()
+
+    def _read_rows(self, lo: int, hi: int) -> List[Dict]:
+        rows = []
+        for offset, length in sorted(self._spans[lo:hi]):
+            self._file.seek(offset)
+            raw = self._file.read(length).decode('utf-8')
+            rows.append(dict(zip(self.fieldnames, next(csv.reader([raw])))))
+        return rows
+
+    def get_chunk(self, chapter_number: str, section_number: str, chunk_number: int) -> List[Dict]:
+        """Return the rows with this exact key (chunk numbers restart per segment)."""
+        key = (str(chapter_number), str(section_number), int(chunk_number))
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key)
+        return self._read_rows(lo, hi)
+
+    def get_section(self, chapter_number: str, section_number: str) -> List[Dict]:
+        """Return all rows of one section in file order."""
+        chapter, section = str(chapter_number), str(section_number)
+        lo = bisect.bisect_left(self._keys, (chapter, section))
+        hi = bisect.bisect_right(self._keys, (chapter, section, sys.maxsize))
+        return self._read_rows(lo, hi)
+
+    def get_chapter(self, chapter_number: str) -> List[Dict]:
+        """Return all rows of one chapter in file order."""
+        chapter = str(chapter_number)
+        lo = bisect.bisect_left(self._keys, (chapter,))
+        hi = bisect.bisect_left(self._keys, (chapter + '\0',))
+        return self._read_rows(lo, hi)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstandard not found. Please install with: pip install zstandard")
+
+
+def frames_path_for(compressed_file: str) -> str:
+    """Return the frame table sidecar path that belongs to a compressed CSV."""
+    return f"{compressed_file}.frames.json"
+
+
+def _iter_chapter_runs(records: Iterator[Tuple[int, bytes]],
+                       chapter_field: Optional[int]) -> Iterator[Tuple[str, List[bytes]]]:
+    """Group consecutive CSV records of one chapter into (chapter, rows) runs."""
+    run_chapter, run = None, []
+    for _, raw in records:
+        chapter = ''
+        if chapter_field is not None:
+            values = next(csv.reader([raw.decode('utf-8')]), [])
+            chapter = values[chapter_field] if len(values) > chapter_field else ''
+        if run and chapter != run_chapter:
+            yield run_chapter, run
+            run = []
+        run_chapter = chapter
+        run.append(raw)
+    if run:
+        yield run_chapter, run
+
+
+def _pack_frames(header: bytes, runs: Iterator[Tuple[str, List[bytes]]],
+                 frame_bytes: int) -> Iterator[Dict]:
+    """Pack whole chapter runs into frames of about ``frame_bytes``; the first frame starts with the header."""
+    current = {'chapters': [], 'rows': [header], 'row_count': 0, 'size': len(header)}
+    for chapter, rows in runs:
+        run_size = sum(len(row) for row in rows)
+        if current['row_count'] and current['size'] + run_size > frame_bytes:
+            yield current
+            current = {'chapters': [], 'rows': [], 'row_count': 0, 'size': 0}
+        if chapter not in current['chapters']:
+            current['chapters'].append(chapter)
+        current['rows'].extend(rows)
+        current['row_count'] += len(rows)
+        current['size'] += run_size
+    yield current
+
+
+def compress_structured_csv(csv_file: str, output_file: Optional[str] = None, level: int = 10,
+                            dict_size: int = 112 * 1024, frame_bytes: int = 256 * 1024,
+                            sample_rows: int = 5000) -> str:
+    """Write a seekable, dictionary-compressed copy of a structured CSV.
+
+    A zstd dictionary is trained on a sample of rows and every frame is
+    compressed independently with it. Frames hold whole chapter runs of up to
+    ``frame_bytes`` of CSV, so any chapter can be decompressed without touching
+    the rest of the file. The dictionary and the frame table are written to
+    ``<output>.dict`` and ``<output>.frames.json``. The CSV is streamed: only
+    the dictionary samples and one frame are held in memory at a time.
+    """
+    _require_zstandard()
+    output_file = output_file or f"{csv_file}.zst"
+
+    with open(csv_file, 'rb') as f:
+        records = _iter_csv_records(f)
+        header = next(records, (0, b''))[1]
+        row_count = sum(1 for _ in records)
+    if not header:
+        raise ValueError(f"{csv_file} is empty")
+    fieldnames = next(csv.reader([header.decode('utf-8')]))
+    chapter_field = fieldnames.index('chapter_number') if 'chapter_number' in fieldnames else None
+
+    # Train a dictionary on evenly spaced rows; tiny inputs compress without one
+    step = max(row_count / sample_rows, 1)
+    wanted = {int(i * step) for i in range(min(sample_rows, row_count))}
+    with open(csv_file, 'rb') as f:
+        records = _iter_csv_records(f)
+        next(records)
+        samples = [raw for row, (_, raw) in enumerate(records) if row in wanted]
+    total_bytes = sum(len(raw) for raw in samples)
+    dictionary = None
+    try:
+        dictionary = zstandard.train_dictionary(min(dict_size, total_bytes // 10), samples, level=level)
+    except (zstandard.ZstdError, ValueError) as e:
+        logger.warning(f"Dictionary training skipped for {csv_file}: {e}")
+    del samples
+
+    compressor = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+    table = {
+        'version': FRAMES_VERSION,
+        'csv': os.path.basename(csv_file),
+        'fieldnames': fieldnames,
+        'dictionary': None,
+        'uncompressed_bytes': 0,
+        'frames': [],
+    }
+    if dictionary is not None:
+        dict_file = f"{output_file}.dict"
+        with open(dict_file, 'wb') as f:
+            f.write(dictionary.as_bytes())
+        table['dictionary'] = os.path.basename(dict_file)
+
+    offset = 0
+    row_start = 0
+    with open(csv_file, 'rb') as f, open(output_file, 'wb') as out:
+        records = _iter_csv_records(f)
+        next(records)
+        for frame in _pack_frames(header, _iter_chapter_runs(records, chapter_field), frame_bytes):
+            data = b''.join(frame['rows'])
+            compressed = compressor.compress(data)
+            out.write(compressed)
+            table['frames'].append({
+                'offset': offset,
+                'length': len(compressed),
+                'uncompressed_offset': table['uncompressed_bytes'],
+                'uncompressed_length': len(data),
+                'row_start': row_start,
+                'row_end': row_start + frame['row_count'],
+                'chapters': frame['chapters'],
+            })
+            offset += len(compressed)
+            row_start += frame['row_count']
+            table['uncompressed_bytes'] += len(data)
+
+    with open(frames_path_for(output_file), 'w', encoding='utf-8') as f:
+        json.dump(table, f, indent=2)
+    logger.info(f"Compressed {csv_file} ({table['uncompressed_bytes']} bytes) to {output_file} "
+                f"({offset} bytes, {len(table['frames'])} frames)")
+    return output_file
+
+
+class CompressedCSVReader:
+    """Read a dictionary-compressed structured CSV frame by frame.
+
+    Only the frames that are needed are read and decompressed: iterating
+    streams one frame at a time and chapter lookups touch just the frames
+    listed for that chapter in the frame table.
+    """
+
+    def __init__(self, compressed_file: str):
+        _require_zstandard()
+        self.compressed_file = compressed_file
+        with open(frames_path_for(compressed_file), 'r', encoding='utf-8') as f:
+            self.table = json.load(f)
+        if self.table.get('version') != FRAMES_VERSION:
+            raise ValueError(f"Unsupported frame table version {self.table.get('version')}")
+        self.fieldnames = self.table['fieldnames']
+
+        dictionary = None
+        if self.table['dictionary']:
+            dict_file = Path(compressed_file).with_name(self.table['dictionary'])
+            dictionary = zstandard.ZstdCompressionDict(dict_file.read_bytes())
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        self._file = open(compressed_file, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _frame_bytes(self, position: int) -> bytes:
+        frame = self.table['frames'][position]
+        self._file.seek(frame['offset'])
+        return self._decompressor.decompress(self._file.read(frame['length']))
+
+    def _frame_rows(self, position: int) -> List[Dict]:
+        data = self._frame_bytes(position)
+        rows = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+        if position == 0:
+            next(rows, None)
+        return [dict(zip(self.fieldnames, values)) for values in rows if values]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for position in range(len(self.table['frames'])):
+            yield from self._frame_rows(position)
+
+    def read_bytes(self) -> bytes:
+        """Return the full original CSV bytes."""
+        return b''.join(self._frame_bytes(position) for position in range(len(self.table['frames'])))
+
+    def get_chapter(self, chapter_number: str) -> List[Dict]:
+        """Return all rows of one chapter, decompressing only its frames."""
+        chapter = str(chapter_number)
+        rows = []
+        for position, frame in enumerate(self.table['frames']):
+            if chapter in frame['chapters']:
+                rows.extend(row for row in self._frame_rows(position)
+                            if row.get('chapter_number') == chapter)
+        return rows
+
+
+def iter_rows(path: str) -> Iterator[Dict]:
+    """Yield structured rows from a CSV, a shard manifest or a zstd-compressed CSV."""
+    if path.endswith('.zst'):
+        with CompressedCSVReader(path) as reader:
+            yield from reader
+        return
+    paths = [shard['path'] for shard in load_manifest(path)['shards']] if path.endswith('.manifest.json') else [path]
+    for csv_file in paths:
+        with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+            yield from csv.DictReader(f)
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(description='Structured Nelson dataset utilities.')
+    subparsers = parser.add_subparsers(dest='command', help='Available commands')
+
+    index_parser = subparsers.add_parser('index', help='Build offset index sidecars for existing CSVs')
+    index_parser.add_argument('csv_files', nargs='+', help='Structured CSV files')
+
+    verify_parser = subparsers.add_parser('verify', help='Verify shard checksums against a manifest')
+    verify_parser.add_argument('manifest', help='Manifest JSON path')
+
+    compress_parser = subparsers.add_parser('compress', help='Write dictionary-compressed zstd copies of CSVs')
+    compress_parser.add_argument('csv_files', nargs='+', help='Structured CSV files')
+    compress_parser.add_argument('--level', type=int, default=10, help='zstd compression level (default: 10)')
+    compress_parser.add_argument('--frame-bytes', type=int, default=256 * 1024,
+                                 help='Target uncompressed bytes per frame (default: 262144)')
+
+    return parser
+
+
+def main():
+    """Main entry point"""
+    parser = create_parser()
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        for csv_file in args.csv_files:
+            print(build_offset_index(csv_file))
+        return 0
+    if args.command == 'verify':
+        mismatched = verify_manifest(args.manifest)
+        for path in mismatched:
+            print(f"checksum mismatch: {path}", file=sys.stderr)
+        return 1 if mismatched else 0
+    if args.command == 'compress':
+        for csv_file in args.csv_files:
+            print(compress_structured_csv(csv_file, level=args.level, frame_bytes=args.frame_bytes))
+        return 0
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
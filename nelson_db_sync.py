@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Incremental Database Sync
+Loads converter output into nelson_book_contents, writing only the chunks whose content hash changed.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import sys
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List
+
+from nelson_dataset import iter_rows
+
+# Optional: psycopg for the database connection
+try:
+    import psycopg
+    from psycopg import sql
+except ImportError:
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+
+SYNC_COLUMNS = ['sync_key', 'meta', 'index_path', 'title', 'topic', 'subtopic', 'content', 'summary',
+                'chunk_no', 'content_hash']
+
+STAGING_TABLE = 'nelson_sync_staging'
+
+# One statement: upsert changed rows, delete vanished ones, report counts.
+# MERGE ... WHEN NOT MATCHED BY SOURCE would need Postgres 17; this form runs on 9.5+.
+MERGE_SQL = """
+with upserted as (
+  insert into {table} as t (sync_key, meta, index_path, title, topic, subtopic, content, summary,
+                            chunk_no, content_hash)
+  select sync_key, meta, index_path, title, topic, subtopic, content, summary, chunk_no, content_hash
+  from {staging}
+  on conflict (sync_key) do update set
+    meta = excluded.meta,
+    index_path = excluded.index_path,
+    title = excluded.title,
+    topic = excluded.topic,
+    subtopic = excluded.subtopic,
+    content = excluded.content,
+    summary = excluded.summary,
+    chunk_no = excluded.chunk_no,
+    content_hash = excluded.content_hash,
+    embedding = case when t.content is distinct from excluded.content then null else t.embedding end
+  where t.content_hash is distinct from excluded.content_hash
+  returning (xmax = 0) as inserted
+),
+deleted as (
+  delete from {table} t
+  where t.sync_key is not null
+    and not exists (select 1 from {staging} s where s.sync_key = t.sync_key)
+  returning 1
+)
+select (select count(*) from upserted where inserted),
+       (select count(*) from upserted where not inserted),
+       (select count(*) from deleted)
+"""
+
+
+def content_hash(row: Dict) -> str:
+    """SHA-256 over every synced column except the key and the hash itself."""
+    values = [row[column] for column in SYNC_COLUMNS if column not in ('sync_key', 'content_hash')]
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def book_rows(rows: Iterable[Dict]) -> Iterator[Dict]:
+    """Map structured CSV rows onto nelson_book_contents columns with a stable key and hash.
+
+    ``title`` holds the source book, as in the other loaders and the
+    book-partitioned layout; the chapter and section titles go to ``topic``
+    and ``subtopic``, and the subsection title to ``meta``. The key is the chapter/section/subsection path plus the chunk number. The
+    same chapter can appear in more than one source book, so repeats get an
+    occurrence counter in output order.
+    """
+    seen: Counter = Counter()
+    for row in rows:
+        index_path = '/'.join(part for part in (row['chapter_number'], row['section_number'],
+                                                row['subsection_number']) if part)
+        chunk_no = int(row['chunk_number']) if row['chunk_number'].isdigit() else None
+        seen[(index_path, chunk_no)] += 1
+        book_row = {
+            'sync_key': f"{index_path}#{chunk_no}:{seen[(index_path, chunk_no)]}",
+            'meta': json.dumps({
+                'book_title': row['book_title'],
+                'book_edition': row['book_edition'],
+                'chapter_number': row['chapter_number'],
+                'section_number': row['section_number'],
+                'subsection_number': row['subsection_number'],
+                'subsection_title': row['subsection_title'],
+            }, ensure_ascii=False, sort_keys=True),
+            'index_path': index_path,
+            'title': row['book_title'],
+            'topic': row['chapter_title'],
+            'subtopic': row['section_title'],
+            'content': row['content'],
+            'summary': row['summary'],
+            'chunk_no': chunk_no,
+        }
+        book_row['content_hash'] = content_hash(book_row)
+        yield book_row
+
+
+def plan_sync(existing: Dict[str, str], rows: List[Dict]) -> Dict[str, int]:
+    """Count the inserts, updates and deletes a sync would make against ``{sync_key: content_hash}``."""
+    incoming = {row['sync_key']: row['content_hash'] for row in rows}
+    inserted = sum(1 for key in incoming if key not in existing)
+    updated = sum(1 for key, digest in incoming.items() if key in existing and existing[key] != digest)
+    deleted = sum(1 for key in existing if key not in incoming)
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted,
+            'unchanged': len(incoming) - inserted - updated}
+
+
+def _require_psycopg():
+    if psycopg is None:
+        raise ImportError("psycopg not found. Please install with: pip install 'psycopg[binary]'")
+
+
+def fetch_hashes(connection, table: str = 'nelson_book_contents') -> Dict[str, str]:
+    """Return ``{sync_key: content_hash}`` for the rows a previous sync wrote."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("select sync_key, content_hash from {} where sync_key is not null")
+                       .format(sql.Identifier(table)))
+        return dict(cursor.fetchall())
+
+
+def sync_rows(connection, rows: List[Dict], table: str = 'nelson_book_contents') -> Dict[str, int]:
+    """COPY the rows into a staging table and merge them into ``table`` in one transaction.
+
+    Unchanged rows are not written, so neither the moddatetime trigger nor
+    the embedding of an unchanged chunk is touched. Rows without a sync_key
+    (loaded by other tools) are left alone.
+    """
+    staging = sql.Identifier(STAGING_TABLE)
+    columns = sql.SQL(', ').join(map(sql.Identifier, SYNC_COLUMNS))
+    with connection.transaction(), connection.cursor() as cursor:
+        cursor.execute(sql.SQL(
+            "create temp table {} (sync_key text primary key, meta jsonb, index_path text, title text, "
+            "topic text, subtopic text, content text, summary text, chunk_no int, content_hash text) "
+            "on commit drop").format(staging))
+        with cursor.copy(sql.SQL("copy {} ({}) from stdin").format(staging, columns)) as copy:
+            for row in rows:
+                copy.write_row([row[column] for column in SYNC_COLUMNS])
+        cursor.execute(sql.SQL(MERGE_SQL).format(table=sql.Identifier(table), staging=staging))
+        inserted, updated, deleted = cursor.fetchone()
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted,
+            'unchanged': len(rows) - inserted - updated}
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(
+        description='Sync converter output into nelson_book_contents, writing only changed chunks.')
+    parser.add_argument('--data', default='nelson_textbook_structured.csv',
+                        help='Structured CSV, shard manifest or .zst output (default: nelson_textbook_structured.csv)')
+    parser.add_argument('--dsn', help='Postgres connection string')
+    parser.add_argument('--table', default='nelson_book_contents', help='Target table (default: nelson_book_contents)')
+    parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing them')
+    parser.add_argument('--previous', metavar='PATH',
+                        help='Plan against an earlier converter output instead of the database (implies --dry-run)')
+    return parser
+
+
+def main():
+    """Main entry point"""
+    args = create_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rows = list(book_rows(iter_rows(args.data)))
+    if not rows:
+        # An empty merge would delete every synced row
+        print(f"No rows in {args.data}; refusing to sync", file=sys.stderr)
+        return 1
+    dry_run = args.dry_run or bool(args.previous)
+    if args.previous:
+        existing = {row['sync_key']: row['content_hash'] for row in book_rows(iter_rows(args.previous))}
+        counts = plan_sync(existing, rows)
+    else:
+        if not args.dsn:
+            print("Either --dsn or --previous is required", file=sys.stderr)
+            return 2
+        _require_psycopg()
+        with psycopg.connect(args.dsn) as connection:
+            if dry_run:
+                counts = plan_sync(fetch_hashes(connection, args.table), rows)
+            else:
+                counts = sync_rows(connection, rows, args.table)
+
+    changes = (f"insert {counts['inserted']}, update {counts['updated']}, delete {counts['deleted']}" if dry_run
+               else f"inserted {counts['inserted']}, updated {counts['updated']}, deleted {counts['deleted']}")
+    print(f"{'Would ' if dry_run else ''}{changes}; {counts['unchanged']} of {len(rows)} rows unchanged")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - In-Process Retrieval
+Offline embeddings, flat and two-stage vector search and BM25 lexical search over structured chunks.
+"""
+
+import bisect
+import csv
+import json
+import logging
+import re
+import zlib
+from collections import Counter
+from itertools import repeat
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tfidf_summarizer import STOPWORDS
+
+# Optional: NumPy for the vector and lexical indexes
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+QUERY_SET_FILE = 'retrieval_queries.json'
+QUERY_SET_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy not found. Please install with: pip install numpy")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords or single characters."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower())
+            if len(token) > 1 and token not in STOPWORDS]
+
+
+def load_query_set(path: str = QUERY_SET_FILE) -> Dict:
+    """Load the labelled query set and check its version."""
+    with open(path, 'r', encoding='utf-8') as f:
+        query_set = json.load(f)
+    if query_set.get('version') != QUERY_SET_VERSION:
+        raise ValueError(f"Unsupported query set version {query_set.get('version')}")
+    return query_set
+
+
+def load_chunks(csv_file: str) -> List[Dict]:
+    """Read structured CSV rows."""
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def chunk_text(row: Dict) -> str:
+    """Text that is embedded and indexed for one chunk."""
+    return ' '.join(filter(None, (row.get('chapter_title', ''), row.get('section_title', ''),
+                                  row.get('content', ''))))
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embeddings through signed feature hashing.
+
+    Stands in for a real embedding model so that retrieval can be measured
+    offline: unigrams and bigrams are hashed into ``dim`` buckets with a
+    hash-derived sign, weighted by 1 + log(tf) and L2-normalised.
+    """
+
+    def __init__(self, dim: int = 1536, bigrams: bool = True):
+        _require_numpy()
+        self.dim = dim
+        self.bigrams = bigrams
+
+    def _features(self, text: str) -> Counter:
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        if self.bigrams:
+            counts.update(map(' '.join, zip(tokens, tokens[1:])))
+        return counts
+
+    def _embed_batch(self, texts: Sequence[str]) -> 'np.ndarray':
+        features: List[str] = []
+        counts: List[int] = []
+        rows: List[int] = []
+        for row, text in enumerate(texts):
+            row_features = self._features(text)
+            features.extend(row_features)
+            counts.extend(row_features.values())
+            rows.extend(repeat(row, len(row_features)))
+        hashes = np.fromiter(map(zlib.crc32, map(str.encode, features)), dtype=np.uint32, count=len(features))
+        signs = np.where(hashes >> 31, 1.0, -1.0)
+        weights = signs * (1.0 + np.log(np.asarray(counts, dtype=np.float64)))
+        flat = np.asarray(rows, dtype=np.int64) * self.dim + (hashes % self.dim).astype(np.int64)
+        matrix = np.bincount(flat, weights=weights, minlength=len(texts) * self.dim)
+        return matrix.reshape(len(texts), self.dim)
+
+    def embed(self, texts: Sequence[str], batch_size: int = 1024) -> 'np.ndarray':
+        """Return a (len(texts), dim) float32 matrix of unit vectors."""
+        matrix = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            matrix[start:start + batch_size] = self._embed_batch(texts[start:start + batch_size])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def top_k(scores: 'np.ndarray', k: int) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Return the k best (indices, scores) in descending order."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=scores.dtype)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return order, scores[order]
+
+
+class VectorIndex:
+    """Exact inner-product search over a dense float32 matrix."""
+
+    # Above this share of rows a filtered query scores all rows and masks
+    gather_fraction = 0.25
+
+    def __init__(self, vectors: 'np.ndarray'):
+        _require_numpy()
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.vectors.nbytes)
+
+    def search(self, query: 'np.ndarray', k: int = 10,
+               candidates: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Return the (row indices, scores) of the k nearest chunks to one query vector.
+
+        With ``candidates`` (row indices from a pre-filter) the top k is taken
+        among those rows only. Selective filters score just the candidate rows;
+        broad ones score everything and mask the rest, which is cheaper than
+        gathering most of the matrix.
+        """
+        if candidates is None:
+            return top_k(self.vectors @ query, k)
+        if len(candidates) > len(self.vectors) * self.gather_fraction:
+            scores = np.full(len(self.vectors), -np.inf, dtype=np.float32)
+            scores[candidates] = (self.vectors @ query)[candidates]
+            found, best = top_k(scores, min(k, len(candidates)))
+            return found, best
+        found, scores = top_k(self.vectors[candidates] @ query, k)
+        return candidates[found], scores
+
+
+def group_rows(keys: Sequence[str]) -> Dict[str, 'np.ndarray']:
+    """Map each non-empty key to the sorted row indices that carry it."""
+    groups: Dict[str, List[int]] = {}
+    for row, key in enumerate(keys):
+        if key:
+            groups.setdefault(key, []).append(row)
+    return {key: np.asarray(row_ids, dtype=np.int64) for key, row_ids in groups.items()}
+
+
+class HierarchicalIndex:
+    """Two-stage search: rank chapter centroids, then search only the chunks of the best chapters.
+
+    Centroids are the normalised mean of the chunk vectors in each chapter and
+    section. With ``top_sections`` a middle stage ranks the section centroids
+    of the chosen chapters and keeps only the best sections' chunks; section
+    centroids are only built in that case.
+    """
+
+    def __init__(self, index: VectorIndex, rows: List[Dict], top_chapters: int = 8,
+                 top_sections: Optional[int] = None):
+        self.index = index
+        self.top_chapters = top_chapters
+        self.top_sections = top_sections
+        self.chapter_rows = group_rows([row.get('chapter_number', '') for row in rows])
+        self.section_rows = group_rows([row.get('section_number', '') for row in rows])
+        self.chapters = list(self.chapter_rows)
+        self.chapter_centroids = self._centroids(self.chapter_rows.values())
+        self.sections = list(self.section_rows)
+        self.section_centroids = self._centroids(self.section_rows.values()) if top_sections else None
+        # Sections of each chapter as positions into self.sections
+        sections_of: Dict[str, List[int]] = {}
+        for position, section in enumerate(self.sections):
+            chapter = rows[int(self.section_rows[section][0])].get('chapter_number', '')
+            sections_of.setdefault(chapter, []).append(position)
+        self.chapter_sections = {chapter: np.asarray(positions, dtype=np.int64)
+                                 for chapter, positions in sections_of.items()}
+
+    def _centroids(self, groups) -> 'np.ndarray':
+        groups = list(groups)
+        if not groups:
+            return np.zeros((0, self.index.vectors.shape[1]), dtype=np.float32)
+        centroids = np.stack([self.index.vectors[row_ids].mean(axis=0) for row_ids in groups])
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (centroids / norms).astype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        sections = self.section_centroids.nbytes if self.section_centroids is not None else 0
+        return int(self.chapter_centroids.nbytes + sections
+                   + sum(row_ids.nbytes for row_ids in self.chapter_rows.values())
+                   + sum(row_ids.nbytes for row_ids in self.section_rows.values()))
+
+    def candidates(self, query: 'np.ndarray') -> 'np.ndarray':
+        """Return the sorted row indices left after the chapter (and section) stages."""
+        best, _ = top_k(self.chapter_centroids @ query, self.top_chapters)
+        chapters = [self.chapters[i] for i in best.tolist()]
+        if self.top_sections:
+            positions = np.concatenate([self.chapter_sections[chapter] for chapter in chapters
+                                        if chapter in self.chapter_sections] or [np.zeros(0, dtype=np.int64)])
+            if len(positions) > self.top_sections:
+                found, _ = top_k(self.section_centroids[positions] @ query, self.top_sections)
+                positions = positions[found]
+            groups = [self.section_rows[self.sections[i]] for i in positions.tolist()]
+        else:
+            groups = [self.chapter_rows[chapter] for chapter in chapters]
+        return np.sort(np.concatenate(groups)) if groups else np.zeros(0, dtype=np.int64)
+
+    def search(self, query: 'np.ndarray', k: int = 10,
+               candidates: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Return the (row indices, scores) of the k best chunks in the chosen chapters."""
+        rows = self.candidates(query)
+        if candidates is not None:
+            rows = np.intersect1d(rows, candidates, assume_unique=True)
+        return self.index.search(query, k, rows)
+
+
+class LexicalIndex:
+    """BM25 over an inverted index stored as CSR posting arrays."""
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        _require_numpy()
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        doc_ids: List[int] = []
+        term_ids: List[int] = []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                doc_ids.append(doc_id)
+                term_ids.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+
+        n_docs = max(len(texts), 1)
+        keys, tf = np.unique(np.asarray(term_ids, dtype=np.int64) * n_docs
+                             + np.asarray(doc_ids, dtype=np.int64), return_counts=True)
+        self.postings = (keys % n_docs).astype(np.int32)
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // n_docs, minlength=len(self.vocabulary)), out=self.indptr[1:])
+
+        df = np.diff(self.indptr)
+        self.idf = np.log(1.0 + (len(texts) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Precompute the BM25 term weight of every posting
+        norm = self.k1 * (1.0 - self.b + self.b * lengths / max(float(lengths.mean()) if len(texts) else 0.0, 1.0))
+        tf = tf.astype(np.float32)
+        self.weights = (tf * (self.k1 + 1.0) / (tf + norm[self.postings])).astype(np.float32)
+        self.size = len(texts)
+
+    @classmethod
+    def from_arrays(cls, vocabulary: Dict[str, int], postings: 'np.ndarray', indptr: 'np.ndarray',
+                    idf: 'np.ndarray', weights: 'np.ndarray', size: int,
+                    k1: float = 1.2, b: float = 0.75) -> 'LexicalIndex':
+        """Restore a built index from its arrays, e.g. memory-mapped from a snapshot, without re-tokenizing."""
+        _require_numpy()
+        index = cls.__new__(cls)
+        index.k1 = k1
+        index.b = b
+        index.vocabulary = vocabulary
+        index.postings = postings
+        index.indptr = indptr
+        index.idf = idf
+        index.weights = weights
+        index.size = size
+        return index
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.postings.nbytes + self.indptr.nbytes + self.idf.nbytes + self.weights.nbytes)
+
+    def scores(self, query: str) -> 'np.ndarray':
+        """Return the BM25 score of every chunk for a query."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.indptr[term], self.indptr[term + 1]
+            scores[self.postings[start:end]] += self.idf[term] * self.weights[start:end]
+        return scores
+
+    def search(self, query: str, k: int = 10,
+               candidates: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Return the (row indices, scores) of the k best chunks for a query, optionally among candidates."""
+        scores = self.scores(query)
+        if candidates is None:
+            return top_k(scores, k)
+        found, best = top_k(scores[candidates], k)
+        return candidates[found], best
+
+
+def section_suffix(section_number: str) -> str:
+    """Return the part of a section number after the chapter, e.g. '1' for 182.1 or 'T' for 183.T."""
+    return section_number.rpartition('.')[2] if '.' in section_number else ''
+
+
+def load_chapter_books(toc_file: str) -> Dict[str, List[str]]:
+    """Map chapter numbers to the source files that contain them, from a --structure-only TOC."""
+    with open(toc_file, 'r', encoding='utf-8') as f:
+        toc = json.load(f)
+    chapter_books: Dict[str, List[str]] = {}
+
+    def walk(entries: List[Dict], book: str):
+        for entry in entries:
+            if entry['type'] == 'chapter':
+                books = chapter_books.setdefault(entry['number'], [])
+                if book not in books:
+                    books.append(book)
+            walk(entry.get('children', []), book)
+
+    for structure in toc['files']:
+        walk(structure.get('toc', []), structure['file'])
+    return chapter_books
+
+
+class BitmapField:
+    """Packed row bitmaps for every value of one field, stacked into a single uint8 matrix."""
+
+    def __init__(self, values_per_row, size: int):
+        groups: Dict[str, List[int]] = {}
+        for row, values in enumerate(values_per_row):
+            for value in values:
+                if value:
+                    groups.setdefault(value, []).append(row)
+        self.size = size
+        self.positions = {value: position for position, value in enumerate(groups)}
+        bits = np.zeros((len(groups), size), dtype=bool)
+        for position, row_ids in enumerate(groups.values()):
+            bits[position, row_ids] = True
+        self.bitmaps = np.packbits(bits, axis=1)
+
+    @classmethod
+    def from_arrays(cls, values: Sequence[str], bitmaps: 'np.ndarray', size: int) -> 'BitmapField':
+        """Restore a field from its values (in bitmap row order) and packed bitmaps."""
+        field = cls.__new__(cls)
+        field.size = size
+        field.positions = {value: position for position, value in enumerate(values)}
+        field.bitmaps = bitmaps
+        return field
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.bitmaps.nbytes)
+
+    def union(self, values) -> 'np.ndarray':
+        """OR of the bitmaps of ``values``; unknown values match no rows."""
+        positions = [self.positions[str(value)] for value in values if str(value) in self.positions]
+        if not positions:
+            return np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[positions], axis=0)
+
+
+class BitmapFilterIndex:
+    """Row bitmaps per chapter, section suffix and source book, built at index time.
+
+    Each bitmap is a packed bitset (one bit per row, 8x smaller than a bool
+    mask). A filter ORs the bitmaps of the requested values per field and ANDs
+    the fields together, yielding candidate rows before any vector is scored.
+    """
+
+    def __init__(self, rows: List[Dict], chapter_books: Optional[Dict[str, List[str]]] = None):
+        _require_numpy()
+        self.size = len(rows)
+        chapter_books = chapter_books or {}
+        self.chapters = BitmapField(([row.get('chapter_number', '')] for row in rows), self.size)
+        self.suffixes = BitmapField(([section_suffix(row.get('section_number', ''))] for row in rows), self.size)
+        self.books = BitmapField((chapter_books.get(row.get('chapter_number', ''), []) for row in rows), self.size)
+        self._index_chapters()
+
+    @classmethod
+    def from_fields(cls, chapters: BitmapField, suffixes: BitmapField, books: BitmapField) -> 'BitmapFilterIndex':
+        """Restore an index from previously built fields, e.g. loaded from a snapshot."""
+        _require_numpy()
+        index = cls.__new__(cls)
+        index.size = chapters.size
+        index.chapters = chapters
+        index.suffixes = suffixes
+        index.books = books
+        index._index_chapters()
+        return index
+
+    def _index_chapters(self):
+        numbered = sorted((int(chapter), chapter) for chapter in self.chapters if chapter.isdigit())
+        self._chapter_numbers = [number for number, _ in numbered]
+        self._chapter_names = [chapter for _, chapter in numbered]
+
+    @property
+    def nbytes(self) -> int:
+        return self.chapters.nbytes + self.suffixes.nbytes + self.books.nbytes
+
+    def select(self, chapters: Optional[Sequence[str]] = None, chapter_range: Optional[Tuple[int, int]] = None,
+               section_suffixes: Optional[Sequence[str]] = None,
+               books: Optional[Sequence[str]] = None) -> Optional['np.ndarray']:
+        """Return the packed bitmap of rows matching every given criterion, or None without criteria.
+
+        ``chapter_range`` is inclusive and combines with ``chapters`` as a union.
+        """
+        clauses = []
+        if chapters is not None or chapter_range is not None:
+            wanted = list(chapters or [])
+            if chapter_range is not None:
+                low, high = chapter_range
+                wanted += self._chapter_names[bisect.bisect_left(self._chapter_numbers, low):
+                                              bisect.bisect_right(self._chapter_numbers, high)]
+            clauses.append(self.chapters.union(wanted))
+        if section_suffixes is not None:
+            clauses.append(self.suffixes.union(section_suffixes))
+        if books is not None:
+            clauses.append(self.books.union(books))
+        if not clauses:
+            return None
+        result = clauses[0]
+        for clause in clauses[1:]:
+            result = result & clause
+        return result
+
+    def candidates(self, **criteria) -> Optional['np.ndarray']:
+        """Return the row indices selected by :meth:`select`, or None without criteria."""
+        bitmap = self.select(**criteria)
+        if bitmap is None:
+            return None
+        # unpackbits yields 0/1 bytes; viewing them as bool keeps flatnonzero on its fast path
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.size).view(bool))
+
+
+SEARCH_MODES = ('flat', 'hierarchical')
+
+
+class InProcessBackend:
+    """Embeds queries and searches a vector index held in memory.
+
+    ``mode`` is ``flat`` (score every chunk) or ``hierarchical`` (chapter
+    centroids first, see :class:`HierarchicalIndex`). It can be switched on a
+    built backend; the centroids are computed on first use. ``vectors`` skips
+    embedding the rows and ``filter_index`` skips building the bitmaps, e.g.
+    when both are restored from a corpus store.
+    """
+
+    name = 'vector'
+
+    def __init__(self, rows: List[Dict], embedder: Optional[HashingEmbedder] = None,
+                 chapter_books: Optional[Dict[str, List[str]]] = None, mode: str = 'flat',
+                 top_chapters: int = 8, top_sections: Optional[int] = None,
+                 vectors: Optional['np.ndarray'] = None, filter_index: Optional[BitmapFilterIndex] = None):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}; expected one of {', '.join(SEARCH_MODES)}")
+        self.rows = rows
+        self.embedder = embedder or HashingEmbedder()
+        if vectors is None:
+            vectors = self.embedder.embed([chunk_text(row) for row in rows])
+        self.index = VectorIndex(vectors)
+        self.filters = filter_index if filter_index is not None else BitmapFilterIndex(rows, chapter_books)
+        self.mode = mode
+        self.top_chapters = top_chapters
+        self.top_sections = top_sections
+        self._hierarchy: Optional[HierarchicalIndex] = None
+
+    @property
+    def hierarchy(self) -> HierarchicalIndex:
+        return self.build_hierarchy()
+
+    def build_hierarchy(self) -> HierarchicalIndex:
+        """Build the chapter (and section) centroids for hierarchical search once, e.g. before timing queries."""
+        if self._hierarchy is None:
+            self._hierarchy = HierarchicalIndex(self.index, self.rows, self.top_chapters, self.top_sections)
+        return self._hierarchy
+
+    @property
+    def nbytes(self) -> int:
+        size = self.index.nbytes + self.filters.nbytes
+        if self._hierarchy is not None:
+            size += self._hierarchy.nbytes
+        return size
+
+    def search(self, query: str, k: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+        """Return the k best rows for a query, restricted by BitmapFilterIndex.select criteria."""
+        return self.search_vector(self.embedder.embed([query])[0], k, filters)
+
+    def search_vector(self, query: 'np.ndarray', k: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+        """As :meth:`search`, for a query that is already embedded."""
+        candidates = self.filters.candidates(**filters) if filters else None
+        index = self.hierarchy if self.mode == 'hierarchical' else self.index
+        found, _ = index.search(query, k, candidates)
+        return [self.rows[i] for i in found.tolist()]
+
+
+class LexicalBackend:
+    """BM25 search over the chunk texts; ``index`` and ``filter_index`` reuse prebuilt indexes."""
+
+    name = 'lexical'
+
+    def __init__(self, rows: List[Dict], chapter_books: Optional[Dict[str, List[str]]] = None,
+                 index: Optional[LexicalIndex] = None, filter_index: Optional[BitmapFilterIndex] = None):
+        self.rows = rows
+        self.index = index if index is not None else LexicalIndex([chunk_text(row) for row in rows])
+        self.filters = filter_index if filter_index is not None else BitmapFilterIndex(rows, chapter_books)
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + self.filters.nbytes
+
+    def search(self, query: str, k: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+        """Return the k best rows for a query, restricted by BitmapFilterIndex.select criteria."""
+        candidates = self.filters.candidates(**filters) if filters else None
+        found, _ = self.index.search(query, k, candidates)
+        return [self.rows[i] for i in found.tolist()]
+
+
+def first_relevant_rank(hits: Sequence[Dict], query: Dict, level: str = 'chapter') -> Optional[int]:
+    """Return the 1-based rank of the first hit labelled relevant for the query, or None."""
+    if level == 'section':
+        field, expected = 'section_number', set(query.get('expected_sections') or [])
+    else:
+        field, expected = 'chapter_number', set(query.get('expected_chapters') or [])
+    for rank, hit in enumerate(hits, start=1):
+        if hit.get(field) in expected:
+            return rank
+    return None
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Regex Pattern Registry
+Precompiles every converter pattern and profiles calls, bytes scanned and time per pattern.
+"""
+
+import re
+import time
+from typing import Dict, Iterator, List, Optional
+
+
+class PatternStats:
+    """Accumulated usage of one registered pattern."""
+
+    __slots__ = ('name', 'pattern', 'calls', 'bytes_scanned', 'seconds')
+
+    def __init__(self, name: str, pattern: str):
+        self.name = name
+        self.pattern = pattern
+        self.calls = 0
+        self.bytes_scanned = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'pattern': self.pattern,
+            'calls': self.calls,
+            'bytes_scanned': self.bytes_scanned,
+            'seconds': round(self.seconds, 6),
+            'mb_per_second': round(self.bytes_scanned / self.seconds / 1e6, 2) if self.seconds else None,
+        }
+
+
+class ProfiledPattern:
+    """A compiled pattern whose calls are counted and timed."""
+
+    __slots__ = ('regex', 'stats')
+
+    def __init__(self, regex, stats: PatternStats):
+        self.regex = regex
+        self.stats = stats
+
+    @property
+    def pattern(self) -> str:
+        return self.regex.pattern
+
+    def _record(self, text: str, start: float, span: tuple = ()):
+        stats = self.stats
+        stats.calls += 1
+        # With pos/endpos only that slice of the text is scanned
+        pos = span[0] if span else 0
+        endpos = min(span[1], len(text)) if len(span) > 1 else len(text)
+        stats.bytes_scanned += max(endpos - pos, 0)
+        stats.seconds += time.perf_counter() - start
+
+    def search(self, text: str, *args):
+        start = time.perf_counter()
+        result = self.regex.search(text, *args)
+        self._record(text, start, args)
+        return result
+
+    def match(self, text: str, *args):
+        start = time.perf_counter()
+        result = self.regex.match(text, *args)
+        self._record(text, start, args)
+        return result
+
+    def findall(self, text: str, *args):
+        start = time.perf_counter()
+        result = self.regex.findall(text, *args)
+        self._record(text, start, args)
+        return result
+
+    def sub(self, repl, text: str, count: int = 0):
+        start = time.perf_counter()
+        result = self.regex.sub(repl, text, count)
+        self._record(text, start)
+        return result
+
+    def split(self, text: str, maxsplit: int = 0):
+        start = time.perf_counter()
+        result = self.regex.split(text, maxsplit)
+        self._record(text, start)
+        return result
+
+    def finditer(self, text: str, *args) -> Iterator:
+        """Iterate matches; time spent inside the regex engine is accumulated lazily."""
+        iterator = self.regex.finditer(text, *args)
+        stats = self.stats
+        stats.calls += 1
+        stats.bytes_scanned += len(text)
+        while True:
+            start = time.perf_counter()
+            match = next(iterator, None)
+            stats.seconds += time.perf_counter() - start
+            if match is None:
+                return
+            yield match
+
+
+class PatternRegistry:
+    """Central registry of named, precompiled patterns.
+
+    Static patterns are compiled once by :meth:`register`. Patterns built from
+    runtime values (for example a chapter number) go through :meth:`dynamic`,
+    which caches one compiled variant per value and books all of them under
+    the template's name.
+    """
+
+    def __init__(self):
+        self._patterns: Dict[str, ProfiledPattern] = {}
+        self._stats: Dict[str, PatternStats] = {}
+        self._dynamic: Dict[str, Dict[str, ProfiledPattern]] = {}
+        self._templates: Dict[str, tuple] = {}
+
+    def register(self, name: str, pattern: str, flags: int = 0) -> ProfiledPattern:
+        """Compile and register a pattern under a unique name."""
+        if name in self._stats:
+            raise ValueError(f"Pattern {name!r} is already registered")
+        stats = PatternStats(name, pattern)
+        self._stats[name] = stats
+        profiled = ProfiledPattern(re.compile(pattern, flags), stats)
+        self._patterns[name] = profiled
+        return profiled
+
+    def register_template(self, name: str, template: str, flags: int = 0):
+        """Register a pattern template formatted with escaped runtime values."""
+        if name in self._stats:
+            raise ValueError(f"Pattern {name!r} is already registered")
+        self._stats[name] = PatternStats(name, template)
+        self._templates[name] = (template, flags)
+        self._dynamic[name] = {}
+
+    def dynamic(self, name: str, value: str) -> ProfiledPattern:
+        """Return the compiled variant of template ``name`` for ``value``."""
+        variants = self._dynamic[name]
+        profiled = variants.get(value)
+        if profiled is None:
+            template, flags = self._templates[name]
+            regex = re.compile(template.format(value=re.escape(value)), flags)
+            profiled = ProfiledPattern(regex, self._stats[name])
+            variants[value] = profiled
+        return profiled
+
+    def __getitem__(self, name: str) -> ProfiledPattern:
+        return self._patterns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._stats
+
+    def reset(self):
+        """Zero all counters."""
+        for stats in self._stats.values():
+            stats.calls = 0
+            stats.bytes_scanned = 0
+            stats.seconds = 0.0
+
+    def report(self, top: Optional[int] = None) -> List[Dict]:
+        """Return per-pattern statistics ranked by cumulative time."""
+        ranked = sorted(self._stats.values(), key=lambda s: s.seconds, reverse=True)
+        return [stats.as_dict() for stats in ranked[:top]]
+
+    def format_report(self, top: Optional[int] = 15) -> str:
+        """Return the ranked statistics as a fixed-width text table."""
+        rows = self.report(top)
+        total = sum(stats.seconds for stats in self._stats.values()) or 1.0
+        lines = [f"{'pattern':<32} {'calls':>10} {'MB scanned':>11} {'seconds':>9} {'share':>6}"]
+        for row in rows:
+            lines.append(f"{row['name']:<32} {row['calls']:>10} {row['bytes_scanned'] / 1e6:>11.2f} "
+                         f"{row['seconds']:>9.3f} {row['seconds'] / total:>6.1%}")
+        return '\n'.join(lines)
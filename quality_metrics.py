@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Dataset Quality Metrics
+Computes the QUALITY_REPORT.md metrics over a structured CSV or Parquet file with column operations.
+"""
+
+import argparse
+import bisect
+import csv
+import io
+import json
+import logging
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from nelson_dataset import CompressedCSVReader, load_manifest
+
+# Optional: NumPy for the vectorized column operations
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Optional: pyarrow for Parquet input
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+QUALITY_VERSION = 1
+
+QUALITY_COLUMNS = [
+    'chapter_number', 'chapter_title', 'section_number', 'subsection_number',
+    'chunk_number', 'content', 'summary'
+]
+
+# Targets from QUALITY_REPORT.md; metrics without a target are reported but never gate
+QUALITY_TARGETS = {
+    'chapter_coverage': 99.0,
+    'section_coverage': 90.0,
+    'good_chapter_titles': 95.0,
+    'quality_summaries': None,
+    'clean_content': 98.0,
+    'data_integrity': 100.0,
+}
+
+QUALITY_LABELS = {
+    'chapter_coverage': 'Chapter Coverage',
+    'section_coverage': 'Section Coverage',
+    'good_chapter_titles': 'Good Chapter Titles',
+    'quality_summaries': 'Quality Summaries',
+    'clean_content': 'Clean Content',
+    'data_integrity': 'Data Integrity',
+}
+
+# Values are joined into one string per column and scanned in a single pass
+SEPARATOR = '\x00'
+
+# Whole-column checks are plain substring searches, which run at memory speed;
+# regex alternations over the whole corpus are several times slower.
+CONTAMINATION_MARKERS = (
+    'Downloaded for', 'com by Elsevier', 'For personal use only',
+    'No other uses without permission', 'Copyright ©', 'ClinicalKey',
+)
+REPLACEMENT_CHAR = '\ufffd'
+SOFT_HYPHEN = '\u00ad'
+# The converter's medical_definition_patterns as one alternation
+DEFINITION_PATTERN = re.compile(
+    r'\b(?:(?:is|are)\s+(?:a|an|the)\s+(?:condition|disease|disorder|syndrome)'
+    r'|refers to|defined as|characterized by|(?:involves|includes|comprises)\s+(?:the|a|an)\b'
+    r'|occurs when|results from|caused by|manifests as|presents with|associated with)',
+    re.IGNORECASE
+)
+# The converter's summary priority terms and medical concepts
+MEDICAL_TERMS = (
+    'treatment', 'diagnosis', 'symptoms', 'clinical', 'manifestation', 'pathogenesis', 'etiology',
+    'epidemiology', 'prognosis', 'therapy', 'patient', 'child', 'infant', 'disorder', 'disease',
+    'condition', 'syndrome',
+)
+TITLE_ARTIFACT_PATTERN = re.compile(r'^u(?:\s|$)')
+TITLE_WORD_PATTERN = re.compile(r'[A-Za-z]{2,}')
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy not found. Please install with: pip install numpy")
+
+
+def _stringify(values) -> List[str]:
+    return ['' if value is None else str(value) for value in values]
+
+
+def _read_csv_columns(f, columns: List[str], data: Dict[str, List[str]]):
+    reader = csv.reader(f)
+    header = next(reader, None) or []
+    positions = [header.index(column) for column in columns if column in header]
+    present = [column for column in columns if column in header]
+    for values in reader:
+        if not values:
+            continue
+        for column, position in zip(present, positions):
+            data[column].append(values[position])
+
+
+def load_columns(path: str, columns: List[str] = QUALITY_COLUMNS) -> Dict[str, List[str]]:
+    """Read the requested columns from a CSV, zstd CSV, shard manifest or Parquet file."""
+    data: Dict[str, List[str]] = {column: [] for column in columns}
+
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ImportError("pyarrow not found. Please install with: pip install pyarrow")
+        table = pq.read_table(path)
+        for column in columns:
+            if column in table.column_names:
+                data[column] = _stringify(table.column(column).to_pylist())
+    elif path.endswith('.manifest.json'):
+        for shard in load_manifest(path)['shards']:
+            with open(shard['path'], 'r', encoding='utf-8', newline='') as f:
+                _read_csv_columns(f, columns, data)
+    elif path.endswith('.zst'):
+        with CompressedCSVReader(path) as reader:
+            text = reader.read_bytes().decode('utf-8')
+        _read_csv_columns(io.StringIO(text, newline=''), columns, data)
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            _read_csv_columns(f, columns, data)
+
+    # Columns missing from the input count as empty
+    total = max((len(values) for values in data.values()), default=0)
+    for column, values in data.items():
+        if not values:
+            data[column] = [''] * total
+    return data
+
+
+def _lengths(values: List[str]) -> 'np.ndarray':
+    return np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+
+
+class ColumnScanner:
+    """Runs substring searches over a whole column at once.
+
+    The column is joined into one string and scanned with ``str.find``; each
+    hit is mapped back to its row by a binary search over the cumulative value
+    lengths, and the scan resumes at the start of the next row, so a substring
+    that repeats within a value costs one search per matching row.
+    """
+
+    def __init__(self, values: List[str], lowercase: bool = False):
+        if lowercase:
+            values = [value.lower() for value in values]
+        self.size = len(values)
+        self.lengths = _lengths(values)
+        self._ends = np.cumsum(self.lengths + 1).tolist()
+        self.text = SEPARATOR.join(values)
+
+    def contains(self, needle: str) -> 'np.ndarray':
+        """Return a boolean mask of rows that contain a substring."""
+        rows = []
+        ends = self._ends
+        find = self.text.find
+        position = find(needle)
+        while position >= 0:
+            row = bisect.bisect_right(ends, position)
+            rows.append(row)
+            if row >= self.size:
+                break
+            position = find(needle, ends[row])
+        mask = np.zeros(self.size, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def count_containing(self, needles) -> 'np.ndarray':
+        """Return, per row, how many of the substrings it contains."""
+        counts = np.zeros(self.size, dtype=np.int64)
+        for needle in needles:
+            counts += self.contains(needle)
+        return counts
+
+
+def _unique_mask(values: List[str], predicate) -> 'np.ndarray':
+    """Evaluate a predicate once per distinct value and broadcast it to all rows."""
+    results: Dict[str, bool] = {}
+    for value in set(values):
+        results[value] = predicate(value)
+    return np.fromiter(map(results.__getitem__, values), dtype=bool, count=len(values))
+
+
+def is_good_chapter_title(title: str) -> bool:
+    """A usable title: no leading "u" glyph artifact and at least two words."""
+    title = title.strip()
+    return bool(title) and not TITLE_ARTIFACT_PATTERN.match(title) and len(TITLE_WORD_PATTERN.findall(title)) >= 2
+
+
+def _is_child_number(parent: str, child: str) -> bool:
+    return not child or (bool(parent) and child.startswith(parent + '.'))
+
+
+def _nesting_mask(parents: List[str], children: List[str]) -> 'np.ndarray':
+    """Rows whose child number is empty or nested under the parent number."""
+    pairs = [f"{parent}{SEPARATOR}{child}" for parent, child in zip(parents, children)]
+    return _unique_mask(pairs, lambda pair: _is_child_number(*pair.split(SEPARATOR)))
+
+
+def compute_quality_metrics(data: Dict[str, List[str]]) -> Dict:
+    """Compute all metrics from column lists; returns counts, percentages and gate results."""
+    _require_numpy()
+    total = len(data['content'])
+    has_chapter = _lengths(data['chapter_number']) > 0
+    has_section = _lengths(data['section_number']) > 0
+    good_titles = _unique_mask(data['chapter_title'], is_good_chapter_title)
+    title_artifacts = _unique_mask(data['chapter_title'],
+                                   lambda title: bool(TITLE_ARTIFACT_PATTERN.match(title.strip())))
+
+    content = ColumnScanner(data['content'])
+    contaminated = content.count_containing(CONTAMINATION_MARKERS) > 0
+    replacement_chars = content.contains(REPLACEMENT_CHAR)
+    clean = ~(contaminated | replacement_chars)
+
+    # Strict summary criteria: long enough, several medical terms, no contamination and a
+    # definition pattern; the regex only runs on rows that pass the substring checks
+    summary = ColumnScanner(data['summary'])
+    folded_summary = ColumnScanner(data['summary'], lowercase=True)
+    candidates = np.flatnonzero((summary.lengths >= 50)
+                                & (folded_summary.count_containing(MEDICAL_TERMS) >= 2)
+                                & (summary.count_containing(CONTAMINATION_MARKERS) == 0))
+    summaries = data['summary']
+    has_definition = np.fromiter((DEFINITION_PATTERN.search(summaries[row]) is not None
+                                  for row in candidates.tolist()), dtype=bool, count=len(candidates))
+    quality_summaries = np.zeros(total, dtype=bool)
+    quality_summaries[candidates[has_definition]] = True
+
+    # Integrity: section and subsection numbers belong to the row's chapter, chunk numbers are positive
+    section_ok = _nesting_mask(data['chapter_number'], data['section_number'])
+    subsection_ok = _nesting_mask(data['chapter_number'], data['subsection_number'])
+    chunk_ok = _unique_mask(data['chunk_number'], lambda value: value.isdigit() and int(value) > 0)
+    integrity = section_ok & subsection_ok & chunk_ok
+
+    masks = {
+        'chapter_coverage': has_chapter,
+        'section_coverage': has_section,
+        'good_chapter_titles': good_titles,
+        'quality_summaries': quality_summaries,
+        'clean_content': clean,
+        'data_integrity': integrity,
+    }
+    metrics = {}
+    for name, mask in masks.items():
+        count = int(mask.sum())
+        percent = round(100.0 * count / total, 2) if total else 0.0
+        target = QUALITY_TARGETS[name]
+        metrics[name] = {
+            'count': count,
+            'total': total,
+            'percent': percent,
+            'target': target,
+            'passed': None if target is None else percent >= target,
+        }
+
+    return {
+        'version': QUALITY_VERSION,
+        'rows': total,
+        'metrics': metrics,
+        'details': {
+            'chapters': len(set(data['chapter_number']) - {''}),
+            'sections': len(set(data['section_number']) - {''}),
+            'title_artifact_rows': int(title_artifacts.sum()),
+            'contaminated_content_rows': int(contaminated.sum()),
+            'replacement_char_rows': int(replacement_chars.sum()),
+            'soft_hyphen_rows': int(content.contains(SOFT_HYPHEN).sum()),
+            'section_mismatch_rows': int((~section_ok).sum()),
+            'subsection_mismatch_rows': int((~subsection_ok).sum()),
+            'bad_chunk_number_rows': int((~chunk_ok).sum()),
+            'mean_content_chars': round(float(content.lengths.mean()), 1) if total else 0.0,
+            'mean_summary_chars': round(float(summary.lengths.mean()), 1) if total else 0.0,
+        },
+    }
+
+
+def quality_failures(report: Dict) -> List[str]:
+    """Return one message per metric that misses its target."""
+    return [
+        f"{QUALITY_LABELS[name]}: {metric['percent']:.2f}% below target {metric['target']:.2f}%"
+        for name, metric in report['metrics'].items() if metric['passed'] is False
+    ]
+
+
+def format_markdown(report: Dict) -> str:
+    """Render a report as a Markdown table in the layout of QUALITY_REPORT.md."""
+    lines = [
+        '# Nelson Textbook Dataset - Quality Metrics',
+        '',
+        f"**Source**: `{report['source']}`  ",
+        f"**Total Records**: {report['rows']:,}  ",
+        f"**Computed In**: {report['seconds']:.3f}s",
+        '',
+        '| **Metric** | **Target** | **Achieved** | **Records** | **Status** |',
+        '|------------|------------|--------------|-------------|------------|',
+    ]
+    for name, metric in report['metrics'].items():
+        target = f">={metric['target']:.0f}%" if metric['target'] is not None else '-'
+        status = {True: '✅ PASS', False: '❌ FAIL', None: 'ℹ️ INFO'}[metric['passed']]
+        lines.append(f"| **{QUALITY_LABELS[name]}** | {target} | **{metric['percent']:.2f}%** | "
+                     f"{metric['count']:,}/{metric['total']:,} | {status} |")
+    lines += ['', '## Details', '', '| **Measure** | **Value** |', '|-------------|-----------|']
+    for name, value in report['details'].items():
+        lines.append(f"| {name.replace('_', ' ')} | {value:,} |")
+    return '\n'.join(lines) + '\n'
+
+
+def quality_paths_for(path: str) -> tuple:
+    """Return the default JSON and Markdown report paths for an input path."""
+    source = Path(path)
+    stem = source.name.split('.')[0]
+    return (str(source.with_name(f"{stem}.quality.json")), str(source.with_name(f"{stem}.quality.md")))
+
+
+def write_quality_report(path: str, json_file: Optional[str] = None,
+                         markdown_file: Optional[str] = None) -> Dict:
+    """Compute metrics for a dataset file and write the JSON and Markdown reports."""
+    start = time.perf_counter()
+    data = load_columns(path)
+    load_seconds = time.perf_counter() - start
+    report = compute_quality_metrics(data)
+    report['source'] = path
+    report['load_seconds'] = round(load_seconds, 3)
+    report['seconds'] = round(time.perf_counter() - start - load_seconds, 3)
+
+    default_json, default_markdown = quality_paths_for(path)
+    with open(json_file or default_json, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    with open(markdown_file or default_markdown, 'w', encoding='utf-8') as f:
+        f.write(format_markdown(report))
+    logger.info(f"Quality metrics for {report['rows']} rows computed in {report['seconds']:.3f}s "
+                f"(read in {report['load_seconds']:.3f}s)")
+    return report
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(description='Compute dataset quality metrics and gate on their targets.')
+    parser.add_argument('input', help='Structured CSV, .zst, .manifest.json or .parquet file')
+    parser.add_argument('--json', metavar='PATH', help='JSON report path (default: <input stem>.quality.json)')
+    parser.add_argument('--markdown', metavar='PATH', help='Markdown report path (default: <input stem>.quality.md)')
+    parser.add_argument('--no-gate', action='store_true', help='Exit 0 even when a metric misses its target')
+    return parser
+
+
+def main():
+    """Main entry point"""
+    args = create_parser().parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    report = write_quality_report(args.input, args.json, args.markdown)
+    for name, metric in report['metrics'].items():
+        print(f"{QUALITY_LABELS[name]:<22} {metric['percent']:>7.2f}%  ({metric['count']}/{metric['total']})")
+
+    failures = quality_failures(report)
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures and not args.no_gate else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
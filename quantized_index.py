@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Quantized Vector Index
+int8 scalar and 1-bit binary chunk codes with exact rescoring from memory-mapped float32 vectors.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from nelson_retrieval import (QUERY_SET_FILE, HashingEmbedder, VectorIndex, chunk_text, first_relevant_rank,
+                              load_chunks, load_query_set, top_k)
+
+# Optional: NumPy for the codes and the memory-mapped vectors
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATIONS = ('int8', 'binary')
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy not found. Please install with: pip install numpy")
+
+
+def save_vectors(vectors: 'np.ndarray', path: str) -> None:
+    """Write float32 vectors as a .npy file that :func:`open_vectors` can map."""
+    _require_numpy()
+    np.save(path, np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def open_vectors(path: str) -> 'np.ndarray':
+    """Memory-map float32 vectors written by :func:`save_vectors`; pages load on first access."""
+    _require_numpy()
+    return np.load(path, mmap_mode='r')
+
+
+class Int8Codes:
+    """Symmetric per-dimension scalar quantization to int8 (4x smaller than float32).
+
+    numpy has no int8 matrix product, so scans convert blocks of codes to
+    float32; the saving is memory, not arithmetic. Blocks are kept small so
+    the converted buffer stays in cache.
+    """
+
+    kind = 'int8'
+    block_rows = 128
+
+    def __init__(self, vectors: 'np.ndarray'):
+        _require_numpy()
+        peak = np.abs(vectors).max(axis=0) if len(vectors) else np.zeros(vectors.shape[1], dtype=np.float32)
+        self.scale = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        self.codes = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, len(vectors), self.block_rows):
+            block = np.asarray(vectors[start:start + self.block_rows], dtype=np.float32)
+            self.codes[start:start + self.block_rows] = np.rint(block / self.scale)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.scale.nbytes)
+
+    def score(self, query: 'np.ndarray', rows: Optional['np.ndarray'] = None) -> 'np.ndarray':
+        """Approximate inner products of the query with every (or the given) row."""
+        codes = self.codes if rows is None else self.codes[rows]
+        scaled = (query * self.scale).astype(np.float32)
+        scores = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((min(self.block_rows, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), self.block_rows):
+            block = codes[start:start + self.block_rows]
+            converted = buffer[:len(block)]
+            converted[...] = block
+            scores[start:start + len(block)] = converted @ scaled
+        return scores
+
+
+class BinaryCodes:
+    """One sign bit per dimension (32x smaller than float32), compared by Hamming distance.
+
+    Dimensions are centred on their corpus mean before taking the sign, so
+    sparse vectors do not collapse to mostly-zero codes.
+    """
+
+    kind = 'binary'
+
+    def __init__(self, vectors: 'np.ndarray'):
+        _require_numpy()
+        self.dim = vectors.shape[1]
+        self.mean = (np.asarray(vectors, dtype=np.float32).mean(axis=0) if len(vectors)
+                     else np.zeros(self.dim, dtype=np.float32))
+        self.codes = self._pack(np.asarray(vectors, dtype=np.float32) > self.mean)
+
+    def _pack(self, bits: 'np.ndarray') -> 'np.ndarray':
+        packed = np.packbits(bits, axis=-1)
+        # Whole 64-bit words popcount much faster than single bytes
+        if packed.shape[-1] % 8 == 0:
+            packed = packed.view(np.uint64)
+        return packed
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.mean.nbytes)
+
+    def score(self, query: 'np.ndarray', rows: Optional['np.ndarray'] = None) -> 'np.ndarray':
+        """``dim - 2 * hamming``: the inner product of the +/-1 codes, higher is closer."""
+        codes = self.codes if rows is None else self.codes[rows]
+        differing = np.bitwise_xor(codes, self._pack(query > self.mean))
+        if hasattr(np, 'bitwise_count'):
+            hamming = np.bitwise_count(differing).sum(axis=1, dtype=np.int32)
+        else:
+            hamming = np.unpackbits(differing.view(np.uint8), axis=1).sum(axis=1, dtype=np.int32)
+        return self.dim - 2 * hamming
+
+
+QUANTIZERS = {
+    'int8': Int8Codes,
+    'binary': BinaryCodes,
+}
+
+
+class QuantizedIndex:
+    """Searches compact codes for a shortlist, then rescores it with the full-precision vectors.
+
+    Only the codes stay resident; ``vectors`` is usually a memory map from
+    :func:`open_vectors`, of which just the shortlisted rows are read per
+    query. Exposes the same ``search`` and ``vectors`` as :class:`VectorIndex`.
+    """
+
+    def __init__(self, codes, vectors: 'np.ndarray', shortlist: int = 100):
+        self.codes = codes
+        self.vectors = vectors
+        self.shortlist = shortlist
+
+    @classmethod
+    def build(cls, vectors: 'np.ndarray', kind: str, vectors_file: str, shortlist: int = 100) -> 'QuantizedIndex':
+        """Quantize ``vectors``, write them to ``vectors_file`` and map them back for rescoring."""
+        if kind not in QUANTIZERS:
+            raise ValueError(f"Unknown quantization {kind!r}; expected one of {', '.join(QUANTIZERS)}")
+        codes = QUANTIZERS[kind](vectors)
+        save_vectors(vectors, vectors_file)
+        return cls(codes, open_vectors(vectors_file), shortlist)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def nbytes(self) -> int:
+        """Resident bytes: the codes only, the full vectors stay on disk."""
+        return self.codes.nbytes
+
+    def search(self, query: 'np.ndarray', k: int = 10,
+               candidates: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Return the (row indices, exact scores) of the k best chunks among the shortlist."""
+        short, _ = top_k(self.codes.score(query, candidates), max(k, self.shortlist))
+        rows = candidates[short] if candidates is not None else short
+        # Ascending row order turns the rescoring reads into forward scans of the map
+        rows = np.sort(rows)
+        found, scores = top_k(np.asarray(self.vectors[rows], dtype=np.float32) @ query, k)
+        return rows[found], scores
+
+
+def evaluate_index(index, exact: VectorIndex, query_vectors: 'np.ndarray', k: int,
+                   rows: List[Dict], labelled: List[Dict]) -> Dict:
+    """Neighbour recall against exact search, labelled recall and latency for one index.
+
+    A returned chunk counts as a true neighbour when its exact score reaches
+    the exact k-th best score, so duplicate chunks with tied scores are not
+    penalised for coming back in a different order.
+    """
+    latencies = []
+    overlap = 0
+    for query in query_vectors:
+        start = time.perf_counter()
+        found, _ = index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        _, expected = exact.search(query, k)
+        if len(expected):
+            overlap += int(np.count_nonzero(exact.vectors[found] @ query >= expected[-1] - 1e-6))
+
+    hits = 0
+    for query, vector in zip(labelled, query_vectors):
+        found, _ = index.search(vector, k)
+        if first_relevant_rank([rows[i] for i in found.tolist()], query) is not None:
+            hits += 1
+
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {
+        'resident_bytes': index.nbytes,
+        'latency_ms_p50': round(float(np.percentile(latencies_ms, 50)), 3),
+        'latency_ms_p95': round(float(np.percentile(latencies_ms, 95)), 3),
+        f'neighbour_recall_at_{k}': round(overlap / (len(query_vectors) * k), 4) if len(query_vectors) else None,
+        f'recall_at_{k}': round(hits / len(labelled), 4) if labelled else None,
+    }
+
+
+def run_tradeoff(rows: List[Dict], labelled: List[Dict], kinds: List[str], shortlists: List[int],
+                 vectors_file: str, dim: int = 1536, k: int = 10, extra_queries: int = 200) -> Dict:
+    """Compare float32 flat search with every (quantization, shortlist) pair.
+
+    Neighbour recall uses the labelled queries plus ``extra_queries`` section
+    titles drawn evenly from the rows, so it is not limited to 54 queries.
+    """
+    embedder = HashingEmbedder(dim=dim)
+    exact = VectorIndex(embedder.embed([chunk_text(row) for row in rows]))
+    step = max(1, len(rows) // extra_queries) if extra_queries else 0
+    titles = [row['section_title'] or row['chapter_title'] for row in rows[::step]][:extra_queries] if step else []
+    query_vectors = embedder.embed([query['query'] for query in labelled] + titles)
+
+    results = [dict({'quantization': 'float32', 'shortlist': None},
+                    **evaluate_index(exact, exact, query_vectors, k, rows, labelled))]
+    for kind in kinds:
+        start = time.perf_counter()
+        index = QuantizedIndex.build(exact.vectors, kind, vectors_file)
+        build_seconds = time.perf_counter() - start
+        for shortlist in shortlists:
+            index.shortlist = shortlist
+            result = {'quantization': kind, 'shortlist': shortlist, 'build_seconds': round(build_seconds, 3)}
+            result.update(evaluate_index(index, exact, query_vectors, k, rows, labelled))
+            results.append(result)
+    return {'rows': len(rows), 'embedding_dim': dim, 'k': k, 'queries': len(query_vectors),
+            'float32_bytes': exact.nbytes, 'vectors_file_bytes': os.path.getsize(vectors_file) if kinds else None,
+            'results': results}
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(description='Measure memory, latency and recall of quantized chunk vectors.')
+    parser.add_argument('--data', default='nelson_textbook_structured.csv',
+                        help='Structured CSV to index (default: nelson_textbook_structured.csv)')
+    parser.add_argument('--queries', default=QUERY_SET_FILE, help=f'Labelled query set (default: {QUERY_SET_FILE})')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, nargs='+', default=list(QUANTIZATIONS),
+                        help='Quantizations to compare (default: int8 binary)')
+    parser.add_argument('--shortlist', type=int, nargs='+', default=[100, 500, 2000],
+                        help='Shortlist sizes rescored at full precision (default: 100 500 2000)')
+    parser.add_argument('--vectors-file', default='nelson_vectors.npy',
+                        help='Where the full-precision vectors are written and mapped (default: nelson_vectors.npy)')
+    parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension (default: 1536)')
+    parser.add_argument('--k', type=int, default=10, help='Recall cutoff (default: 10)')
+    parser.add_argument('--extra-queries', type=int, default=200,
+                        help='Section titles added as queries for neighbour recall (default: 200)')
+    parser.add_argument('--json', metavar='PATH', help='Also write results as JSON to PATH')
+    return parser
+
+
+def main():
+    """Main entry point"""
+    args = create_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    _require_numpy()
+
+    report = run_tradeoff(load_chunks(args.data), load_query_set(args.queries)['queries'], args.quantization,
+                          args.shortlist, args.vectors_file, dim=args.dim, k=args.k,
+                          extra_queries=args.extra_queries)
+
+    k = args.k
+    print(f"{report['rows']} chunks, {report['queries']} queries, float32 vectors "
+          f"{report['float32_bytes'] / 1e6:.1f} MB")
+    print(f"{'codes':>8} {'shortlist':>9} {'resident MB':>11} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'nn recall':>9} {'recall':>7}")
+    for result in report['results']:
+        print(f"{result['quantization']:>8} {result['shortlist'] or '-':>9} "
+              f"{result['resident_bytes'] / 1e6:>11.2f} {result['latency_ms_p50']:>7.2f} "
+              f"{result['latency_ms_p95']:>7.2f} {result[f'neighbour_recall_at_{k}']:>9.3f} "
+              f"{result[f'recall_at_{k}'] or 0:>7.3f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
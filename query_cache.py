@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Semantic Query Cache
+Serves repeated and reworded queries from recent results within a cosine threshold.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from nelson_retrieval import HashingEmbedder
+
+# Optional: NumPy for the cached query matrix
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy not found. Please install with: pip install numpy")
+
+
+def filters_key(filters: Optional[Dict]) -> str:
+    """Canonical string for a filters dict, so equal filters share cache entries."""
+    return json.dumps(filters or {}, sort_keys=True, default=list)
+
+
+class SemanticQueryCache:
+    """LRU cache of query embeddings and their top-k results, with TTL and dataset versioning.
+
+    A lookup matches the most similar cached query whose cosine similarity
+    reaches ``threshold``, that used the same filters and that asked for at
+    least ``k`` results. Cached query vectors live in one preallocated matrix,
+    so a lookup is a single matrix-vector product. Entries older than
+    ``ttl_seconds`` are dropped on access, and by ``put`` before it evicts a
+    live entry; a different ``dataset_version`` clears the cache.
+    ``max_entries=0`` disables caching.
+    """
+
+    def __init__(self, dim: int, threshold: float = 0.8, max_entries: int = 1024,
+                 ttl_seconds: Optional[float] = 3600.0, dataset_version: Optional[str] = None):
+        _require_numpy()
+        if max_entries < 0:
+            raise ValueError(f"max_entries must be >= 0, got {max_entries}")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.dataset_version = dataset_version
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._active = np.zeros(max_entries, dtype=bool)
+        # slot -> (k, filters key, results, created at); ordered from least to most recently used
+        self._entries: 'OrderedDict[int, tuple]' = OrderedDict()
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, slot: int):
+        del self._entries[slot]
+        self._active[slot] = False
+        self._free.append(slot)
+
+    def _drop_expired(self, now: float):
+        for slot, (_, _, _, created) in list(self._entries.items()):
+            if now - created > self.ttl_seconds:
+                self._drop(slot)
+                self.expirations += 1
+
+    def set_dataset_version(self, version: Optional[str]):
+        """Clear the cache when the dataset it was filled from changes."""
+        with self._lock:
+            if version != self.dataset_version:
+                for slot in list(self._entries):
+                    self._drop(slot)
+                self.dataset_version = version
+                self.invalidations += 1
+
+    def get(self, query: 'np.ndarray', k: int, filters: Optional[Dict] = None) -> Optional[List[Dict]]:
+        """Return cached results for a normalised query vector, or None on a miss."""
+        key = filters_key(filters)
+        now = time.monotonic()
+        with self._lock:
+            if self._entries:
+                scores = self._vectors @ query
+                scores[~self._active] = -np.inf
+                matches = np.flatnonzero(scores >= self.threshold)
+                for slot in matches[np.argsort(-scores[matches])].tolist():
+                    cached_k, cached_key, results, created = self._entries[slot]
+                    if self.ttl_seconds is not None and now - created > self.ttl_seconds:
+                        self._drop(slot)
+                        self.expirations += 1
+                        continue
+                    if cached_key == key and cached_k >= k:
+                        self._entries.move_to_end(slot)
+                        self.hits += 1
+                        return results[:k]
+            self.misses += 1
+            return None
+
+    def put(self, query: 'np.ndarray', k: int, filters: Optional[Dict], results: List[Dict]):
+        """Store the results for a query; when full, drop expired entries, then the least recently used."""
+        if not self.max_entries:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not self._free and self.ttl_seconds is not None:
+                self._drop_expired(now)
+            if not self._free:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            slot = self._free.pop()
+            self._vectors[slot] = query
+            self._active[slot] = True
+            self._entries[slot] = (k, filters_key(filters), list(results), now)
+
+    def metrics(self) -> Dict:
+        """Counters plus the hit rate."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+class CachedBackend:
+    """Puts a :class:`SemanticQueryCache` in front of any retrieval backend.
+
+    Queries are embedded once with the backend's own embedder (or
+    ``embedder`` for backends without one, such as BM25); on a miss a
+    backend with ``search_vector`` reuses that embedding. Time saved is the
+    mean miss latency minus the mean hit latency, times the number of hits.
+    """
+
+    def __init__(self, backend, cache: SemanticQueryCache, embedder: Optional[HashingEmbedder] = None):
+        self.backend = backend
+        self.cache = cache
+        self.embedder = embedder or getattr(backend, 'embedder', None) or HashingEmbedder()
+        self.name = f"{backend.name}+cache"
+        self._lock = threading.Lock()
+        self._hit_seconds = 0.0
+        self._miss_seconds = 0.0
+
+    @property
+    def nbytes(self) -> Optional[int]:
+        return getattr(self.backend, 'nbytes', None)
+
+    def search(self, query: str, k: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+        """Return cached results for a close enough earlier query, otherwise search and cache."""
+        start = time.perf_counter()
+        vector = self.embedder.embed([query])[0]
+        results = self.cache.get(vector, k, filters)
+        if results is not None:
+            with self._lock:
+                self._hit_seconds += time.perf_counter() - start
+            return results
+
+        if hasattr(self.backend, 'search_vector'):
+            results = self.backend.search_vector(vector, k, filters)
+        elif filters:
+            results = self.backend.search(query, k, filters)
+        else:
+            results = self.backend.search(query, k)
+        self.cache.put(vector, k, filters, results)
+        with self._lock:
+            self._miss_seconds += time.perf_counter() - start
+        return results
+
+    def metrics(self) -> Dict:
+        """Cache counters plus mean hit/miss latency and the estimated time saved."""
+        metrics = self.cache.metrics()
+        hits, misses = metrics['hits'], metrics['misses']
+        hit_ms = self._hit_seconds / hits * 1000.0 if hits else None
+        miss_ms = self._miss_seconds / misses * 1000.0 if misses else None
+        metrics['mean_hit_ms'] = round(hit_ms, 3) if hit_ms is not None else None
+        metrics['mean_miss_ms'] = round(miss_ms, 3) if miss_ms is not None else None
+        metrics['saved_ms'] = round(hits * (miss_ms - hit_ms), 1) if hits and misses else 0.0
+        return metrics
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Retrieval Benchmark
+Runs the labelled query set against a retrieval backend and reports recall, MRR, latency and QPS.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+from nelson_dataset import file_sha256
+from nelson_retrieval import (QUERY_SET_FILE, SEARCH_MODES, HashingEmbedder, InProcessBackend, LexicalBackend,
+                              first_relevant_rank, load_chapter_books, load_chunks, load_query_set)
+from quantized_index import QUANTIZATIONS, QuantizedIndex
+from query_cache import CachedBackend, SemanticQueryCache
+
+# Optional: NumPy for latency percentiles
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Optional: psycopg for the pgvector backend
+try:
+    import psycopg
+    from psycopg import sql
+except ImportError:
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_VERSION = 1
+
+
+class PrecomputedQueryEmbedder:
+    """Query vectors computed ahead of time by the model behind a table's stored embeddings.
+
+    ``vectors_file`` is a .npy matrix with one row per query of the query set,
+    in query set order. :meth:`embed` looks texts up instead of embedding them,
+    so the benchmark can query e.g. text-embedding-ada-002 vectors offline.
+    """
+
+    def __init__(self, queries: List[Dict], vectors_file: str):
+        if np is None:
+            raise ImportError("numpy not found. Please install with: pip install numpy")
+        vectors = np.load(vectors_file)
+        if vectors.ndim != 2 or len(vectors) != len(queries):
+            raise ValueError(f"{vectors_file} must hold one vector per query ({len(queries)}), "
+                             f"got shape {vectors.shape}")
+        self.dim = vectors.shape[1]
+        self._vectors = {query['query']: vector for query, vector in zip(queries, vectors.astype(np.float32))}
+
+    def embed(self, texts: Sequence[str]) -> 'np.ndarray':
+        """Return the stored vectors for ``texts``, which must all be queries of the query set."""
+        missing = [text for text in texts if text not in self._vectors]
+        if missing:
+            raise KeyError(f"No precomputed vector for query {missing[0]!r}")
+        return np.stack([self._vectors[text] for text in texts])
+
+
+class PgvectorBackend:
+    """Cosine-distance search against the nelson_textbook table in Postgres.
+
+    Queries are embedded locally with ``embedder``, which must come from the
+    same model as the stored embeddings: a :class:`PrecomputedQueryEmbedder`
+    for model embeddings such as text-embedding-ada-002, or a HashingEmbedder
+    for a table filled with hashed embeddings. Each worker thread uses its own
+    connection.
+    """
+
+    name = 'pgvector'
+
+    def __init__(self, dsn: str, embedder, table: str = 'nelson_textbook'):
+        if psycopg is None:
+            raise ImportError("psycopg not found. Please install with: pip install 'psycopg[binary]'")
+        self.dsn = dsn
+        self.embedder = embedder
+        self.table = sql.Identifier(table)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = psycopg.connect(self.dsn, autocommit=True)
+            self._local.connection = connection
+        return connection
+
+    def search(self, query: str, k: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+        """Return the k nearest rows for a query, optionally restricted to chapters or a chapter range."""
+        vector = '[' + ','.join(f"{value:.6f}" for value in self.embedder.embed([query])[0]) + ']'
+        conditions, params = [], []
+        for key, value in (filters or {}).items():
+            if key == 'chapters':
+                conditions.append(sql.SQL("chapter_number = ANY(%s)"))
+                params.append(list(value))
+            elif key == 'chapter_range':
+                conditions.append(sql.SQL("chapter_number ~ '^[0-9]+$' AND chapter_number::int BETWEEN %s AND %s"))
+                params.extend(value)
+            else:
+                raise ValueError(f"The pgvector backend does not support the {key!r} filter")
+        where = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+        statement = sql.SQL(
+            "SELECT chapter_number, section_number, chunk_number FROM {}{} "
+            "ORDER BY embedding <=> %s::vector LIMIT %s"
+        ).format(self.table, where)
+        with self._connection().cursor() as cursor:
+            cursor.execute(statement, params + [vector, k])
+            return [{'chapter_number': chapter, 'section_number': section, 'chunk_number': chunk}
+                    for chapter, section, chunk in cursor.fetchall()]
+
+
+def percentiles(seconds: Sequence[float]) -> Dict:
+    """Return p50/p95/p99 and mean latency in milliseconds."""
+    if not seconds:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None}
+    values = np.asarray(seconds) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3), 'mean_ms': round(float(values.mean()), 3)}
+
+
+def chapter_window(query: Dict, window: Optional[int]) -> Optional[Dict]:
+    """Filter to chapters within ``window`` of the query's first expected chapter (None = unfiltered).
+
+    Stands in for the chapter or section scoping a caller would pass from its UI.
+    """
+    if window is None:
+        return None
+    chapter = next((int(chapter) for chapter in query['expected_chapters'] if chapter.isdigit()), None)
+    if chapter is None:
+        return None
+    return {'chapter_range': (chapter - window, chapter + window)}
+
+
+def evaluate_quality(backend, queries: List[Dict], ks: List[int], window: Optional[int] = None) -> Dict:
+    """Run every query once; report recall@k, MRR and sequential latency."""
+    depth = max(ks)
+    per_query = []
+    latencies = []
+    for query in queries:
+        filters = chapter_window(query, window)
+        start = time.perf_counter()
+        hits = backend.search(query['query'], depth, filters) if filters else backend.search(query['query'], depth)
+        latencies.append(time.perf_counter() - start)
+        per_query.append({
+            'id': query['id'],
+            'chapter_rank': first_relevant_rank(hits, query, 'chapter'),
+            'section_rank': first_relevant_rank(hits, query, 'section') if query.get('expected_sections') else None,
+            'seconds': round(latencies[-1], 6),
+        })
+
+    sectioned = [result for query, result in zip(queries, per_query) if query.get('expected_sections')]
+    quality = {'queries': len(per_query), 'queries_with_sections': len(sectioned)}
+    for k in ks:
+        quality[f'recall_at_{k}'] = _recall(per_query, 'chapter_rank', k)
+        quality[f'section_recall_at_{k}'] = _recall(sectioned, 'section_rank', k)
+    quality['mrr'] = round(sum(1.0 / result['chapter_rank'] for result in per_query
+                               if result['chapter_rank']) / len(per_query), 4) if per_query else None
+    return {'quality': quality, 'latency': percentiles(latencies), 'per_query': per_query}
+
+
+def _recall(results: List[Dict], field: str, k: int) -> Optional[float]:
+    if not results:
+        return None
+    return round(sum(1 for result in results if result[field] and result[field] <= k) / len(results), 4)
+
+
+def measure_throughput(backend, queries: List[Dict], concurrency: int, repeat: int, k: int,
+                       window: Optional[int] = None) -> Dict:
+    """Issue ``repeat`` passes over the query set from ``concurrency`` threads; report QPS and latency."""
+    texts = [(query['query'], chapter_window(query, window)) for query in queries] * repeat
+
+    def timed_search(request) -> float:
+        text, filters = request
+        start = time.perf_counter()
+        if filters:
+            backend.search(text, k, filters)
+        else:
+            backend.search(text, k)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed_search, texts))
+    elapsed = time.perf_counter() - start
+
+    result = {'concurrency': concurrency, 'requests': len(texts),
+              'qps': round(len(texts) / elapsed, 2) if elapsed else None}
+    result.update(percentiles(latencies))
+    return result
+
+
+def create_backend(name: str, rows: List[Dict], dim: int, dsn: Optional[str] = None,
+                   table: str = 'nelson_textbook', chapter_books: Optional[Dict[str, List[str]]] = None,
+                   mode: str = 'flat', top_chapters: int = 8, top_sections: Optional[int] = None,
+                   quantization: Optional[str] = None, shortlist: int = 100,
+                   vectors_file: str = 'nelson_vectors.npy', query_embedder=None):
+    """Create a backend by name: vector, lexical or pgvector.
+
+    With ``quantization`` the vector backend keeps only int8 or binary codes
+    in memory and rescores a shortlist from ``vectors_file``. The pgvector
+    backend needs a ``query_embedder`` matching the table's embeddings.
+    """
+    if (mode != 'flat' or quantization) and name != 'vector':
+        raise ValueError("--mode and --quantization need the vector backend")
+    if name == 'vector':
+        backend = InProcessBackend(rows, HashingEmbedder(dim=dim), chapter_books=chapter_books, mode=mode,
+                                   top_chapters=top_chapters, top_sections=top_sections)
+        if quantization:
+            backend.index = QuantizedIndex.build(backend.index.vectors, quantization, vectors_file, shortlist)
+        return backend
+    if name == 'lexical':
+        return LexicalBackend(rows, chapter_books=chapter_books)
+    if name == 'pgvector':
+        if not dsn:
+            raise ValueError("The pgvector backend needs --dsn")
+        if query_embedder is None:
+            raise ValueError("The pgvector backend needs query vectors from the model behind the table's "
+                             "embeddings (--query-vectors), or --hashed-table if the table holds hashed embeddings")
+        return PgvectorBackend(dsn, query_embedder, table=table)
+    raise ValueError(f"Unknown backend {name!r}; expected vector, lexical or pgvector")
+
+
+def run_benchmark(backend, queries: List[Dict], ks: List[int], concurrency: List[int], repeat: int,
+                  window: Optional[int] = None) -> Dict:
+    """Quality pass followed by one throughput pass per concurrency level.
+
+    With ``window`` the same passes are repeated with a chapter-range filter
+    per query and reported under ``filtered``.
+    """
+    report = evaluate_quality(backend, queries, ks)
+    report['throughput'] = [measure_throughput(backend, queries, threads, repeat, max(ks))
+                            for threads in concurrency]
+    if window is not None:
+        filtered = evaluate_quality(backend, queries, ks, window)
+        filtered['chapter_window'] = window
+        filtered['throughput'] = [measure_throughput(backend, queries, threads, repeat, max(ks), window)
+                                  for threads in concurrency]
+        report['filtered'] = filtered
+    return report
+
+
+def compare_with_flat(backend, queries: List[Dict], ks: List[int]) -> Dict:
+    """Run the quality pass once more in flat mode on the same backend, for a two-stage run."""
+    mode = backend.mode
+    backend.mode = 'flat'
+    try:
+        flat = evaluate_quality(backend, queries, ks)
+    finally:
+        backend.mode = mode
+    return {'quality': flat['quality'], 'latency': flat['latency']}
+
+
+def compare_reports(current: Dict, baseline: Dict) -> List[str]:
+    """Describe changes in the headline numbers against an earlier report."""
+    lines = []
+    keys = [('quality', key) for key in current.get('quality', {}) if key.startswith('recall_at_')]
+    for section, key in keys + [('quality', 'mrr'), ('latency', 'p95_ms')]:
+        before, after = baseline.get(section, {}).get(key), current.get(section, {}).get(key)
+        if before is not None and after is not None:
+            lines.append(f"{section}.{key}: {before} -> {after} ({after - before:+.4f})")
+    before = {row['concurrency']: row['qps'] for row in baseline.get('throughput', [])}
+    for row in current.get('throughput', []):
+        if before.get(row['concurrency']) is not None and row['qps'] is not None:
+            lines.append(f"qps@{row['concurrency']}: {before[row['concurrency']]} -> {row['qps']}")
+    if baseline.get('query_set_sha256') != current.get('query_set_sha256'):
+        lines.append("warning: the query set differs from the baseline run")
+    return lines
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command line parser."""
+    parser = argparse.ArgumentParser(description='Benchmark retrieval quality and speed on the labelled query set.')
+    parser.add_argument('--backend', choices=['vector', 'lexical', 'pgvector'], default='vector',
+                        help='Retrieval backend (default: vector, in-process)')
+    parser.add_argument('--data', default='nelson_textbook_structured.csv',
+                        help='Structured CSV for in-process backends (default: nelson_textbook_structured.csv)')
+    parser.add_argument('--queries', default=QUERY_SET_FILE, help=f'Labelled query set (default: {QUERY_SET_FILE})')
+    parser.add_argument('--dsn', help='Postgres connection string for the pgvector backend')
+    parser.add_argument('--table', default='nelson_textbook', help='Table for the pgvector backend')
+    parser.add_argument('--query-vectors', metavar='PATH',
+                        help='.npy matrix with one vector per query (query set order) from the model that produced '
+                             'the pgvector table\'s embeddings')
+    parser.add_argument('--hashed-table', action='store_true',
+                        help='The pgvector table holds hashed embeddings (--dim), so queries can be embedded the same way')
+    parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension (default: 1536)')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 5, 10], help='Recall cutoffs (default: 1 5 10)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8],
+                        help='Thread counts for the throughput passes (default: 1 4 8)')
+    parser.add_argument('--repeat', type=int, default=5, help='Query set passes per throughput run (default: 5)')
+    parser.add_argument('--mode', choices=SEARCH_MODES, default='flat',
+                        help='Vector search mode: flat, or hierarchical (chapter centroids first); '
+                             'hierarchical runs are also compared against flat search (default: flat)')
+    parser.add_argument('--top-chapters', type=int, default=8,
+                        help='Chapters searched in hierarchical mode (default: 8)')
+    parser.add_argument('--top-sections', type=int,
+                        help='Also narrow hierarchical search to this many sections of those chapters')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS,
+                        help='Keep int8 or binary codes in memory and rescore a shortlist at full precision')
+    parser.add_argument('--shortlist', type=int, default=100,
+                        help='Rows rescored at full precision with --quantization (default: 100)')
+    parser.add_argument('--vectors-file', default='nelson_vectors.npy',
+                        help='Memory-mapped full-precision vectors for --quantization (default: nelson_vectors.npy)')
+    parser.add_argument('--cache', type=float, metavar='THRESHOLD', nargs='?', const=0.8,
+                        help='Put a semantic query cache in front of the backend, matching cached queries '
+                             'at cosine >= THRESHOLD (default threshold: 0.8)')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Cached queries kept (default: 1024, 0 disables the cache)')
+    parser.add_argument('--cache-ttl', type=float, default=3600.0, help='Cache entry lifetime in seconds (default: 3600)')
+    parser.add_argument('--filtered', type=int, metavar='WINDOW', nargs='?', const=25,
+                        help='Also run every query filtered to chapters within WINDOW of its expected chapter '
+                             '(default window: 25)')
+    parser.add_argument('--toc', metavar='PATH',
+                        help='TOC JSON from --structure-only, used to build per-book filters')
+    parser.add_argument('--output', default='retrieval_benchmark.json', help='JSON results path')
+    parser.add_argument('--baseline', metavar='PATH', help='Earlier results JSON to compare against')
+    return parser
+
+
+def main():
+    """Main entry point"""
+    args = create_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    if np is None:
+        raise ImportError("numpy not found. Please install with: pip install numpy")
+
+    query_set = load_query_set(args.queries)
+    rows = load_chunks(args.data) if args.backend != 'pgvector' else []
+
+    query_embedder = None
+    if args.query_vectors:
+        query_embedder = PrecomputedQueryEmbedder(query_set['queries'], args.query_vectors)
+    elif args.hashed_table:
+        query_embedder = HashingEmbedder(dim=args.dim)
+
+    start = time.perf_counter()
+    chapter_books = load_chapter_books(args.toc) if args.toc else None
+    backend = create_backend(args.backend, rows, args.dim, dsn=args.dsn, table=args.table,
+                             chapter_books=chapter_books, mode=args.mode, top_chapters=args.top_chapters,
+                             top_sections=args.top_sections, quantization=args.quantization,
+                             shortlist=args.shortlist, vectors_file=args.vectors_file,
+                             query_embedder=query_embedder)
+    if args.mode == 'hierarchical':
+        backend.build_hierarchy()
+    if args.cache is not None:
+        dataset_version = file_sha256(args.data) if args.backend != 'pgvector' else args.table
+        cache = SemanticQueryCache(args.dim, threshold=args.cache, max_entries=args.cache_size,
+                                   ttl_seconds=args.cache_ttl, dataset_version=dataset_version)
+        backend = CachedBackend(backend, cache, HashingEmbedder(dim=args.dim))
+    build_seconds = time.perf_counter() - start
+
+    report = {
+        'benchmark_version': BENCHMARK_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'backend': backend.name,
+        'data': args.data if args.backend != 'pgvector' else args.table,
+        'rows': len(rows),
+        'query_set': args.queries,
+        'query_set_version': query_set['version'],
+        'query_set_sha256': file_sha256(args.queries),
+        'embedding_dim': args.dim,
+        'query_vectors': args.query_vectors if args.backend == 'pgvector' else None,
+        'mode': args.mode,
+        'quantization': args.quantization,
+        'shortlist': args.shortlist if args.quantization else None,
+        'build_seconds': round(build_seconds, 3),
+        'index_bytes': getattr(backend, 'nbytes', None),
+    }
+    if args.mode == 'hierarchical':
+        report['top_chapters'] = args.top_chapters
+        report['top_sections'] = args.top_sections
+    report.update(run_benchmark(backend, query_set['queries'], sorted(args.k), args.concurrency, args.repeat,
+                                window=args.filtered))
+    if args.mode == 'hierarchical':
+        report['flat'] = compare_with_flat(getattr(backend, 'backend', backend), query_set['queries'], sorted(args.k))
+    if args.cache is not None:
+        report['cache'] = dict(backend.metrics(), threshold=args.cache)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    quality = report['quality']
+    print(f"{report['backend']} ({report['mode']}): {quality['queries']} queries, "
+          f"build {report['build_seconds']:.2f}s")
+    for k in sorted(args.k):
+        print(f"  recall@{k}: {quality[f'recall_at_{k}']}  section recall@{k}: {quality[f'section_recall_at_{k}']}")
+    print(f"  MRR: {quality['mrr']}  latency p50/p95/p99: {report['latency']['p50_ms']}/"
+          f"{report['latency']['p95_ms']}/{report['latency']['p99_ms']} ms")
+    for row in report['throughput']:
+        print(f"  concurrency {row['concurrency']}: {row['qps']} QPS, p95 {row['p95_ms']} ms")
+    if 'cache' in report:
+        cache = report['cache']
+        print(f"  cache: hit rate {cache['hit_rate']}, mean hit/miss {cache['mean_hit_ms']}/{cache['mean_miss_ms']} ms, "
+              f"saved {cache['saved_ms']} ms")
+    if 'flat' in report:
+        flat = report['flat']
+        for k in sorted(args.k):
+            print(f"  flat recall@{k}: {flat['quality'][f'recall_at_{k}']}  "
+                  f"section recall@{k}: {flat['quality'][f'section_recall_at_{k}']}")
+        print(f"  flat MRR: {flat['quality']['mrr']}  latency p50/p95/p99: {flat['latency']['p50_ms']}/"
+              f"{flat['latency']['p95_ms']}/{flat['latency']['p99_ms']} ms")
+    if 'filtered' in report:
+        filtered = report['filtered']
+        print(f"  filtered (chapters +/-{filtered['chapter_window']}): "
+              f"recall@{max(args.k)} {filtered['quality'][f'recall_at_{max(args.k)}']}, "
+              f"MRR {filtered['quality']['mrr']}, latency p50/p95: "
+              f"{filtered['latency']['p50_ms']}/{filtered['latency']['p95_ms']} ms")
+        for row in filtered['throughput']:
+            print(f"    concurrency {row['concurrency']}: {row['qps']} QPS, p95 {row['p95_ms']} ms")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            for line in compare_reports(report, json.load(f)):
+                print(f"  {line}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Batch TF-IDF Extractive Summarizer
+Scores every sentence of every chunk in a chapter with one sparse TF-IDF pass.
+"""
+
+import re
+from typing import List
+
+# Optional: NumPy for the vectorized scoring
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SENTENCE_SPLIT = re.compile(r'[.!?]+')
+WORD_PATTERN = re.compile(r'[a-z][a-z0-9\-]+')
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further had
+has have having he her here hers herself him himself his how i if in into is it its itself just
+may me might more most must my myself no nor not now of off on once only or other our ours
+ourselves out over own same she should so some such than that the their theirs them themselves
+then there these they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves however thus often
+usually including include includes see fig figure table chapter
+""".split())
+
+
+class TfidfSummarizer:
+    """Extractive summaries for a batch of chunks from sparse TF-IDF statistics.
+
+    All chunks of a chapter are treated as the document collection. Each
+    sentence is scored by cosine similarity between its TF-IDF vector and its
+    chunk's TF-IDF centroid, with a small lead bonus, and the best sentences of
+    every chunk are picked in one vectorized pass.
+    """
+
+    def __init__(self, max_sentences: int = 2, max_chars: int = 250,
+                 min_sentence_chars: int = 30, max_sentence_chars: int = 250,
+                 lead_weight: float = 0.1):
+        if np is None:
+            raise ImportError("numpy not found. Please install with: pip install numpy")
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+        self.min_sentence_chars = min_sentence_chars
+        self.max_sentence_chars = max_sentence_chars
+        self.lead_weight = lead_weight
+
+    def split_sentences(self, content: str) -> List[str]:
+        """Split content the same way generate_enhanced_summary does."""
+        return [s.strip() for s in SENTENCE_SPLIT.split(content) if len(s.strip()) > 10]
+
+    def summarize_batch(self, contents: List[str]) -> List[str]:
+        """Return one summary per content string."""
+        summaries = [content if len(content) < 100 else '' for content in contents]
+
+        sentences: List[str] = []
+        chunk_ids: List[int] = []
+        positions: List[int] = []
+        for chunk_id, content in enumerate(contents):
+            if summaries[chunk_id]:
+                continue
+            chunk_sentences = self.split_sentences(content)
+            if not chunk_sentences:
+                summaries[chunk_id] = content[:200].strip()
+                continue
+            sentences.extend(chunk_sentences)
+            chunk_ids.extend([chunk_id] * len(chunk_sentences))
+            positions.extend(range(len(chunk_sentences)))
+        if not sentences:
+            return summaries
+
+        # Sparse sentence-term matrix in COO form
+        vocabulary = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        for sentence_id, sentence in enumerate(sentences):
+            for word in WORD_PATTERN.findall(sentence.lower()):
+                if word in STOPWORDS:
+                    continue
+                rows.append(sentence_id)
+                cols.append(vocabulary.setdefault(word, len(vocabulary)))
+
+        n_sentences = len(sentences)
+        n_terms = max(len(vocabulary), 1)
+        sentence_chunk = np.asarray(chunk_ids, dtype=np.int64)
+        scores = np.zeros(n_sentences)
+
+        if rows:
+            row_arr = np.asarray(rows, dtype=np.int64)
+            col_arr = np.asarray(cols, dtype=np.int64)
+            keys, counts = np.unique(row_arr * n_terms + col_arr, return_counts=True)
+            entry_sentence = keys // n_terms
+            entry_term = keys % n_terms
+            entry_chunk = sentence_chunk[entry_sentence]
+
+            # Document frequency over chunks, smoothed idf
+            chunk_terms = np.unique(entry_chunk * n_terms + entry_term)
+            df = np.bincount(chunk_terms % n_terms, minlength=n_terms)
+            n_docs = len(np.unique(sentence_chunk))
+            idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+
+            weights = (1.0 + np.log(counts)) * idf[entry_term]
+            sentence_norm = np.sqrt(np.bincount(entry_sentence, weights ** 2, minlength=n_sentences))
+
+            # Chunk centroids share the (chunk, term) key space
+            chunk_keys, inverse = np.unique(entry_chunk * n_terms + entry_term, return_inverse=True)
+            centroid = np.bincount(inverse, weights)
+            chunk_norm = np.sqrt(np.bincount(chunk_keys // n_terms, centroid ** 2,
+                                             minlength=len(contents)))
+
+            dot = np.bincount(entry_sentence, weights * centroid[inverse], minlength=n_sentences)
+            denominator = sentence_norm * chunk_norm[sentence_chunk]
+            np.divide(dot, denominator, out=scores, where=denominator > 0)
+
+        position_arr = np.asarray(positions, dtype=np.float64)
+        scores *= 1.0 + self.lead_weight / (1.0 + position_arr)
+        lengths = np.fromiter((len(s) for s in sentences), dtype=np.int64, count=n_sentences)
+        out_of_range = (lengths < self.min_sentence_chars) | (lengths > self.max_sentence_chars)
+        scores[out_of_range] -= 2.0
+
+        # Rank sentences within each chunk and keep the top few
+        order = np.lexsort((-scores, sentence_chunk))
+        ordered_chunks = sentence_chunk[order]
+        group_start = np.searchsorted(ordered_chunks, ordered_chunks, side='left')
+        rank = np.arange(n_sentences) - group_start
+        selected = order[rank < self.max_sentences]
+
+        picked = {}
+        for sentence_id in selected.tolist():
+            picked.setdefault(chunk_ids[sentence_id], []).append(sentence_id)
+        for chunk_id, sentence_ids in picked.items():
+            summary_ids = [sentence_ids[0]]
+            total = lengths[sentence_ids[0]]
+            for sentence_id in sentence_ids[1:]:
+                if scores[sentence_id] > 0 and total + lengths[sentence_id] + 2 <= self.max_chars:
+                    summary_ids.append(sentence_id)
+                    total += lengths[sentence_id] + 2
+            summary_ids.sort(key=lambda i: positions[i])
+            summaries[chunk_id] = '. '.join(sentences[i][:self.max_sentence_chars] for i in summary_ids)
+
+        return summaries
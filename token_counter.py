@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Nelson Textbook of Pediatrics - Pluggable Token Counters
+Heuristic, whitespace and BPE token counting with batched, LRU-cached lookups.
+"""
+
+import re
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional
+
+# Optional: tiktoken for BPE token counting
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Optional: HuggingFace tokenizers for a local tokenizer.json
+try:
+    import tokenizers
+except ImportError:
+    tokenizers = None
+
+
+class TokenCounter(metaclass=ABCMeta):
+    """Base class: counts tokens for batches of texts through an LRU cache.
+
+    Subclasses implement :meth:`_count_batch` for the texts that miss the cache.
+    """
+
+    name = 'base'
+
+    def __init__(self, cache_size: int = 65536):
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, int]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def _count_batch(self, texts: List[str]) -> List[int]:
+        """Count the tokens of texts that missed the cache."""
+        ...
+
+    def count(self, text: str) -> int:
+        """Return the token count of one text."""
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """Return token counts for many texts, computing cache misses in one batch."""
+        if not self.cache_size:
+            return self._count_batch(texts)
+
+        cache = self._cache
+        counts: List[Optional[int]] = [None] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            cached = cache.get(text)
+            if cached is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                cache.move_to_end(text)
+                counts[i] = cached
+        self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+
+        if missing:
+            unique = list(missing)
+            self.misses += len(unique)
+            for text, value in zip(unique, self._count_batch(unique)):
+                for i in missing[text]:
+                    counts[i] = value
+                cache[text] = value
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+        return counts
+
+
+class HeuristicTokenCounter(TokenCounter):
+    """The original estimate: one token per three characters."""
+
+    name = 'heuristic'
+
+    def __init__(self, chars_per_token: int = 3):
+        # Cheaper to recompute than to look up
+        super().__init__(cache_size=0)
+        self.chars_per_token = chars_per_token
+
+    def _count_batch(self, texts: List[str]) -> List[int]:
+        return [len(text) // self.chars_per_token for text in texts]
+
+
+class WhitespaceTokenCounter(TokenCounter):
+    """Counts words and punctuation marks, a close proxy for word-level models."""
+
+    name = 'whitespace'
+    token_pattern = re.compile(r'\w+|[^\w\s]')
+
+    def _count_batch(self, texts: List[str]) -> List[int]:
+        findall = self.token_pattern.findall
+        return [len(findall(text)) for text in texts]
+
+
+class BPETokenCounter(TokenCounter):
+    """Exact counts from a local BPE tokenizer.
+
+    Uses a ``tokenizer.json`` through HuggingFace ``tokenizers`` when
+    ``tokenizer_file`` is given, otherwise the tiktoken encoding
+    ``encoding_name`` (cl100k_base matches the 1536-d OpenAI embedding models).
+    """
+
+    name = 'bpe'
+
+    def __init__(self, encoding_name: str = 'cl100k_base', tokenizer_file: Optional[str] = None,
+                 cache_size: int = 65536):
+        super().__init__(cache_size=cache_size)
+        self._tokenizer = None
+        self._encoding = None
+        if tokenizer_file:
+            if tokenizers is None:
+                raise ImportError("tokenizers not found. Please install with: pip install tokenizers")
+            self._tokenizer = tokenizers.Tokenizer.from_file(tokenizer_file)
+        else:
+            if tiktoken is None:
+                raise ImportError("tiktoken not found. Please install with: pip install tiktoken")
+            self._encoding = tiktoken.get_encoding(encoding_name)
+
+    def _count_batch(self, texts: List[str]) -> List[int]:
+        if self._tokenizer is not None:
+            encodings = self._tokenizer.encode_batch(texts, add_special_tokens=False)
+            return [len(encoding.ids) for encoding in encodings]
+        return [len(tokens) for tokens in self._encoding.encode_ordinary_batch(texts)]
+
+
+TOKEN_COUNTERS = {
+    'heuristic': HeuristicTokenCounter,
+    'whitespace': WhitespaceTokenCounter,
+    'bpe': BPETokenCounter,
+}
+
+
+def create_token_counter(name: str = 'heuristic', **kwargs) -> TokenCounter:
+    """Create a token counter by name: heuristic, whitespace or bpe."""
+    if name not in TOKEN_COUNTERS:
+        raise ValueError(f"Unknown token counter {name!r}; expected one of {', '.join(TOKEN_COUNTERS)}")
+    return TOKEN_COUNTERS[name](**kwargs)